@@ -0,0 +1,132 @@
+"""Broadcast backplanes that carry websocket messages between workers.
+
+Each worker's ConnectionManager delivers to its own sockets and publishes
+the message on the backplane so other workers can deliver to theirs. A
+worker only subscribes to documents it has local connections for, so
+messages are routed only to nodes that need them.
+"""
+from typing import Awaitable, Callable, Optional
+import asyncio
+import json
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[str, str], Awaitable[None]]
+
+class Backplane:
+    """Base class; the default behaviour suits a single worker"""
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self.deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        """deliver(doc_id, message) is called for messages from other nodes"""
+        self.deliver = deliver
+
+    async def stop(self):
+        pass
+
+    async def subscribe(self, doc_id: str):
+        pass
+
+    async def unsubscribe(self, doc_id: str):
+        pass
+
+    async def publish(self, doc_id: str, message: str):
+        pass
+
+class InProcessBackplane(Backplane):
+    """Single worker: local fan-out already reaches every subscriber"""
+
+class RedisBackplane(Backplane):
+    """Redis pub/sub with one channel per document"""
+
+    def __init__(self, url: str, channel_prefix: str = "realdoc:doc:"):
+        super().__init__()
+        self.url = url
+        self.channel_prefix = channel_prefix
+        self._redis = None
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    async def start(self, deliver: Deliver):
+        import redis.asyncio as redis
+
+        await super().start(deliver)
+        self._redis = redis.from_url(self.url)
+        self._pubsub = self._redis.pubsub()
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def stop(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        if self._redis is not None:
+            await self._redis.aclose()
+
+    async def subscribe(self, doc_id: str):
+        await self._pubsub.subscribe(self.channel_prefix + doc_id)
+        self._subscribed.set()
+
+    async def unsubscribe(self, doc_id: str):
+        await self._pubsub.unsubscribe(self.channel_prefix + doc_id)
+
+    async def publish(self, doc_id: str, message: str):
+        envelope = json.dumps({"o": self.node_id, "m": message})
+        await self._redis.publish(self.channel_prefix + doc_id, envelope)
+
+    async def _read_loop(self):
+        prefix_length = len(self.channel_prefix)
+        while True:
+            if not self._pubsub.subscribed:
+                self._subscribed.clear()
+                await self._subscribed.wait()
+            try:
+                item = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception as e:
+                logger.error(f"Backplane receive failed: {str(e)}")
+                await asyncio.sleep(1.0)
+                continue
+            if item is None or item.get("type") != "message":
+                continue
+            channel = item["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            try:
+                envelope = json.loads(item["data"])
+                origin, message = envelope["o"], envelope["m"]
+            except Exception as e:
+                # Something else publishing on our channels; one bad message mustn't stop fan-out
+                logger.warning("Dropping malformed backplane message", extra={
+                    "event": "backplane.bad_message", "channel": channel, "error": e
+                })
+                continue
+            if origin == self.node_id:
+                continue
+            try:
+                await self.deliver(channel[prefix_length:], message)
+            except Exception as e:
+                logger.error(f"Backplane delivery failed: {str(e)}", exc_info=True)
+
+def create_backplane(kind: str, redis_url: str = "") -> Backplane:
+    if kind == "redis":
+        if not redis_url:
+            raise ValueError("REDIS_URL must be set for the redis broadcast backend")
+        try:
+            import redis.asyncio
+        except ImportError:
+            raise ValueError("The redis broadcast backend needs the redis package: pip install redis")
+        return RedisBackplane(redis_url)
+    if kind in ("", "memory"):
+        return InProcessBackplane()
+    raise ValueError(f"Unknown broadcast backend: {kind}")
@@ -0,0 +1,195 @@
+"""Websocket message encoding.
+
+Clients pick a codec when they connect (``?codec=json|msgpack`` and
+optionally ``&compress=deflate|zstd``). JSON messages go out as text frames.
+Everything else is a binary frame whose first byte says how the rest is
+packed:
+
+    0x00  raw codec payload (msgpack)
+    0x01  zlib-compressed payload
+    0x02  zstd-compressed payload
+
+Only payloads above ``threshold`` bytes are compressed; small ops are not
+worth the CPU. Client frames are inflated to at most ``max_message_bytes``,
+so a small compressed frame cannot expand into gigabytes. Transport-level permessage-deflate is negotiated separately
+by the ASGI server.
+
+A broadcast is wrapped in a Frame so it is encoded once per codec and the
+same bytes are reused for every recipient.
+"""
+from typing import Dict, Optional, Tuple, Union
+import json
+import re
+import zlib
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional codec
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional compression
+    zstandard = None
+
+RAW, DEFLATE, ZSTD = 0, 1, 2
+COMPRESSIONS = {"deflate": DEFLATE, "zstd": ZSTD}
+DEFAULT_COMPRESS_THRESHOLD = 4096
+DEFAULT_MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+Encoded = Union[str, bytes]
+
+class CodecError(ValueError):
+    """Unsupported codec or a frame that cannot be decoded"""
+
+class MessageTooLarge(CodecError):
+    """A client frame that decodes to more than the message size limit"""
+
+if orjson is not None:
+    def _json_dumps(message) -> bytes:
+        return orjson.dumps(message)
+
+    def _json_dumps_text(message) -> str:
+        return orjson.dumps(message).decode()
+
+    _json_loads = orjson.loads
+else:
+    def _json_dumps(message) -> bytes:
+        return json.dumps(message, separators=(",", ":")).encode()
+
+    def _json_dumps_text(message) -> str:
+        return json.dumps(message, separators=(",", ":"))
+
+    _json_loads = json.loads
+
+if zstandard is not None:
+    _zstd_compressor = zstandard.ZstdCompressor(level=3)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+
+class Codec:
+    __slots__ = ("name", "compression", "threshold", "max_message_bytes", "key")
+
+    def __init__(self, name: str = "json", compression: Optional[str] = None,
+                 threshold: int = DEFAULT_COMPRESS_THRESHOLD, max_message_bytes: int = DEFAULT_MAX_MESSAGE_BYTES):
+        if name not in ("json", "msgpack"):
+            raise CodecError(f"Unknown codec: {name}")
+        if name == "msgpack" and msgpack is None:
+            raise CodecError("msgpack codec requested but msgpack is not installed")
+        if compression is not None and compression not in COMPRESSIONS:
+            raise CodecError(f"Unknown compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise CodecError("zstd compression requested but zstandard is not installed")
+        self.name = name
+        self.compression = compression
+        self.threshold = threshold
+        self.max_message_bytes = max_message_bytes
+        # Frames cache encodings under this key
+        self.key: Tuple[str, Optional[str]] = (name, compression)
+
+    @property
+    def binary(self) -> bool:
+        return self.name != "json"
+
+    def encode(self, message: dict) -> Encoded:
+        if self.name == "json":
+            if self.compression is None:
+                return _json_dumps_text(message)
+            payload = _json_dumps(message)
+            if len(payload) < self.threshold:
+                return payload.decode()
+        else:
+            payload = msgpack.packb(message)
+            if self.compression is None or len(payload) < self.threshold:
+                return bytes((RAW,)) + payload
+        if COMPRESSIONS[self.compression] == ZSTD:
+            return bytes((ZSTD,)) + _zstd_compressor.compress(payload)
+        return bytes((DEFLATE,)) + zlib.compress(payload, 6)
+
+    def decode(self, data: Encoded) -> dict:
+        try:
+            if isinstance(data, str):
+                return _json_loads(data)
+            if not data:
+                raise CodecError("empty frame")
+            header, payload = data[0], data[1:]
+            limit = self.max_message_bytes
+            if header == DEFLATE:
+                decompressor = zlib.decompressobj()
+                payload = decompressor.decompress(payload, limit)
+                if decompressor.unconsumed_tail:
+                    raise MessageTooLarge(f"frame inflates past {limit} bytes")
+            elif header == ZSTD:
+                if zstandard is None:
+                    raise CodecError("zstd frame received but zstandard is not installed")
+                # decompress() trusts the content size in the frame header; a bounded read does not
+                payload = _zstd_decompressor.stream_reader(payload).read(limit + 1)
+                if len(payload) > limit:
+                    raise MessageTooLarge(f"frame inflates past {limit} bytes")
+            elif header != RAW:
+                raise CodecError(f"unknown frame header {header}")
+            if self.name == "msgpack":
+                return msgpack.unpackb(payload)
+            return _json_loads(payload)
+        except CodecError:
+            raise
+        except Exception as e:
+            raise CodecError(f"could not decode frame: {e}") from e
+
+JSON = Codec()
+
+_codecs: Dict[Tuple[str, Optional[str]], Codec] = {JSON.key: JSON}
+
+def negotiate(name: Optional[str] = None, compression: Optional[str] = None,
+              threshold: int = DEFAULT_COMPRESS_THRESHOLD,
+              max_message_bytes: int = DEFAULT_MAX_MESSAGE_BYTES) -> Codec:
+    """Shared Codec for the client's query parameters, so Frames cache per pair"""
+    key = (name or "json", compression or None)
+    codec = _codecs.get(key)
+    if codec is None:
+        codec = _codecs[key] = Codec(key[0], key[1], threshold, max_message_bytes)
+    return codec
+
+class Frame:
+    """An outgoing message, encoded at most once per codec"""
+    __slots__ = ("_message", "_encoded")
+
+    def __init__(self, message: Optional[dict] = None, encoded: Optional[Dict[tuple, Encoded]] = None):
+        self._message = message
+        self._encoded = encoded or {}
+
+    @classmethod
+    def from_json(cls, text: str) -> "Frame":
+        """Wrap JSON received from another node without parsing it up front"""
+        return cls(None, {JSON.key: text})
+
+    @property
+    def message(self) -> dict:
+        if self._message is None:
+            self._message = _json_loads(self._encoded[JSON.key])
+        return self._message
+
+    def encode(self, codec: Codec) -> Encoded:
+        data = self._encoded.get(codec.key)
+        if data is None:
+            data = self._encoded[codec.key] = codec.encode(self.message)
+        return data
+
+# Matches the leading "type" key the server and clients always write first
+_TYPE_PREFIX = re.compile(r'\s*\{\s*"type"\s*:\s*"([A-Za-z_]+)"')
+
+def sniff_type(data: Encoded) -> Optional[str]:
+    """Message type from the start of a JSON text frame, without a full parse.
+
+    Returns None when it can't tell cheaply (binary frames, other key order);
+    callers then fall back to decoding the whole frame.
+    """
+    if isinstance(data, str):
+        match = _TYPE_PREFIX.match(data, 0, 64)
+        if match:
+            return match.group(1)
+    return None
@@ -0,0 +1,112 @@
+"""Who is in a document and where their cursors are.
+
+Presence lives only in memory. Every websocket session is a member, keyed
+by a session id, so one user with two tabs shows two cursors. Cursor and
+selection updates overwrite the member's pending entry instead of being
+queued. The ConnectionManager drains the pending entries at a fixed tick
+and sends one delta per document, no matter how often cursors moved
+in between.
+
+Messages (all ``{"type": "presence", ...}``):
+
+    to a newcomer:  {"sid": <own session id>, "members": [member, ...]}
+    each tick:      {"members": [changed member, ...], "left": [sid, ...]}
+
+where a member is ``{"sid", "user", "cursor", "selection"}``.
+"""
+from typing import Dict, List, Optional, Set
+import uuid
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+class DocumentPresence:
+    __slots__ = ("members", "changed", "left")
+
+    def __init__(self):
+        self.members: Dict[str, dict] = {}
+        # Session ids with updates since the last tick
+        self.changed: Set[str] = set()
+        self.left: Set[str] = set()
+
+class PresenceTracker:
+    def __init__(self):
+        self.documents: Dict[str, DocumentPresence] = {}
+        # Documents with something to send at the next tick
+        self.pending: Set[str] = set()
+        self.stats = {"updates": 0, "coalesced": 0, "ticks": 0, "deltas": 0, "snapshots": 0}
+
+    def join(self, doc_id: str, sid: str, user: Optional[str]):
+        document = self.documents.setdefault(doc_id, DocumentPresence())
+        document.members[sid] = {"sid": sid, "user": user, "cursor": None, "selection": None}
+        document.changed.add(sid)
+        document.left.discard(sid)
+        self.pending.add(doc_id)
+
+    def leave(self, doc_id: str, sid: str):
+        document = self.documents.get(doc_id)
+        if document is None or document.members.pop(sid, None) is None:
+            return
+        if sid in document.changed:
+            # Joined and left within one tick: nobody needs to hear about it
+            document.changed.discard(sid)
+        else:
+            document.left.add(sid)
+        if document.members or document.left:
+            self.pending.add(doc_id)
+        else:
+            del self.documents[doc_id]
+            self.pending.discard(doc_id)
+
+    def update(self, doc_id: str, sid: str, cursor: Optional[int], selection: Optional[List[int]]) -> bool:
+        """Record a member's latest cursor; False if the session isn't a member"""
+        document = self.documents.get(doc_id)
+        member = document.members.get(sid) if document is not None else None
+        if member is None:
+            return False
+        self.stats["updates"] += 1
+        if sid in document.changed:
+            # Replaces an update nobody has seen yet
+            self.stats["coalesced"] += 1
+        member["cursor"] = cursor
+        member["selection"] = selection
+        document.changed.add(sid)
+        self.pending.add(doc_id)
+        return True
+
+    def snapshot(self, doc_id: str, sid: Optional[str] = None) -> dict:
+        document = self.documents.get(doc_id)
+        members = [dict(member) for member in document.members.values()] if document else []
+        message = {"type": "presence", "members": members}
+        if sid is not None:
+            message["sid"] = sid
+        self.stats["snapshots"] += 1
+        return message
+
+    def drain(self) -> Dict[str, dict]:
+        """One delta message per document that changed since the last call"""
+        deltas = {}
+        for doc_id in self.pending:
+            document = self.documents.get(doc_id)
+            if document is None:
+                continue
+            members = document.members
+            deltas[doc_id] = {
+                "type": "presence",
+                "members": [dict(members[sid]) for sid in document.changed if sid in members],
+                "left": list(document.left),
+            }
+            document.changed.clear()
+            document.left.clear()
+            if not members:
+                del self.documents[doc_id]
+        self.pending.clear()
+        self.stats["ticks"] += 1
+        self.stats["deltas"] += len(deltas)
+        return deltas
+
+    def metrics(self) -> dict:
+        stats = dict(self.stats)
+        stats["documents"] = len(self.documents)
+        stats["members"] = sum(len(d.members) for d in self.documents.values())
+        return stats
@@ -0,0 +1,340 @@
+"""Rate limits and overload protection.
+
+A limit is ``<requests>/<seconds>``: a token bucket holding ``requests``
+tokens that refills over ``seconds``. Each bucket is kept as a single float,
+the time at which it would be full again (the GCRA form of a token bucket),
+so a check is one dict lookup and a little arithmetic. Buckets that have
+refilled are indistinguishable from new ones and are swept away once there
+are too many keys.
+
+REST requests are limited by RateLimitMiddleware, per client (the bearer
+token's user, else the client address) across all of /api and per
+configured route. Websocket messages are limited per connection, per user
+and per document by MessageLimits. AdmissionControl turns new websockets
+away when the worker already has too many or its event loop is lagging.
+"""
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import asyncio
+import json
+import math
+import time
+
+from jose import JWTError
+
+from auth.jwt_handler import verify_token
+from config import (
+    RATE_LIMIT_ENABLED, RATE_LIMIT_REST, RATE_LIMIT_ROUTES,
+    WS_RATE_LIMIT_CONNECTION, WS_RATE_LIMIT_USER, WS_RATE_LIMIT_DOCUMENT, WS_RATE_LIMIT_MAX_WAIT_SECONDS,
+    WS_MAX_CONNECTIONS, WS_MAX_LOOP_LAG_MS, LOOP_LAG_CHECK_INTERVAL_MS
+)
+from telemetry.metrics import event_loop_lag_seconds
+
+class RateLimitExceeded(Exception):
+    """A client is so far over its limit that it should be disconnected"""
+
+class Rate(NamedTuple):
+    requests: int
+    seconds: float
+
+def parse_rate(spec: Optional[str]) -> Optional[Rate]:
+    """``"10/60"`` -> Rate(10, 60.0); empty or ``"0"`` means no limit"""
+    spec = (spec or "").strip()
+    if spec in ("", "0"):
+        return None
+    requests, _, seconds = spec.partition("/")
+    rate = Rate(int(requests), float(seconds or 1))
+    if rate.requests <= 0 or rate.seconds <= 0:
+        raise ValueError(f"Invalid rate limit: {spec!r}")
+    return rate
+
+def parse_routes(spec: Optional[str]) -> Dict[str, Rate]:
+    """``"POST /api/auth/login=10/60, PUT /api/documents/*=60/60"`` -> {route: Rate}"""
+    routes = {}
+    for entry in (spec or "").split(","):
+        if not entry.strip():
+            continue
+        route, _, rate = entry.rpartition("=")
+        method, _, path = route.strip().partition(" ")
+        parsed = parse_rate(rate)
+        if parsed is not None:
+            routes[f"{method.upper()} {path.strip()}"] = parsed
+    return routes
+
+class RateLimiter:
+    """Token buckets for any number of keys, all with the same rate"""
+
+    def __init__(self, rate: Rate, max_keys: int = 10000):
+        self.rate = rate
+        # Seconds one request uses up, and the most a bucket can be behind
+        self.interval = rate.seconds / rate.requests
+        self.window = float(rate.seconds)
+        self.max_keys = max_keys
+        self._full_at: Dict[str, float] = {}
+        self._sweep_at = max_keys
+        self.stats = {"allowed": 0, "limited": 0, "swept": 0}
+
+    def wait(self, key: str, now: float) -> float:
+        """Seconds until ``key`` may make a request; 0.0 if it may now"""
+        full_at = self._full_at.get(key, now)
+        wait = (full_at if full_at > now else now) + self.interval - now - self.window
+        return wait if wait > 0 else 0.0
+
+    def hit(self, key: str, now: Optional[float] = None) -> float:
+        """Take a request if one is available; else the seconds to wait"""
+        return acquire(((self, key),), now)
+
+    def _set(self, key: str, full_at: float, now: float):
+        self._full_at[key] = full_at
+        if len(self._full_at) >= self._sweep_at:
+            self._sweep(now)
+
+    def _sweep(self, now: float):
+        # Refilled buckets are the same as missing ones
+        before = len(self._full_at)
+        self._full_at = {key: full_at for key, full_at in self._full_at.items() if full_at > now}
+        self.stats["swept"] += before - len(self._full_at)
+        self._sweep_at = max(self.max_keys, 2 * len(self._full_at))
+
+    def metrics(self) -> dict:
+        stats = dict(self.stats)
+        stats["rate"] = f"{self.rate.requests}/{self.rate.seconds:g}"
+        stats["keys"] = len(self._full_at)
+        return stats
+
+def acquire(checks: Iterable[Tuple[RateLimiter, str]], now: Optional[float] = None) -> float:
+    """Take one request from every (limiter, key) or from none of them.
+
+    Returns 0.0 on success, else the longest wait among the limits that
+    said no, so a request refused by one limit doesn't use up the others.
+    """
+    if now is None:
+        now = time.monotonic()
+    wait = 0.0
+    taken = []
+    for limiter, key in checks:
+        full_at = limiter._full_at.get(key, now)
+        full_at = (full_at if full_at > now else now) + limiter.interval
+        over = full_at - now - limiter.window
+        if over > 0:
+            limiter.stats["limited"] += 1
+            if over > wait:
+                wait = over
+        else:
+            taken.append((limiter, key, full_at))
+    if wait:
+        return wait
+    for limiter, key, full_at in taken:
+        limiter.stats["allowed"] += 1
+        limiter._set(key, full_at, now)
+    return 0.0
+
+def _build(rate: Optional[Rate]) -> Optional[RateLimiter]:
+    return RateLimiter(rate) if rate is not None else None
+
+class RouteLimits:
+    """REST limits: one for every request under the prefix, plus per-route ones.
+
+    Route keys are ``"METHOD /path"``; a path ending in ``*`` matches any
+    path starting with what comes before it.
+    """
+
+    def __init__(self, default: Optional[Rate] = None, routes: Optional[Dict[str, Rate]] = None,
+                 enabled: bool = True):
+        self.enabled = enabled
+        self.default = _build(default)
+        self.exact: Dict[str, RateLimiter] = {}
+        self.prefixes: List[Tuple[str, RateLimiter]] = []
+        for route, rate in (routes or {}).items():
+            if route.endswith("*"):
+                self.prefixes.append((route[:-1], RateLimiter(rate)))
+            else:
+                self.exact[route] = RateLimiter(rate)
+
+    def route(self, method: str, path: str) -> Optional[RateLimiter]:
+        route = f"{method} {path}"
+        limiter = self.exact.get(route)
+        if limiter is None:
+            for prefix, candidate in self.prefixes:
+                if route.startswith(prefix):
+                    return candidate
+        return limiter
+
+    def check(self, method: str, path: str, client: str, now: Optional[float] = None) -> float:
+        checks = []
+        if self.default is not None:
+            checks.append((self.default, client))
+        limiter = self.route(method, path)
+        if limiter is not None:
+            checks.append((limiter, client))
+        return acquire(checks, now) if checks else 0.0
+
+    def metrics(self) -> dict:
+        routes = {route: limiter.metrics() for route, limiter in self.exact.items()}
+        routes.update((prefix + "*", limiter.metrics()) for prefix, limiter in self.prefixes)
+        return {
+            "enabled": self.enabled,
+            "default": self.default.metrics() if self.default else None,
+            "routes": routes,
+        }
+
+def client_key(scope: dict) -> str:
+    """The user of a valid bearer token, else the client address"""
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                try:
+                    # Verified tokens are cached, so this is usually a dict lookup
+                    return "user:" + verify_token(token)["sub"]
+                except JWTError:
+                    pass
+            break
+    client = scope.get("client")
+    return "addr:" + (client[0] if client else "unknown")
+
+class RateLimitMiddleware:
+    """Answers 429 with Retry-After for REST requests over their limits"""
+
+    def __init__(self, app, limits: RouteLimits, prefix: str = "/api"):
+        self.app = app
+        self.limits = limits
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.limits.enabled or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+        wait = self.limits.check(scope["method"], scope["path"], client_key(scope))
+        if not wait:
+            await self.app(scope, receive, send)
+            return
+        body = json.dumps({"detail": "Too many requests"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(wait)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+class MessageLimits:
+    """Websocket message limits per connection, per user and per document.
+
+    A client over its limits is not read from until it is back under them,
+    which pushes back on it through TCP. One that would have to wait longer
+    than ``max_wait`` seconds is disconnected.
+    """
+
+    def __init__(self, connection: Optional[Rate] = None, user: Optional[Rate] = None,
+                 document: Optional[Rate] = None, max_wait: float = 2.0, enabled: bool = True):
+        self.enabled = enabled
+        self.connection = _build(connection)
+        self.user = _build(user)
+        self.document = _build(document)
+        self.max_wait = max_wait
+        self.stats = {"delayed": 0, "dropped": 0, "disconnected": 0}
+
+    def check(self, session_id: str, user: Optional[str], document_id: str,
+              now: Optional[float] = None) -> float:
+        """Take one message from every applicable limit; else the seconds to wait"""
+        if not self.enabled:
+            return 0.0
+        checks = []
+        if self.connection is not None:
+            checks.append((self.connection, session_id))
+        if self.user is not None and user is not None:
+            checks.append((self.user, user))
+        if self.document is not None:
+            checks.append((self.document, document_id))
+        return acquire(checks, now)
+
+    def metrics(self) -> dict:
+        stats = dict(self.stats)
+        for name in ("connection", "user", "document"):
+            limiter = getattr(self, name)
+            stats[name] = limiter.metrics() if limiter is not None else None
+        return stats
+
+class LoopMonitor:
+    """Event loop lag, measured by a task that sleeps a fixed interval.
+
+    ``lag`` follows a rising lag at once and a falling one gradually, so a
+    loop that has just been stalled is still treated as busy for a moment.
+    """
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.lag = 0.0
+
+    def record(self, lag: float):
+        self.lag = lag if lag > self.lag else self.lag * 0.8 + lag * 0.2
+        if lag > self.max_lag:
+            self.max_lag = lag
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        histogram = event_loop_lag_seconds.labels()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - started - self.interval, 0.0)
+            self.record(lag)
+            histogram.observe(lag)
+
+    def metrics(self) -> dict:
+        return {"lag_ms": round(self.lag * 1000, 3), "max_lag_ms": round(self.max_lag * 1000, 3)}
+
+class AdmissionControl:
+    """Whether this worker should take on another websocket"""
+
+    def __init__(self, monitor: LoopMonitor, max_connections: int = 0, max_loop_lag: float = 0.0):
+        self.monitor = monitor
+        self.max_connections = max_connections
+        self.max_loop_lag = max_loop_lag
+        self.stats = {"admitted": 0, "rejected_connections": 0, "rejected_lag": 0}
+
+    def check(self, connections: int) -> Optional[str]:
+        """None to admit the connection, else why it is turned away"""
+        if self.max_connections and connections >= self.max_connections:
+            self.stats["rejected_connections"] += 1
+            return f"{connections} connections open"
+        if self.max_loop_lag and self.monitor.lag > self.max_loop_lag:
+            self.stats["rejected_lag"] += 1
+            return f"event loop lagging {self.monitor.lag * 1000:.0f} ms"
+        self.stats["admitted"] += 1
+        return None
+
+    def metrics(self) -> dict:
+        stats = dict(self.stats)
+        stats.update(self.monitor.metrics())
+        return stats
+
+rest_limits = RouteLimits(parse_rate(RATE_LIMIT_REST), parse_routes(RATE_LIMIT_ROUTES), RATE_LIMIT_ENABLED)
+message_limits = MessageLimits(
+    parse_rate(WS_RATE_LIMIT_CONNECTION),
+    parse_rate(WS_RATE_LIMIT_USER),
+    parse_rate(WS_RATE_LIMIT_DOCUMENT),
+    max_wait=WS_RATE_LIMIT_MAX_WAIT_SECONDS,
+    enabled=RATE_LIMIT_ENABLED
+)
+loop_monitor = LoopMonitor(LOOP_LAG_CHECK_INTERVAL_MS / 1000)
+admission = AdmissionControl(loop_monitor, WS_MAX_CONNECTIONS, WS_MAX_LOOP_LAG_MS / 1000)
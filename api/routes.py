@@ -1,17 +1,58 @@
-from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi import APIRouter, HTTPException, Request, Response, Depends
+from fastapi.responses import StreamingResponse
+import base64
+import binascii
+import codecs
 import json
 from pydantic import BaseModel
-from typing import Dict
+from typing import Dict, List, Optional
 import logging
 import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
 from db.dependencies import get_db
+from db import mongo
+from db.transfer import EXPORT_KINDS, TransferError, export_lines, import_lines
+from jose import JWTError
+from config import (
+    ACCESS_TOKEN_EXPIRE_MINUTES, BATCH_GET_MAX_DOCUMENTS, DOC_STREAM_MIN_CHARS, DOC_UPLOAD_MAX_BYTES,
+    DOC_LIST_MAX_LIMIT, HTTP_GZIP_LEVEL, SEARCH_MAX_RESULTS, TRANSFER_BATCH_SIZE
+)
+from auth.jwt_handler import (
+    REFRESH, create_access_token, create_refresh_token, get_admin_user, get_current_user, get_optional_user,
+    token_cache, verify_token
+)
+from auth.passwords import HasherBusyError, password_hasher
+from collab.history import HistoryUnavailableError
+from collab.ot import TextOperation
+from telemetry import logs
+from api.ratelimit import admission, message_limits, rest_limits
+from api.websocket import manager as ws_manager, documents as live_documents, fetch_missed, session_stats, snapshot_message
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 @router.get("/health")
 async def health_check():
-    return {"status": "healthy", "version": "1.0.0"}
+    # Database state comes from the background probe, not a per-request ping
+    return {
+        "status": "healthy",
+        "version": "1.0.0",
+        "database": mongo.health,
+        "document_cache": live_documents.metrics(),
+        "history": live_documents.history.metrics(),
+        "search": live_documents.search.metrics(),
+        "journal": live_documents.journal.metrics() if live_documents.journal else None,
+        "password_hasher": password_hasher.metrics(),
+        "token_cache": token_cache.metrics(),
+        "sessions": dict(session_stats),
+        "presence": ws_manager.presence.metrics(),
+        "rate_limits": {"rest": rest_limits.metrics(), "websocket": message_limits.metrics()},
+        "admission": dict(admission.metrics(), connections=ws_manager.connection_count),
+        "websocket_lifecycle": dict(ws_manager.lifecycle_stats),
+        "logging": logs.metrics()
+    }
 
 class UserCreate(BaseModel):
     username: str
@@ -21,11 +62,23 @@ class UserCreate(BaseModel):
 class DocumentContent(BaseModel):
     content: str
 
+async def _hash_call(call):
+    try:
+        return await call
+    except HasherBusyError:
+        logger.warning("Password hashing queue full, rejecting request")
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"}
+        )
+
 @router.post("/auth/signup")
 async def signup(user: UserCreate, request: Request, db=Depends(get_db)):
-    logger.info(f"Signup attempt for username: {user.username}")
-    logger.info(f"Request headers: {request.headers}")
-    logger.info(f"Origin header: {request.headers.get('origin')}")
+    logger.info("Signup attempt", extra={"event": "auth.signup", "username": user.username})
+    if logger.isEnabledFor(logging.DEBUG):
+        # Auth and cookie headers are redacted by the log formatter
+        logger.debug("Signup request headers", extra={"headers": dict(request.headers)})
     
     # Basic validation
     if not all([user.username, user.password, user.email]):
@@ -35,7 +88,7 @@ async def signup(user: UserCreate, request: Request, db=Depends(get_db)):
     # Check if username exists
     existing_user = await db.users.find_one({"username": user.username})
     if existing_user:
-        logger.warning(f"Username already exists: {user.username}")
+        logger.warning("Username already exists", extra={"event": "auth.signup_conflict", "username": user.username})
         raise HTTPException(
             status_code=400, 
             detail={
@@ -44,10 +97,8 @@ async def signup(user: UserCreate, request: Request, db=Depends(get_db)):
             }
         )
 
-    # Hash password before storing
-    from passlib.context import CryptContext
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    hashed_password = pwd_context.hash(user.password)
+    # Hash password before storing; runs in the bcrypt pool, not on the loop
+    hashed_password = await _hash_call(password_hasher.hash(user.password))
 
     # Create new user
     new_user = {
@@ -68,8 +119,17 @@ async def signup(user: UserCreate, request: Request, db=Depends(get_db)):
             "username": user.username,
             "email": user.email
         }
+    except DuplicateKeyError:
+        # Lost a race with a concurrent signup; the unique index caught it
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Username already exists",
+                "suggestion": "Please choose a different username"
+            }
+        )
     except Exception as e:
-        logger.error(f"Error creating user: {str(e)}")
+        logger.error("Error creating user", extra={"event": "auth.signup_failed", "username": user.username, "error": e})
         raise HTTPException(status_code=500, detail="Internal server error")
 
 class UserLogin(BaseModel):
@@ -78,7 +138,7 @@ class UserLogin(BaseModel):
 
 @router.post("/auth/login")
 async def login(user: UserLogin, db=Depends(get_db)):
-    logger.info(f"Login attempt for username: {user.username}")
+    logger.info("Login attempt", extra={"event": "auth.login", "username": user.username})
     
     if not all([user.username, user.password]):
         raise HTTPException(status_code=422, detail="Username and password are required")
@@ -87,15 +147,19 @@ async def login(user: UserLogin, db=Depends(get_db)):
     if not existing_user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    from passlib.context import CryptContext
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    
-    if not pwd_context.verify(user.password, existing_user["password"]):
+    valid, new_hash = await _hash_call(
+        password_hasher.verify(user.password, existing_user["password"])
+    )
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    from auth.jwt_handler import create_access_token
-    from config import ACCESS_TOKEN_EXPIRE_MINUTES
-    
+    if new_hash is not None:
+        # Stored hash predates the current BCRYPT_ROUNDS; upgrade it in place
+        await db.users.update_one(
+            {"_id": existing_user["_id"]},
+            {"$set": {"password": new_hash, "updated_at": datetime.datetime.utcnow()}}
+        )
+
     access_token = create_access_token(
         data={"sub": user.username}
     )
@@ -103,105 +167,367 @@ async def login(user: UserLogin, db=Depends(get_db)):
         "message": "Login successful",
         "username": user.username,
         "access_token": access_token,
+        "refresh_token": create_refresh_token(data={"sub": user.username}),
         "token_type": "bearer",
         "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
     }
 
-@router.get("/documents/{doc_id}")
-async def get_document(doc_id: str, db=Depends(get_db)):
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
+@router.post("/auth/refresh")
+async def refresh(body: TokenRefresh):
+    # Stateless: a valid, unexpired refresh token is enough; no bcrypt or DB hit
     try:
-        logger.info(f"Attempting to load document: {doc_id}")
-        # Verify collection exists
-        if 'documents' not in (await db.list_collection_names()):
-            logger.error("Documents collection does not exist")
-            await db.create_collection('documents')
-            
-        document = await db.documents.find_one({"doc_id": doc_id})
-        
-        if not document:
-            logger.info(f"Document {doc_id} not found, creating new one")
-            try:
-                result = await db.documents.insert_one({
-                    "doc_id": doc_id,
-                    "content": "",
-                    "created_at": datetime.datetime.utcnow(),
-                    "updated_at": datetime.datetime.utcnow()
-                })
-                if not result.inserted_id:
-                    logger.error("Failed to create new document")
-                    raise HTTPException(status_code=500, detail="Failed to create document")
-                logger.info(f"Created new document with ID: {result.inserted_id}")
-                return {"content": ""}
-            except Exception as e:
-                logger.error(f"Error creating document: {str(e)}", exc_info=True)
-                raise HTTPException(status_code=500, detail=f"Error creating document: {str(e)}")
-        
-        logger.info(f"Successfully loaded document: {doc_id}")
-        return {"content": document.get("content", "")}
+        claims = verify_token(body.refresh_token, REFRESH, cache=None)
+    except JWTError:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    username = claims["sub"]
+    return {
+        "username": username,
+        "access_token": create_access_token(data={"sub": username}),
+        "refresh_token": create_refresh_token(data={"sub": username}),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    }
+
+def document_etag(revision: int) -> str:
+    # Every change bumps the revision, so it identifies the content. Weak: the
+    # same revision goes out as JSON, streamed JSON or plain text, in any encoding
+    return f'W/"r{revision}"'
+
+def _cache_headers(revision: int) -> dict:
+    return {"ETag": document_etag(revision), "Vary": "Accept-Encoding"}
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # Weak comparison, as If-None-Match calls for
+    if not if_none_match:
+        return False
+    etag = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def _not_modified(revision: int) -> Response:
+    return Response(status_code=304, headers=_cache_headers(revision))
+
+# Characters per piece of a streamed document body
+STREAM_PIECE_CHARS = 64 * 1024
+
+async def _stream_text(content: str, encode, prefix: bytes = b"", suffix: bytes = b""):
+    # The string is immutable, so this is a consistent revision even while edits land
+    if prefix:
+        yield prefix
+    for start in range(0, len(content), STREAM_PIECE_CHARS):
+        yield encode(content[start:start + STREAM_PIECE_CHARS])
+    if suffix:
+        yield suffix
+
+def _json_string_piece(piece: str) -> bytes:
+    # Characters are escaped one by one, so pieces concatenate into one JSON string
+    return json.dumps(piece, ensure_ascii=False)[1:-1].encode()
+
+async def _read_for_get(doc_id: str, request: Request):
+    """(304 response, None) if the client's copy is current, else (None, state)"""
+    try:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            # Revision only: an unchanged document is never loaded
+            revision = await live_documents.revision(doc_id)
+            if revision is not None and _etag_matches(if_none_match, document_etag(revision)):
+                return _not_modified(revision), None
+        # Served from the in-memory store when the document is hot
+        state = await live_documents.read(doc_id)
     except Exception as e:
-        logger.error(f"Error getting document {doc_id}: {str(e)}", exc_info=True)
+        logger.error("Error getting document", extra={"event": "document.read_failed", "doc_id": doc_id, "error": e},
+                     exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error loading document: {str(e)}")
+    if state is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return None, state
 
-from api.websocket import manager as ws_manager
+@router.get("/documents/{doc_id}")
+async def get_document(doc_id: str, request: Request, response: Response):
+    # Read-only: a missing document is a 404, creating one is PUT's job
+    not_modified, state = await _read_for_get(doc_id, request)
+    if not_modified is not None:
+        return not_modified
+    if state.length >= DOC_STREAM_MIN_CHARS:
+        # Large bodies go out in pieces rather than as one encoded copy
+        prefix = f'{{"rev":{state.revision},"content":"'.encode()
+        return StreamingResponse(
+            _stream_text(state.content, _json_string_piece, prefix, b'"}'),
+            media_type="application/json", headers=_cache_headers(state.revision)
+        )
+    response.headers.update(_cache_headers(state.revision))
+    return {"content": state.content, "rev": state.revision}
 
-@router.post("/documents/{doc_id}")
-async def save_document(doc_id: str, document: DocumentContent, request: Request, db=Depends(get_db)):
+@router.get("/documents/{doc_id}/content")
+async def get_document_content(doc_id: str, request: Request):
+    """The content as plain UTF-8 text, streamed"""
+    not_modified, state = await _read_for_get(doc_id, request)
+    if not_modified is not None:
+        return not_modified
+    return StreamingResponse(
+        _stream_text(state.content, str.encode), media_type="text/plain; charset=utf-8",
+        headers=_cache_headers(state.revision)
+    )
+
+@router.put("/documents/{doc_id}/content")
+async def upload_document_content(doc_id: str, request: Request, user: Optional[str] = Depends(get_optional_user)):
+    """Replace the content with the raw UTF-8 request body, decoded as it arrives"""
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > DOC_UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Document too large")
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parts = []
+    received = 0
     try:
-        logger.info(f"Attempting to save document: {doc_id}")
-        
-        # Verify database connection by attempting a simple operation
-        try:
-            await db.command('ping')
-        except Exception as e:
-            logger.error(f"Database connection verification failed: {str(e)}")
-            raise HTTPException(status_code=500, detail="Database connection verification failed")
-        
-        # Verify collection exists
-        collections = await db.list_collection_names()
-        logger.debug(f"Available collections: {collections}")
-        
-        if 'documents' not in collections:
-            logger.info("Creating documents collection")
-            try:
-                await db.create_collection('documents')
-                logger.info("Successfully created documents collection")
-            except Exception as create_error:
-                logger.error(f"Failed to create collection: {str(create_error)}", exc_info=True)
-                raise HTTPException(status_code=500, detail="Failed to create collection")
-        
-        # Save to database with detailed logging
-        logger.debug(f"Saving document content: {document.content}")
-        result = await db.documents.update_one(
-            {"doc_id": doc_id},
-            {"$set": {
-                "content": document.content,
-                "updated_at": datetime.datetime.utcnow()
-            }},
-            upsert=True
-        )
-        
-        # Detailed result analysis
-        logger.debug(f"Update result: {result.raw_result}")
-        if not result.acknowledged:
-            logger.error("Document save not acknowledged by database")
-            raise HTTPException(status_code=500, detail="Document save not acknowledged by database")
-            
-        if result.matched_count == 0 and result.upserted_id is None:
-            logger.error("Document was neither matched nor upserted")
-            raise HTTPException(status_code=500, detail="Document save failed")
-        
-        logger.info(f"Successfully saved document: {doc_id}. Matched: {result.matched_count}, Modified: {result.modified_count}, Upserted ID: {result.upserted_id}")
-        
-        # Broadcast update to all connected clients
-        await ws_manager.broadcast(
-            json.dumps({
-                "type": "content_update",
-                "content": document.content
-            }),
-            doc_id
+        async for piece in request.stream():
+            received += len(piece)
+            if received > DOC_UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="Document too large")
+            parts.append(decoder.decode(piece))
+        parts.append(decoder.decode(b"", final=True))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Body must be UTF-8 text")
+    content = "".join(parts)
+    del parts
+    try:
+        state = await live_documents.write(doc_id, content, user)
+        await _publish_replacement(state)
+    except Exception as e:
+        logger.error("Error uploading document", extra={"event": "document.upload_failed", "doc_id": doc_id, "error": e},
+                     exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error saving document: {str(e)}")
+    logger.info("Document uploaded", extra={
+        "event": "document.uploaded", "doc_id": doc_id, "bytes": received, "rev": state.revision
+    })
+    return {"message": "Document saved successfully", "rev": state.revision}
+
+@router.put("/documents/{doc_id}")
+async def create_document(doc_id: str, response: Response, user: Optional[str] = Depends(get_optional_user)):
+    """Create an empty document, owned by the caller if signed in; a no-op
+    returning the current one if it exists"""
+    try:
+        state, created = await live_documents.create(doc_id, owner=user)
+    except Exception as e:
+        logger.error("Error creating document", extra={"event": "document.create_failed", "doc_id": doc_id, "error": e},
+                     exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error creating document: {str(e)}")
+    if created:
+        logger.info("Document created", extra={"event": "document.created", "doc_id": doc_id, "owner": user})
+        response.status_code = 201
+    response.headers["ETag"] = document_etag(state.revision)
+    return {"content": state.content, "rev": state.revision}
+
+def _encode_cursor(row: dict) -> str:
+    key = json.dumps([row["updated_at"].isoformat(), str(row["_id"]), isinstance(row["_id"], ObjectId)])
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str):
+    try:
+        updated_at, last_id, is_object_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.datetime.fromisoformat(updated_at), ObjectId(last_id) if is_object_id else last_id
+    except (binascii.Error, InvalidId, ValueError, TypeError):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+@router.get("/documents")
+async def list_documents(limit: int = 20, cursor: Optional[str] = None, owned: bool = False,
+                         user: str = Depends(get_current_user)):
+    """The caller's documents (owned, or edited as a collaborator; only owned
+    with ``owned=true``), most recently updated first, without their content.
+    Pass ``next_cursor`` back as ``cursor`` for the next page."""
+    if not 1 <= limit <= DOC_LIST_MAX_LIMIT:
+        raise HTTPException(status_code=422, detail=f"limit must be 1-{DOC_LIST_MAX_LIMIT}")
+    after = _decode_cursor(cursor) if cursor else None
+    rows, more = await live_documents.list_documents(user, limit, after, owned_only=owned)
+    return {
+        "documents": [{
+            "doc_id": row["doc_id"],
+            "title": row.get("title", ""),
+            "size": row.get("size"),
+            "updated_at": row["updated_at"],
+            "owner": row.get("owner"),
+            "rev": row.get("revision", 0),
+        } for row in rows],
+        "next_cursor": _encode_cursor(rows[-1]) if more else None
+    }
+
+class DocumentBatchGet(BaseModel):
+    doc_ids: List[str]
+    include_content: bool = True
+
+@router.post("/documents:batchGet")
+async def batch_get_documents(body: DocumentBatchGet):
+    """Many documents in one query, in request order; unknown ids are listed as missing"""
+    doc_ids = list(dict.fromkeys(body.doc_ids))
+    if len(doc_ids) > BATCH_GET_MAX_DOCUMENTS:
+        raise HTTPException(
+            status_code=422, detail=f"At most {BATCH_GET_MAX_DOCUMENTS} documents per request"
         )
+    found = await live_documents.read_many(doc_ids, content=body.include_content)
+    documents = []
+    for doc_id in doc_ids:
+        if doc_id not in found:
+            continue
+        content, revision = found[doc_id]
+        document = {"doc_id": doc_id, "rev": revision}
+        if body.include_content:
+            document["content"] = content
+        documents.append(document)
+    return {"documents": documents, "missing": [doc_id for doc_id in doc_ids if doc_id not in found]}
+
+@router.get("/search")
+async def search_documents(q: str, limit: int = 20, offset: int = 0):
+    """Documents containing every word of ``q``, best match first. The last
+    word (and any ending in ``*``) also matches as a prefix. Saved changes
+    show up once the index has caught up, usually within a few seconds."""
+    if not 1 <= limit <= SEARCH_MAX_RESULTS or offset < 0:
+        raise HTTPException(status_code=422, detail=f"limit must be 1-{SEARCH_MAX_RESULTS} and offset >= 0")
+    total, hits = await live_documents.search.search(q, limit, offset)
+    return {
+        "query": q,
+        "total": total,
+        "offset": offset,
+        "results": [{"doc_id": doc_id, "score": score} for doc_id, score in hits],
+        "next_offset": offset + limit if offset + limit < total else None
+    }
+
+@router.get("/documents/{doc_id}/diff")
+async def get_document_diff(doc_id: str, since: int, request: Request, response: Response):
+    """One op taking revision ``since`` to the current content, or the full
+    content when the ops in between are no longer available"""
+    state = await live_documents.read(doc_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if _etag_matches(request.headers.get("if-none-match"), document_etag(state.revision)):
+        return _not_modified(state.revision)
+    response.headers.update(_cache_headers(state.revision))
+    if since == state.revision:
+        return {"type": "diff", "since": since, "rev": state.revision,
+                "ops": TextOperation().retain(state.length).to_json()}
+    missed = state.ops_since(since)
+    if missed is not None:
+        ops = [op for _, op in missed]
+    else:
+        logged = await fetch_missed(state, since)
+        recent = state.ops_since(logged[-1][0]) if logged else None
+        ops = None
+        if recent is not None:
+            ops = [TextOperation.from_json(entry) for _, entry in logged] + [op for _, op in recent]
+    if not ops:
+        return snapshot_message(state)
+    diff = ops[0]
+    for op in ops[1:]:
+        diff = diff.compose(op)
+    return {"type": "diff", "since": since, "rev": state.revision, "ops": diff.to_json()}
+
+async def _publish_replacement(state):
+    # Broadcast update to all connected clients once it is journaled
+    barrier = live_documents.barrier()
+    await ws_manager.broadcast(snapshot_message(state, "content_update"), state.doc_id, barrier=barrier)
+    if barrier is not None:
+        await barrier
+
+@router.post("/documents/{doc_id}")
+async def save_document(doc_id: str, document: DocumentContent, request: Request,
+                        user: Optional[str] = Depends(get_optional_user)):
+    try:
+        # Write-behind: the store batches this into the next bulk flush, and
+        # live sessions with pending ops against older revisions will resync
+        state = await live_documents.write(doc_id, document.content, user)
+        logger.info("Document saved", extra={
+            "event": "document.saved", "doc_id": doc_id, "chars": len(document.content), "rev": state.revision
+        })
+
+        await _publish_replacement(state)
         
         return {"message": "Document saved successfully"}
     except Exception as e:
-        logger.error(f"Error saving document {doc_id}: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Error saving document: {str(e)}")
\ No newline at end of file
+        logger.error("Error saving document", extra={"event": "document.save_failed", "doc_id": doc_id, "error": e},
+                     exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error saving document: {str(e)}")
+
+@router.get("/documents/{doc_id}/versions")
+async def get_document_version(doc_id: str, rev: Optional[int] = None,
+                               at: Optional[datetime.datetime] = None):
+    """The document as of revision ``rev`` or timestamp ``at`` (ISO 8601)"""
+    if (rev is None) == (at is None):
+        raise HTTPException(status_code=422, detail="Pass exactly one of rev or at")
+    history = live_documents.history
+    state = live_documents.get(doc_id)
+    if state is not None and state.dirty and (at is not None or rev > state.persisted_revision):
+        # The newest changes are still waiting for the write-behind flush
+        await live_documents.flush()
+    if at is not None:
+        if at.tzinfo is not None:
+            at = at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        rev = await history.revision_at(doc_id, at)
+        if rev is None:
+            raise HTTPException(status_code=404, detail=f"No history for {doc_id} at {at.isoformat()}")
+    if state is not None and rev == state.revision:
+        return {"doc_id": doc_id, "rev": rev, "content": state.content}
+    try:
+        content = await history.reconstruct(doc_id, rev)
+    except HistoryUnavailableError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"doc_id": doc_id, "rev": rev, "content": content}
+
+# Largest batch_size an import may ask for
+TRANSFER_MAX_BATCH_SIZE = 10000
+
+@router.get("/admin/export")
+async def export_data(kinds: str = ",".join(EXPORT_KINDS), gzip: bool = False,
+                      admin: str = Depends(get_admin_user), db=Depends(get_db)):
+    """Documents and/or users as NDJSON (see db.transfer), streamed from
+    batched cursors. ``gzip=true`` compresses in a worker thread, a batch at
+    a time, rather than on the event loop like the compression middleware."""
+    selected = [kind.strip() for kind in kinds.split(",") if kind.strip()]
+    if not selected or any(kind not in EXPORT_KINDS for kind in selected):
+        raise HTTPException(status_code=422, detail=f"kinds must be a comma separated subset of {','.join(EXPORT_KINDS)}")
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    headers = {"Content-Disposition": f'attachment; filename="realdoc-{stamp}.ndjson"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    logger.info("Export started", extra={"event": "admin.export", "user": admin, "kinds": selected, "gzip": gzip})
+    return StreamingResponse(
+        export_lines(live_documents, db.users, selected, TRANSFER_BATCH_SIZE, HTTP_GZIP_LEVEL if gzip else None),
+        media_type="application/x-ndjson", headers=headers
+    )
+
+@router.post("/admin/import")
+async def import_data(request: Request, replace: bool = False, batch_size: int = TRANSFER_BATCH_SIZE,
+                      admin: str = Depends(get_admin_user), db=Depends(get_db)):
+    """Import an NDJSON body (gzip if sent with Content-Encoding: gzip) as it
+    arrives, ``batch_size`` lines per write. Existing documents and users are
+    skipped unless ``replace``; replaced documents reach live sessions like a save."""
+    if not 1 <= batch_size <= TRANSFER_MAX_BATCH_SIZE:
+        raise HTTPException(status_code=422, detail=f"batch_size must be 1-{TRANSFER_MAX_BATCH_SIZE}")
+    encoding = request.headers.get("content-encoding", "identity").lower()
+    if encoding not in ("identity", "gzip", "deflate"):
+        raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {encoding}")
+    try:
+        report = await import_lines(
+            live_documents, db.users, request.stream(), batch_size, replace,
+            compressed=encoding != "identity", max_line_bytes=DOC_UPLOAD_MAX_BYTES,
+            on_replace=_publish_replacement
+        )
+    except TransferError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Import failed", extra={"event": "admin.import_failed", "user": admin, "error": e}, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
+    if report["documents_inserted"] and live_documents.search is not None:
+        # Inserted rows bypassed the store's flush, which feeds the index
+        live_documents.search.request_backfill(live_documents)
+    logger.info("Import finished", extra={
+        "event": "admin.import", "user": admin, **{k: v for k, v in report.items() if k != "error_lines"}
+    })
+    return report
@@ -1,26 +1,692 @@
-from typing import Dict, List
-from fastapi import WebSocket
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from fastapi import WebSocket, WebSocketDisconnect
+import asyncio
+import logging
+import time
+
+from api.backplane import Backplane, InProcessBackplane, create_backplane
+from api.codec import JSON, Codec, CodecError, Encoded, Frame, MessageTooLarge, sniff_type
+from api.presence import PresenceTracker, new_session_id
+from api.ratelimit import RateLimitExceeded, message_limits
+from collab.document import DocumentState
+from collab.history import HistoryStore
+from collab.journal import Journal
+from collab.ot import OTError, TextOperation
+from collab.search import SearchIndex
+from collab.store import DocumentStore
+from config import (
+    OT_HISTORY_LIMIT, DOC_CACHE_MAX_DOCUMENTS, DOC_CACHE_MAX_BYTES,
+    DOC_FLUSH_INTERVAL_MS, DOC_FLUSH_MAX_OPS, BROADCAST_BACKEND, REDIS_URL,
+    WS_SEND_QUEUE_SIZE, WS_SLOW_CONSUMER_POLICY, WS_SEND_TIMEOUT_SECONDS,
+    WS_PING_INTERVAL_SECONDS, WS_IDLE_TIMEOUT_SECONDS, WS_MAX_LIFETIME_SECONDS,
+    HISTORY_SNAPSHOT_EVERY_OPS, HISTORY_SNAPSHOT_EVERY_BYTES, HISTORY_KEEP_OP_SNAPSHOTS,
+    JOURNAL_DIR, JOURNAL_SEGMENT_BYTES, JOURNAL_COMMIT_INTERVAL_MS, JOURNAL_COMMIT_MAX_ENTRIES, JOURNAL_FSYNC,
+    DOC_CHUNK_SIZE, DOC_ROPE_MIN_CHARS, PRESENCE_TICK_HZ, SEARCH_INDEX_BATCH, SEARCH_INDEX_INTERVAL_MS, SEARCH_MAX_TERMS,
+    SEARCH_PREFIX_EXPANSIONS, SEARCH_MAX_POSTINGS_PER_TERM
+)
+from telemetry.metrics import registry, ws_delivery_seconds, ws_fanout_recipients
+
+logger = logging.getLogger(__name__)
+
+# Slow-consumer policies for a full outbound queue
+COALESCE = "coalesce"       # drop what's queued and send the latest snapshot instead
+DISCONNECT = "disconnect"   # close the socket; the client reconnects and reloads
+
+# Bound once; observed for every broadcast and every send
+_fanout_recipients = ws_fanout_recipients.labels()
+_delivery_seconds = ws_delivery_seconds.labels()
+
+# Queue marker replaced by a fresh snapshot when the sender reaches it
+_RESYNC = object()
+
+Message = Union[dict, str, Frame]
+
+def _as_frame(message: Message) -> Frame:
+    if isinstance(message, Frame):
+        return message
+    if isinstance(message, str):
+        return Frame.from_json(message)
+    return Frame(message)
+
+def _is_position(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+def _send_encoded(websocket: WebSocket, data: Encoded):
+    if isinstance(data, bytes):
+        return websocket.send_bytes(data)
+    return websocket.send_text(data)
+
+if hasattr(asyncio, "timeout"):
+    async def _send_with_timeout(websocket: WebSocket, data: Encoded, timeout: float):
+        # asyncio.timeout avoids the extra task wait_for creates per send
+        async with asyncio.timeout(timeout):
+            await _send_encoded(websocket, data)
+else:
+    async def _send_with_timeout(websocket: WebSocket, data: Encoded, timeout: float):
+        await asyncio.wait_for(_send_encoded(websocket, data), timeout)
+
+class FanoutStats:
+    __slots__ = ("broadcasts", "deliveries", "latency_total", "latency_max", "dropped", "disconnects")
 
-class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+        self.broadcasts = 0
+        self.deliveries = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.dropped = 0
+        self.disconnects = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "broadcasts": self.broadcasts,
+            "deliveries": self.deliveries,
+            "mean_latency_ms": round(self.latency_total / self.deliveries * 1000, 3) if self.deliveries else 0.0,
+            "max_latency_ms": round(self.latency_max * 1000, 3),
+            "dropped": self.dropped,
+            "disconnects": self.disconnects,
+        }
+
+class Connection:
+    """A websocket with its bounded outbound queue and dedicated sender task"""
+    __slots__ = (
+        "websocket", "document_id", "codec", "user", "queue", "wakeup", "sender", "close_code",
+        "session_id", "presence", "presence_behind", "connected_at", "last_seen"
+    )
+
+    def __init__(self, websocket: WebSocket, document_id: str, codec: Codec = JSON,
+                 user: Optional[str] = None, presence: bool = False):
+        self.websocket = websocket
+        self.document_id = document_id
+        self.codec = codec
+        # Verified once at the handshake; messages are never re-authenticated
+        self.user = user
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.sender: Optional[asyncio.Task] = None
+        # Set when the sender should close the socket instead of sending more
+        self.close_code: Optional[int] = None
+        self.session_id = new_session_id()
+        # Whether the client asked for presence messages; it is a member either way
+        self.presence = presence
+        # A presence delta was skipped; the next tick sends a full snapshot
+        self.presence_behind = False
+        # time.monotonic() of the handshake and of the last frame received
+        self.connected_at = self.last_seen = time.monotonic()
 
-    async def connect(self, websocket: WebSocket, document_id: str):
-        await websocket.accept()
+class ConnectionManager:
+    """Open websockets, by document and by session id.
+
+    Quiet clients are sent a ``ping`` every ``ping_interval`` seconds; any
+    frame from a client counts as a reply. Connections that have sent
+    nothing for ``idle_timeout`` seconds (a peer that went away without a
+    close), or have been open for ``max_lifetime``, are closed with 1001 and
+    the client reconnects. 0 disables each.
+    """
+    def __init__(self, backplane: Optional[Backplane] = None, queue_size: int = 256,
+                 slow_consumer_policy: str = COALESCE, send_timeout: float = 10.0,
+                 presence_tick_hz: float = 20.0, ping_interval: float = 0.0,
+                 idle_timeout: float = 0.0, max_lifetime: float = 0.0):
+        if slow_consumer_policy not in (COALESCE, DISCONNECT):
+            raise ValueError(f"Unknown slow consumer policy: {slow_consumer_policy}")
+        self.active_connections: Dict[str, Dict[WebSocket, Connection]] = {}
+        # Every open connection by session id, for the heartbeat sweep
+        self.connections: Dict[str, Connection] = {}
+        self.backplane = backplane or InProcessBackplane()
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.send_timeout = send_timeout
+        # Returns the latest full-state message for a document, used when coalescing
+        self.snapshot_provider: Optional[Callable[[str], Optional[dict]]] = None
+        self.fanout_stats: Dict[str, FanoutStats] = {}
+        self.presence = PresenceTracker()
+        self.presence_interval = 1.0 / presence_tick_hz if presence_tick_hz > 0 else 0.0
+        self._presence_wakeup: Optional[asyncio.Event] = None
+        self._presence_ticker: Optional[asyncio.Task] = None
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.lifecycle_stats = {"sweeps": 0, "pings": 0, "idle_closed": 0, "lifetime_closed": 0}
+
+    @property
+    def connection_count(self) -> int:
+        """Open connections across all documents, for admission control"""
+        return len(self.connections)
+
+    @property
+    def sweep_interval(self) -> float:
+        # Often enough to ping on time and to close within half a timeout of it
+        intervals = [t for t in (self.ping_interval, self.idle_timeout / 2, self.max_lifetime / 2) if t > 0]
+        return min(intervals) if intervals else 0.0
+
+    async def start(self):
+        await self.backplane.start(self._deliver_remote)
+        self._presence_wakeup = asyncio.Event()
+        self._presence_ticker = asyncio.create_task(self._presence_loop())
+        if self.sweep_interval:
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        for task in (self._presence_ticker, self._heartbeat):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._presence_ticker = self._heartbeat = None
+        senders = [
+            connection.sender
+            for connections in self.active_connections.values()
+            for connection in connections.values()
+            if connection.sender is not None
+        ]
+        for connections in self.active_connections.values():
+            for connection in connections.values():
+                connection.close_code = 1001
+        for sender in senders:
+            sender.cancel()
+        await asyncio.gather(*senders, return_exceptions=True)
+        self.active_connections.clear()
+        self.connections.clear()
+        self.fanout_stats.clear()
+        self.presence = PresenceTracker()
+        await self.backplane.stop()
+
+    async def connect(self, websocket: WebSocket, document_id: str, codec: Codec = JSON,
+                      user: Optional[str] = None, subprotocol: Optional[str] = None,
+                      presence: bool = False) -> Connection:
+        await websocket.accept(subprotocol=subprotocol)
+        connection = Connection(websocket, document_id, codec, user, presence)
+        connection.sender = asyncio.create_task(self._send_loop(connection))
         if document_id not in self.active_connections:
-            self.active_connections[document_id] = []
-        self.active_connections[document_id].append(websocket)
-
-    def disconnect(self, websocket: WebSocket, document_id: str):
-        if document_id in self.active_connections:
-            self.active_connections[document_id].remove(websocket)
-            if not self.active_connections[document_id]:
-                del self.active_connections[document_id]
-
-    async def broadcast(self, message: str, document_id: str):
-        if document_id in self.active_connections:
-            for connection in self.active_connections[document_id]:
-                await connection.send_text(message)
-
-# Create and export manager instance
-manager = ConnectionManager()
+            self.active_connections[document_id] = {}
+            self.fanout_stats[document_id] = FanoutStats()
+            # First local subscriber: start receiving this document from other nodes
+            await self.backplane.subscribe(document_id)
+        self.active_connections[document_id][websocket] = connection
+        self.connections[connection.session_id] = connection
+        self.presence.join(document_id, connection.session_id, user)
+        self._presence_changed()
+        return connection
+
+    async def disconnect(self, websocket: WebSocket, document_id: str):
+        connection = self.active_connections.get(document_id, {}).get(websocket)
+        if connection is None:
+            return
+        if connection.sender is not None and connection.sender is not asyncio.current_task():
+            connection.sender.cancel()
+        await self._remove(connection)
+
+    async def _remove(self, connection: Connection):
+        connections = self.active_connections.get(connection.document_id)
+        if not connections or connections.pop(connection.websocket, None) is None:
+            return
+        del self.connections[connection.session_id]
+        self.presence.leave(connection.document_id, connection.session_id)
+        self._presence_changed()
+        if not connections:
+            del self.active_connections[connection.document_id]
+            self.fanout_stats.pop(connection.document_id, None)
+            await self.backplane.unsubscribe(connection.document_id)
+
+    def send(self, websocket: WebSocket, document_id: str, message: Message,
+             barrier: Optional[asyncio.Future] = None):
+        """Queue a message for one client, behind anything already queued for it.
+
+        With a ``barrier`` the message (and so everything queued after it)
+        is held back until the future resolves, e.g. until a change is journaled.
+        """
+        connection = self.active_connections.get(document_id, {}).get(websocket)
+        if connection is not None:
+            self._enqueue(connection, _as_frame(message), time.perf_counter(),
+                          self.fanout_stats[document_id], barrier)
+
+    async def broadcast(self, message: Message, document_id: str, exclude: Optional[WebSocket] = None,
+                        barrier: Optional[asyncio.Future] = None):
+        frame = _as_frame(message)
+        await self.deliver_local(document_id, frame, exclude, barrier)
+        # Other nodes always get JSON; it's also what most local clients use
+        await self.backplane.publish(document_id, frame.encode(JSON))
+
+    async def _deliver_remote(self, document_id: str, message: str):
+        # Presence from other nodes only goes to the clients that asked for it
+        if sniff_type(message) == "presence":
+            self._fan_out_presence(document_id, Frame.from_json(message))
+        else:
+            await self.deliver_local(document_id, message)
+
+    async def deliver_local(self, document_id: str, message: Message, exclude: Optional[WebSocket] = None,
+                            barrier: Optional[asyncio.Future] = None):
+        """Queue the message for every local client; never waits on a socket"""
+        connections = self.active_connections.get(document_id)
+        if not connections:
+            return
+        message = _as_frame(message)
+        stats = self.fanout_stats[document_id]
+        stats.broadcasts += 1
+        now = time.perf_counter()
+        for websocket, connection in connections.items():
+            if websocket is not exclude:
+                self._enqueue(connection, message, now, stats, barrier)
+        _fanout_recipients.observe(len(connections) - (exclude in connections))
+
+    def _enqueue(self, connection: Connection, message: Frame, queued_at: float, stats: FanoutStats,
+                 barrier: Optional[asyncio.Future] = None):
+        if connection.close_code is not None:
+            return
+        queue = connection.queue
+        if queue and queue[-1][0] is _RESYNC:
+            # The pending snapshot is taken at send time and already covers this
+            stats.dropped += 1
+            return
+        if len(queue) >= self.queue_size:
+            stats.dropped += 1
+            if self.slow_consumer_policy == DISCONNECT:
+                connection.close_code = 1013
+                queue.clear()
+            elif self.snapshot_provider is not None:
+                queue.clear()
+                queue.append((_RESYNC, queued_at, barrier))
+            else:
+                queue.popleft()
+                queue.append((message, queued_at, barrier))
+        else:
+            queue.append((message, queued_at, barrier))
+        connection.wakeup.set()
+
+    async def _send_loop(self, connection: Connection):
+        websocket = connection.websocket
+        queue = connection.queue
+        while True:
+            while not queue and connection.close_code is None:
+                connection.wakeup.clear()
+                await connection.wakeup.wait()
+            stats = self.fanout_stats.get(connection.document_id) or FanoutStats()
+            if connection.close_code is not None:
+                if connection.close_code == 1013:
+                    stats.disconnects += 1
+                    logger.info("Disconnecting slow consumer", extra={
+                        "event": "ws.slow_consumer", "doc_id": connection.document_id
+                    })
+                try:
+                    await websocket.close(code=connection.close_code)
+                except Exception:
+                    pass
+                await self._remove(connection)
+                return
+            frame, queued_at, barrier = queue[0]
+            if barrier is not None:
+                if not barrier.done():
+                    await asyncio.wait((barrier,))
+                    # The queue may have been coalesced or cleared while waiting
+                    continue
+                if barrier.exception() is not None:
+                    # The change never became durable; don't confirm it
+                    logger.error(f"Closing websocket on {connection.document_id}: {barrier.exception()}")
+                    connection.close_code = 1011
+                    queue.clear()
+                    continue
+            queue.popleft()
+            if frame is _RESYNC:
+                snapshot = self.snapshot_provider(connection.document_id)
+                if snapshot is None:
+                    continue
+                frame = Frame(snapshot)
+            try:
+                await _send_with_timeout(websocket, frame.encode(connection.codec), self.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Dead or stalled socket: stop delivering to it
+                logger.info("Evicting websocket", extra={
+                    "event": "ws.evicted", "doc_id": connection.document_id, "error": e
+                })
+                stats.disconnects += 1
+                # Close it too, so the endpoint stops reading edits from a client nothing reaches
+                try:
+                    await asyncio.wait_for(websocket.close(code=1011), self.send_timeout)
+                except Exception:
+                    pass
+                await self._remove(connection)
+                return
+            latency = time.perf_counter() - queued_at
+            stats.deliveries += 1
+            stats.latency_total += latency
+            if latency > stats.latency_max:
+                stats.latency_max = latency
+            _delivery_seconds.observe(latency)
+
+    # Heartbeats -----------------------------------------------------------
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Websocket heartbeat sweep failed: {str(e)}", exc_info=True)
+
+    def sweep(self, now: Optional[float] = None):
+        """Ping quiet connections and close idle and expired ones"""
+        now = time.monotonic() if now is None else now
+        self.lifecycle_stats["sweeps"] += 1
+        ping = None
+        for connection in self.connections.values():
+            if connection.close_code is not None:
+                continue
+            reason = None
+            if self.max_lifetime and now - connection.connected_at >= self.max_lifetime:
+                reason = "lifetime"
+            elif self.idle_timeout and now - connection.last_seen >= self.idle_timeout:
+                reason = "idle"
+            if reason is not None:
+                self.lifecycle_stats[reason + "_closed"] += 1
+                logger.info("Closing websocket", extra={
+                    "event": "ws.timeout", "doc_id": connection.document_id, "reason": reason
+                })
+                # Its sender closes the socket and removes it
+                connection.close_code = 1001
+                connection.queue.clear()
+                connection.wakeup.set()
+            elif self.ping_interval and now - connection.last_seen >= self.ping_interval and not connection.queue:
+                # A client with frames still queued has not caught up; no point asking it
+                if ping is None:
+                    ping = Frame({"type": "ping"})
+                self._enqueue(connection, ping, time.perf_counter(), self.fanout_stats[connection.document_id])
+                self.lifecycle_stats["pings"] += 1
+
+    # Presence ------------------------------------------------------------
+
+    def send_presence(self, websocket: WebSocket, document_id: str):
+        """Queue the full member list for a newcomer, with its own session id"""
+        connection = self.active_connections.get(document_id, {}).get(websocket)
+        if connection is not None and connection.presence:
+            self.send(websocket, document_id, self.presence.snapshot(document_id, connection.session_id))
+
+    def update_presence(self, websocket: WebSocket, document_id: str, message: dict):
+        """Take a ``cursor`` message; it goes out with the next tick"""
+        connection = self.active_connections.get(document_id, {}).get(websocket)
+        if connection is None:
+            return
+        cursor = message.get("cursor")
+        selection = message.get("selection")
+        if not _is_position(cursor):
+            cursor = None
+        if not (isinstance(selection, list) and len(selection) == 2 and all(map(_is_position, selection))):
+            selection = None
+        if self.presence.update(document_id, connection.session_id, cursor, selection):
+            self._presence_changed()
+
+    def _presence_changed(self):
+        if self._presence_wakeup is not None:
+            self._presence_wakeup.set()
+
+    async def _presence_loop(self):
+        while True:
+            await self._presence_wakeup.wait()
+            self._presence_wakeup.clear()
+            try:
+                await self.flush_presence()
+            except Exception as e:
+                logger.error(f"Presence tick failed: {str(e)}", exc_info=True)
+            # At most one delta per document per tick, however fast cursors move
+            await asyncio.sleep(self.presence_interval)
+
+    async def flush_presence(self):
+        """Send every document's coalesced presence changes"""
+        for document_id, delta in self.presence.drain().items():
+            frame = Frame(delta)
+            self._fan_out_presence(document_id, frame)
+            await self.backplane.publish(document_id, frame.encode(JSON))
+
+    def _fan_out_presence(self, document_id: str, frame: Frame):
+        connections = self.active_connections.get(document_id)
+        if not connections:
+            return
+        stats = self.fanout_stats[document_id]
+        stats.broadcasts += 1
+        snapshot = None
+        now = time.perf_counter()
+        for connection in connections.values():
+            if not connection.presence:
+                continue
+            if len(connection.queue) >= self.queue_size // 2:
+                # Cursors are disposable; never let them push a client into a resync
+                connection.presence_behind = True
+                stats.dropped += 1
+                continue
+            if connection.presence_behind:
+                if snapshot is None:
+                    snapshot = Frame(self.presence.snapshot(document_id))
+                connection.presence_behind = False
+                self._enqueue(connection, snapshot, now, stats)
+            else:
+                self._enqueue(connection, frame, now, stats)
+
+    def metrics(self) -> dict:
+        return {doc_id: stats.as_dict() for doc_id, stats in self.fanout_stats.items()}
+
+# Create and export the manager shared by REST routes and the websocket endpoint
+manager = ConnectionManager(
+    create_backplane(BROADCAST_BACKEND, REDIS_URL),
+    queue_size=WS_SEND_QUEUE_SIZE,
+    slow_consumer_policy=WS_SLOW_CONSUMER_POLICY,
+    send_timeout=WS_SEND_TIMEOUT_SECONDS,
+    presence_tick_hz=PRESENCE_TICK_HZ,
+    ping_interval=WS_PING_INTERVAL_SECONDS,
+    idle_timeout=WS_IDLE_TIMEOUT_SECONDS,
+    max_lifetime=WS_MAX_LIFETIME_SECONDS
+)
+
+# Live OT state for open documents, written back to Mongo in batches
+documents = DocumentStore(
+    max_documents=DOC_CACHE_MAX_DOCUMENTS,
+    max_bytes=DOC_CACHE_MAX_BYTES,
+    flush_interval_ms=DOC_FLUSH_INTERVAL_MS,
+    flush_max_ops=DOC_FLUSH_MAX_OPS,
+    history_limit=OT_HISTORY_LIMIT,
+    rope_min_chars=DOC_ROPE_MIN_CHARS,
+    chunk_size=DOC_CHUNK_SIZE,
+    journal=Journal(
+        JOURNAL_DIR,
+        segment_bytes=JOURNAL_SEGMENT_BYTES,
+        commit_interval_ms=JOURNAL_COMMIT_INTERVAL_MS,
+        commit_max_entries=JOURNAL_COMMIT_MAX_ENTRIES,
+        fsync=JOURNAL_FSYNC
+    ) if JOURNAL_DIR else None,
+    history=HistoryStore(
+        snapshot_every_ops=HISTORY_SNAPSHOT_EVERY_OPS,
+        snapshot_every_bytes=HISTORY_SNAPSHOT_EVERY_BYTES,
+        keep_op_snapshots=HISTORY_KEEP_OP_SNAPSHOTS,
+        chunk_size=DOC_CHUNK_SIZE
+    ),
+    search=SearchIndex(
+        batch_size=SEARCH_INDEX_BATCH,
+        interval_ms=SEARCH_INDEX_INTERVAL_MS,
+        max_terms=SEARCH_MAX_TERMS,
+        prefix_expansions=SEARCH_PREFIX_EXPANSIONS,
+        max_postings_per_term=SEARCH_MAX_POSTINGS_PER_TERM
+    )
+)
+
+def snapshot_message(state: DocumentState, kind: str = "snapshot") -> dict:
+    return {"type": kind, "rev": state.revision, "content": state.content}
+
+# How (re)connecting clients were brought up to date
+session_stats = {"resumed": 0, "snapshots": 0, "ops_replayed": 0}
+
+# In-flight op log reads, so a reconnect storm reads each document's ops once
+_backfills: Dict[str, "asyncio.Task"] = {}
+
+async def fetch_missed(state: DocumentState, since: Optional[int]) -> Optional[List[Tuple[int, list]]]:
+    """Ops after ``since`` from the op log, for when memory no longer has
+    them (e.g. after a restart). They are also put back into the in-memory
+    history for the clients that follow. Call before connecting; pass the
+    result to catch_up_messages."""
+    if since is None or documents.history is None:
+        return None
+    while state.ops_since(since) is None:
+        # Beyond the in-memory history length a snapshot is the cheaper catch-up
+        if since < 0 or state.revision - since > documents.history_limit:
+            return None
+        pending = _backfills.get(state.doc_id)
+        if pending is None:
+            pending = _backfills[state.doc_id] = asyncio.ensure_future(_backfill(state, since))
+            pending.add_done_callback(lambda _, doc_id=state.doc_id: _backfills.pop(doc_id, None))
+            return await pending
+        # Someone else is reading this document's ops; see if they cover us
+        await asyncio.wait((pending,))
+    return None
+
+async def _backfill(state: DocumentState, since: int) -> Optional[List[Tuple[int, list]]]:
+    logged = await documents.history.ops_after(state.doc_id, since, state.oldest_revision)
+    if logged:
+        state.backfill_history([(revision, TextOperation.from_json(ops)) for revision, ops in logged])
+    return logged
+
+def catch_up_messages(state: DocumentState, since: Optional[int] = None,
+                      logged: Optional[List[Tuple[int, list]]] = None) -> List[dict]:
+    """What a client needs on connect: the ops it missed since ``since``, or
+    a snapshot when that is unknown or no longer in the history"""
+    missed = None
+    if since is not None:
+        recent = state.ops_since(since)
+        if recent is None and logged:
+            # The op log covered since..L; memory must cover what came after
+            recent = state.ops_since(logged[-1][0])
+            if recent is not None:
+                missed = logged + [(revision, op.to_json()) for revision, op in recent]
+        elif recent is not None:
+            missed = [(revision, op.to_json()) for revision, op in recent]
+    if missed is None:
+        session_stats["snapshots"] += 1
+        return [snapshot_message(state)]
+    session_stats["resumed"] += 1
+    session_stats["ops_replayed"] += len(missed)
+    messages = [{"type": "resume", "since": since, "rev": state.revision}]
+    messages.extend({"type": "op", "rev": revision, "ops": ops} for revision, ops in missed)
+    return messages
+
+def _latest_snapshot(document_id: str) -> Optional[dict]:
+    state = documents.get(document_id)
+    return snapshot_message(state, "resync") if state is not None else None
+
+manager.snapshot_provider = _latest_snapshot
+
+# Aggregates only: /metrics is unauthenticated, and a label per document would
+# both leak document IDs and grow without bound
+registry.collect(
+    "realdoc_ws_connections", "Open websockets on this worker",
+    lambda: [((), manager.connection_count)]
+)
+registry.collect(
+    "realdoc_ws_open_documents", "Documents with at least one open websocket on this worker",
+    lambda: [((), len(manager.active_connections))]
+)
+registry.collect(
+    "realdoc_ws_connections_per_document", "Open websockets per open document on this worker",
+    lambda: [len(connections) for connections in manager.active_connections.values()],
+    kind="histogram"
+)
+registry.collect(
+    "realdoc_ws_timeouts_total", "Websockets closed by the server for being idle or open too long",
+    lambda: [((("reason", "idle"),), manager.lifecycle_stats["idle_closed"]),
+             ((("reason", "lifetime"),), manager.lifecycle_stats["lifetime_closed"])],
+    kind="counter"
+)
+
+async def handle_message(websocket: WebSocket, manager: ConnectionManager,
+                         state: DocumentState, message: dict, user: Optional[str] = None):
+    """Apply one client message to the document and fan it out.
+
+    ``op`` messages carry a delta against ``rev``; the sender gets an ``ack``
+    with the new revision and everyone else the transformed op.
+    ``content_update`` replaces the whole body and is kept as a fallback.
+    Changes are attributed to ``user``, the authenticated sender.
+    """
+    kind = message.get('type')
+    if kind == 'op':
+        try:
+            op = TextOperation.from_json(message.get("ops"))
+            op = state.apply_client_op(message.get("rev"), op)
+        except OTError as e:
+            # Client is out of step: hand it the current state to rebase on
+            logger.info("Rejected op", extra={"event": "ws.op_rejected", "doc_id": state.doc_id, "error": e})
+            manager.send(websocket, state.doc_id, {
+                "type": "resync", "rev": state.revision, "content": state.content, "error": str(e)
+            })
+            return
+        state.edited_by(user)
+        # Nothing about the change leaves the server before it is journaled
+        barrier = documents.changed(state)
+        manager.send(websocket, state.doc_id, {"type": "ack", "rev": state.revision}, barrier)
+        await manager.broadcast(
+            {"type": "op", "rev": state.revision, "ops": op.to_json()},
+            state.doc_id,
+            exclude=websocket,
+            barrier=barrier
+        )
+    elif kind == 'cursor':
+        manager.update_presence(websocket, state.doc_id, message)
+    elif kind == 'ping':
+        manager.send(websocket, state.doc_id, {"type": "pong"})
+    elif kind == 'content_update':
+        content = message.get("content")
+        if not isinstance(content, str):
+            return
+        state.replace_content(content)
+        state.edited_by(user)
+        barrier = documents.changed(state)
+        manager.send(websocket, state.doc_id, {"type": "ack", "rev": state.revision}, barrier)
+        await manager.broadcast(
+            snapshot_message(state, "content_update"), state.doc_id, exclude=websocket, barrier=barrier
+        )
+
+async def throttle_message(connection: Connection, message: dict) -> bool:
+    """Hold a client to its message limits before its message is handled.
+
+    Returns False for a cursor update over the limit, which is dropped since
+    a newer one will follow. Anything else waits until the limits allow it;
+    raises RateLimitExceeded if that would take too long.
+    """
+    wait = message_limits.check(connection.session_id, connection.user, connection.document_id)
+    if not wait:
+        return True
+    if message.get("type") == "cursor":
+        message_limits.stats["dropped"] += 1
+        return False
+    if wait > message_limits.max_wait:
+        message_limits.stats["disconnected"] += 1
+        raise RateLimitExceeded(f"{wait:.1f}s over the message limit")
+    message_limits.stats["delayed"] += 1
+    # Not reading from the socket meanwhile pushes back on the client
+    while wait:
+        await asyncio.sleep(wait)
+        wait = message_limits.check(connection.session_id, connection.user, connection.document_id)
+    return True
+
+# Message types handle_message acts on; anything else is dropped unparsed
+HANDLED_TYPES = frozenset(("op", "content_update", "cursor", "ping"))
+
+async def receive_message(websocket: WebSocket, codec: Codec) -> Optional[dict]:
+    """Next decoded client message, or None for frames the server ignores"""
+    event = await websocket.receive()
+    if event["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(event.get("code", 1000))
+    data = event.get("text")
+    if data is None:
+        data = event.get("bytes")
+    kind = sniff_type(data)
+    if kind is not None and kind not in HANDLED_TYPES:
+        return None
+    try:
+        message = codec.decode(data)
+    except MessageTooLarge:
+        raise
+    except CodecError as e:
+        logger.info("Dropping undecodable frame", extra={"event": "ws.frame_dropped", "error": e})
+        return None
+    return message if isinstance(message, dict) else None
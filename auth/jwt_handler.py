@@ -1,17 +1,105 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from typing import Optional, Tuple
+import hashlib
+import time
+import uuid
 from jose import jwt, JWTError
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, WebSocket, status
 from fastapi.security import OAuth2PasswordBearer
-from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from config import (
+    SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, JWT_REFRESH_EXPIRE_HOURS,
+    JWT_CACHE_TTL_SECONDS, JWT_CACHE_MAX_ENTRIES, ADMIN_USERNAMES
+)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+# For routes that also serve anonymous clients
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
 
-def create_access_token(data: dict):
+ACCESS = "access"
+REFRESH = "refresh"
+
+# Browsers can't set headers on a websocket, so the token may arrive as the
+# second entry of Sec-WebSocket-Protocol: "bearer, <token>"
+WS_TOKEN_SUBPROTOCOL = "bearer"
+
+def _encode(data: dict, token_type: str, lifetime: timedelta) -> str:
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    to_encode.update({"exp": datetime.utcnow() + lifetime, "type": token_type})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+def create_access_token(data: dict):
+    return _encode(data, ACCESS, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+def create_refresh_token(data: dict):
+    # jti keeps refresh tokens issued in the same second distinct
+    return _encode({**data, "jti": uuid.uuid4().hex}, REFRESH, timedelta(hours=JWT_REFRESH_EXPIRE_HOURS))
+
+class TokenCache:
+    """Decoded claims of recently verified tokens.
+
+    Keyed by a hash of the token so raw tokens aren't kept in memory. An
+    entry lives until the token's own ``exp`` or ``ttl`` seconds, whichever
+    comes first; the least recently used entries go once ``max_entries`` is
+    reached. Failed verifications are never cached.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, token: str) -> Optional[dict]:
+        key = hashlib.sha256(token.encode()).digest()
+        entry = self._entries.get(key)
+        if entry is not None:
+            claims, expires_at = entry
+            if time.time() < expires_at:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return claims
+            del self._entries[key]
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, token: str, claims: dict):
+        expires_at = time.time() + self.ttl
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        key = hashlib.sha256(token.encode()).digest()
+        self._entries[key] = (claims, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def metrics(self) -> dict:
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["entries"] = len(self._entries)
+        return stats
+
+token_cache = TokenCache(ttl=JWT_CACHE_TTL_SECONDS, max_entries=JWT_CACHE_MAX_ENTRIES)
+
+def verify_token(token: str, token_type: str = ACCESS, cache: Optional[TokenCache] = token_cache) -> dict:
+    """Claims of a valid token of the given type; raises JWTError otherwise"""
+    claims = cache.get(token) if cache is not None else None
+    if claims is None:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if claims.get("sub") is None:
+            raise JWTError("Token has no subject")
+        if cache is not None:
+            cache.put(token, claims)
+    # Tokens issued before refresh support carry no type and are access tokens
+    if claims.get("type", ACCESS) != token_type:
+        raise JWTError(f"Expected a {token_type} token")
+    return claims
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
@@ -20,12 +108,41 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
+        username: str = verify_token(token)["sub"]
     except JWTError:
         raise credentials_exception
     
     # Here you would typically verify the user still exists in DB
     return username
+
+async def get_optional_user(token: Optional[str] = Depends(optional_oauth2_scheme)) -> Optional[str]:
+    """The current user, or None without a token; an invalid token is still a 401"""
+    if token is None:
+        return None
+    return await get_current_user(token)
+
+async def get_admin_user(username: str = Depends(get_current_user)):
+    """The current user if listed in ADMIN_USERNAMES, else 403"""
+    if username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return username
+
+def websocket_token(websocket: WebSocket) -> Tuple[Optional[str], Optional[str]]:
+    """(token, subprotocol to accept) from the handshake query or subprotocols"""
+    token = websocket.query_params.get("token")
+    if token:
+        return token, None
+    protocols = [p.strip() for p in websocket.headers.get("sec-websocket-protocol", "").split(",")]
+    if len(protocols) >= 2 and protocols[0] == WS_TOKEN_SUBPROTOCOL and protocols[1]:
+        return protocols[1], WS_TOKEN_SUBPROTOCOL
+    return None, None
+
+def authenticate_websocket(websocket: WebSocket) -> Tuple[Optional[str], Optional[str]]:
+    """(username, subprotocol) for a handshake; username is None if unauthenticated"""
+    token, subprotocol = websocket_token(websocket)
+    if token is None:
+        return None, None
+    try:
+        return verify_token(token)["sub"], subprotocol
+    except JWTError:
+        return None, None
@@ -0,0 +1,133 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import asyncio
+import logging
+import time
+
+from config import (
+    BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE, PASSWORD_REHASH_ON_LOGIN
+)
+from telemetry.metrics import password_queue_seconds, registry
+
+logger = logging.getLogger(__name__)
+
+_queue_seconds = password_queue_seconds.labels()
+
+class HasherBusyError(RuntimeError):
+    """Too many hash/verify calls are already waiting; the caller should back off"""
+
+class PasswordHasher:
+    """bcrypt hashing off the event loop.
+
+    bcrypt releases the GIL, so a small thread pool runs hashes in parallel
+    while websocket traffic keeps flowing. Calls beyond ``workers`` wait on a
+    semaphore; beyond ``max_queue`` waiting calls they are rejected.
+    """
+
+    def __init__(self, rounds: int = 12, workers: int = 4, max_queue: int = 256,
+                 rehash_on_login: bool = True):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rehash_on_login = rehash_on_login
+        self._context = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.stats = {
+            "in_flight": 0,
+            "waiting": 0,
+            "max_waiting": 0,
+            "completed": 0,
+            "rejected": 0,
+            "rehashed": 0,
+            "queue_time_total": 0.0,
+            "queue_time_max": 0.0,
+        }
+
+    def start(self):
+        from passlib.context import CryptContext
+
+        if self._context is not None:
+            return
+        self._context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=self.rounds)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._slots = asyncio.Semaphore(self.workers)
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._context = None
+        self._executor = None
+        self._slots = None
+
+    async def _run(self, fn, *args):
+        if self._context is None:
+            self.start()
+        stats = self.stats
+        queued_at = time.perf_counter()
+        if self._slots.locked():
+            # Every worker is busy: queue up, unless the queue is already full
+            if stats["waiting"] >= self.max_queue:
+                stats["rejected"] += 1
+                raise HasherBusyError("Password hashing queue is full")
+            stats["waiting"] += 1
+            stats["max_waiting"] = max(stats["max_waiting"], stats["waiting"])
+            try:
+                await self._slots.acquire()
+            finally:
+                stats["waiting"] -= 1
+        else:
+            await self._slots.acquire()
+        waited = time.perf_counter() - queued_at
+        stats["queue_time_total"] += waited
+        stats["queue_time_max"] = max(stats["queue_time_max"], waited)
+        _queue_seconds.observe(waited)
+        stats["in_flight"] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            stats["in_flight"] -= 1
+            stats["completed"] += 1
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self._context_hash, password)
+
+    async def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Check a password; also returns a new hash when the stored one is outdated"""
+        if not self.rehash_on_login:
+            return await self._run(self._context_verify, password, hashed), None
+        valid, new_hash = await self._run(self._context_verify_and_update, password, hashed)
+        if new_hash is not None:
+            self.stats["rehashed"] += 1
+        return valid, new_hash
+
+    def _context_hash(self, password):
+        return self._context.hash(password)
+
+    def _context_verify(self, password, hashed):
+        return self._context.verify(password, hashed)
+
+    def _context_verify_and_update(self, password, hashed):
+        return self._context.verify_and_update(password, hashed)
+
+    def metrics(self) -> dict:
+        stats = dict(self.stats)
+        completed = stats["completed"]
+        stats["queue_time_mean_ms"] = round(stats.pop("queue_time_total") / completed * 1000, 3) if completed else 0.0
+        stats["queue_time_max_ms"] = round(stats.pop("queue_time_max") * 1000, 3)
+        return stats
+
+# Shared instance; started from the app lifespan
+password_hasher = PasswordHasher(
+    rounds=BCRYPT_ROUNDS,
+    workers=PASSWORD_HASH_WORKERS,
+    max_queue=PASSWORD_HASH_MAX_QUEUE,
+    rehash_on_login=PASSWORD_REHASH_ON_LOGIN
+)
+
+registry.collect(
+    "realdoc_password_hash_calls", "bcrypt calls running or waiting for a worker",
+    lambda: [((("state", "running"),), password_hasher.stats["in_flight"]),
+             ((("state", "waiting"),), password_hasher.stats["waiting"])]
+)
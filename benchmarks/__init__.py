@@ -0,0 +1,2 @@
+# Benchmarks for realdoc-api hot paths.
+# Run a module directly, e.g. `python -m benchmarks.bench_mongo_pool`.
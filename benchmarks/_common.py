@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import asyncio
+import statistics
+
+# config.py refuses to import without a URI; benchmarks default to a local one
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+
+BENCH_MONGO_URI = os.getenv("BENCH_MONGO_URI", "")
+BENCH_DB_NAME = os.getenv("BENCH_DB_NAME", "realdoc-bench")
+
+def client_factory():
+    """Return a callable building clients that all see the same data.
+
+    Uses a real mongod when BENCH_MONGO_URI is set, otherwise mongomock-motor
+    clients sharing one in-memory store.
+    """
+    if BENCH_MONGO_URI:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return lambda **kwargs: AsyncIOMotorClient(BENCH_MONGO_URI, **kwargs)
+    import mongomock
+    from mongomock.store import ServerStore
+    from mongomock_motor import AsyncMongoMockClient
+    store = ServerStore()
+    return lambda **kwargs: AsyncMongoMockClient(mock_mongo_client=mongomock.MongoClient(_store=store))
+
+def make_client():
+    return client_factory()()
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+def summarize(samples, elapsed=None):
+    """Latency summary in milliseconds for a list of second-valued samples"""
+    ms = [s * 1000 for s in samples]
+    result = {
+        "count": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 4) if ms else 0.0,
+        "p50_ms": round(percentile(ms, 50), 4),
+        "p95_ms": round(percentile(ms, 95), 4),
+        "p99_ms": round(percentile(ms, 99), 4),
+    }
+    if elapsed:
+        result["throughput_per_s"] = round(len(ms) / elapsed, 2)
+    return result
+
+async def run_concurrent(fn, total, concurrency):
+    """Call the coroutine fn() `total` times with `concurrency` in flight"""
+    samples = []
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            await fn()
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - start
+
+def asgi_client(app):
+    import httpx
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+def report(name, results, backend=None):
+    if backend is None:
+        backend = "mongod" if BENCH_MONGO_URI else "mongomock"
+    print(json.dumps({"benchmark": name, "backend": backend, "results": results},
+                     indent=2, sort_keys=True))
@@ -0,0 +1,72 @@
+"""Cross-node fan-out latency through the Redis backplane.
+
+    python -m benchmarks.bench_backplane [--messages 1000] [--subscribers 50]
+
+Node A broadcasts; node B has `subscribers` sockets on the same document
+and records publish-to-delivery latency. Uses BENCH_REDIS_URL when set,
+otherwise an in-process fakeredis TCP server as the broker.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import threading
+import time
+
+from benchmarks._common import summarize, report
+
+class TimingWebSocket:
+    def __init__(self, samples):
+        self.samples = samples
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message):
+        self.samples.append(time.perf_counter() - float(message))
+
+def start_fake_broker():
+    import fakeredis
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = fakeredis.TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}"
+
+async def main(messages, subscribers):
+    from api.backplane import RedisBackplane
+    from api.websocket import ConnectionManager
+
+    url = os.getenv("BENCH_REDIS_URL") or start_fake_broker()
+    node_a = ConnectionManager(RedisBackplane(url))
+    node_b = ConnectionManager(RedisBackplane(url))
+    await node_a.start()
+    await node_b.start()
+    samples = []
+    for _ in range(subscribers):
+        await node_b.connect(TimingWebSocket(samples), "bench-doc")
+    await asyncio.sleep(0.1)
+
+    start = time.perf_counter()
+    for _ in range(messages):
+        await node_a.broadcast(repr(time.perf_counter()), "bench-doc")
+    deadline = time.perf_counter() + 30
+    while len(samples) < messages * subscribers and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    await node_a.stop()
+    await node_b.stop()
+    result = summarize(samples, elapsed)
+    result["expected_deliveries"] = messages * subscribers
+    report("backplane_fan_out", {"cross_node": result},
+           backend="redis" if os.getenv("BENCH_REDIS_URL") else "fakeredis")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--subscribers", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.messages, args.subscribers))
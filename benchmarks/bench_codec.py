@@ -0,0 +1,90 @@
+"""Encode/decode cost and bytes on the wire for typical websocket messages.
+
+    python -m benchmarks.bench_codec [--iterations 2000] [--snapshot-kb 100]
+
+Also compares encoding one broadcast per recipient (the old behaviour)
+against encoding once and reusing the bytes.
+"""
+import argparse
+import json
+import random
+import string
+import time
+
+from benchmarks._common import report
+from api.codec import CodecError, Frame, negotiate
+
+def sample_messages(snapshot_kb):
+    rng = random.Random(3)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(500)]
+    content = " ".join(rng.choice(words) for _ in range(snapshot_kb * 180))[:snapshot_kb * 1024]
+    return {
+        "op": {"type": "op", "rev": 1042, "ops": [5120, "h", 20480]},
+        "snapshot": {"type": "snapshot", "rev": 1042, "content": content},
+    }
+
+def time_per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def bench_codecs(messages, iterations):
+    results = {}
+    stdlib = {
+        "encode_us": {}, "decode_us": {}, "bytes": {},
+    }
+    for kind, message in messages.items():
+        n = iterations if kind == "op" else max(iterations // 20, 10)
+        text = json.dumps(message)
+        stdlib["encode_us"][kind] = round(time_per_call(lambda: json.dumps(message), n), 3)
+        stdlib["decode_us"][kind] = round(time_per_call(lambda: json.loads(text), n), 3)
+        stdlib["bytes"][kind] = len(text.encode())
+    results["json_stdlib"] = stdlib
+
+    for name in ("json", "msgpack"):
+        for compression in (None, "deflate", "zstd"):
+            try:
+                codec = negotiate(name, compression)
+            except CodecError as e:
+                results[f"{name}+{compression}"] = {"skipped": str(e)}
+                continue
+            row = {"encode_us": {}, "decode_us": {}, "bytes": {}}
+            for kind, message in messages.items():
+                n = iterations if kind == "op" else max(iterations // 20, 10)
+                encoded = codec.encode(message)
+                row["encode_us"][kind] = round(time_per_call(lambda: codec.encode(message), n), 3)
+                row["decode_us"][kind] = round(time_per_call(lambda: codec.decode(encoded), n), 3)
+                row["bytes"][kind] = len(encoded.encode() if isinstance(encoded, str) else encoded)
+            results[name if compression is None else f"{name}+{compression}"] = row
+    return results
+
+def bench_fan_out_encoding(message, recipients):
+    """One broadcast to `recipients` JSON clients"""
+    codec = negotiate("json")
+
+    def per_recipient():
+        for _ in range(recipients):
+            json.dumps(message)
+
+    def encode_once():
+        frame = Frame(message)
+        for _ in range(recipients):
+            frame.encode(codec)
+
+    return {
+        "recipients": recipients,
+        "encode_per_recipient_us": round(time_per_call(per_recipient, 5), 1),
+        "encode_once_us": round(time_per_call(encode_once, 5), 1),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--snapshot-kb", type=int, default=100)
+    parser.add_argument("--recipients", type=int, default=100)
+    args = parser.parse_args()
+    messages = sample_messages(args.snapshot_kb)
+    results = bench_codecs(messages, args.iterations)
+    results["snapshot_broadcast"] = bench_fan_out_encoding(messages["snapshot"], args.recipients)
+    report("codec", results, backend="cpu")
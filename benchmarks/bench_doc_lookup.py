@@ -0,0 +1,53 @@
+"""find_one({"doc_id": ...}) latency with and without the schema bootstrap indexes.
+
+    python -m benchmarks.bench_doc_lookup [--sizes 10000,100000,1000000] [--lookups 500]
+
+Seeds each collection size from scratch. Use BENCH_MONGO_URI for realistic
+numbers; mongomock ignores indexes and always scans.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks._common import BENCH_DB_NAME, make_client, summarize, report
+from db.schema import ensure_schema
+
+SEED_BATCH = 10000
+
+async def seed(db, size):
+    await db.documents.drop()
+    for start in range(0, size, SEED_BATCH):
+        await db.documents.insert_many([
+            {"doc_id": f"doc-{i}", "content": "", "updated_at": i}
+            for i in range(start, min(start + SEED_BATCH, size))
+        ], ordered=False)
+
+async def measure(db, size, lookups):
+    rng = random.Random(size)
+    samples = []
+    for _ in range(lookups):
+        doc_id = f"doc-{rng.randrange(size)}"
+        start = time.perf_counter()
+        await db.documents.find_one({"doc_id": doc_id})
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+async def main(sizes, lookups):
+    db = make_client()[BENCH_DB_NAME]
+    results = {}
+    for size in sizes:
+        await seed(db, size)
+        unindexed = await measure(db, size, lookups)
+        await ensure_schema(db)
+        indexed = await measure(db, size, lookups)
+        results[str(size)] = {"no_index": unindexed, "doc_id_unique_index": indexed}
+    await db.documents.drop()
+    report("doc_id_lookup", results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--lookups", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main([int(s) for s in args.sizes.split(",")], args.lookups))
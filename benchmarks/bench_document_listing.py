@@ -0,0 +1,125 @@
+"""Deep pages of GET /api/documents: keyset pagination against skip/limit.
+
+    python -m benchmarks.bench_document_listing [--documents N] [--users 10]
+                                                [--limit 20] [--depths 1,100,1000]
+
+Seeds --documents metadata rows owned by --users users (round robin, one in
+ten also shared with the next user), then times fetching page --depths of one
+user's listing both ways, with the same sort and projection:
+
+keyset:  DocumentStore.list_documents from the previous page's last
+         (updated_at, _id), as the endpoint's cursor does
+offset:  find().sort().skip(depth * limit).limit(limit)
+
+The cursor for each depth comes from an untimed skip query first. With
+BENCH_MONGO_URI the default is a million documents, the schema's indexes are
+applied, and ``keys_examined`` is explain()'s totalKeysExamined for each
+query: flat for keyset, growing with depth for offset. mongomock scans every
+row whatever the query, so there the default is 20k and only the shape of
+the comparison means anything.
+"""
+import os
+import argparse
+import asyncio
+import datetime
+import statistics
+import time
+
+os.environ.setdefault("JOURNAL_DIR", "")
+
+from benchmarks._common import BENCH_DB_NAME, BENCH_MONGO_URI, make_client, report
+from collab.store import LISTING_PROJECTION, DocumentStore
+from db.schema import INDEXES, ensure_schema
+
+SORT = [("updated_at", -1), ("_id", -1)]
+SEED_BATCH = 10000
+
+async def seed(db, count, users):
+    await db.documents.drop()
+    if BENCH_MONGO_URI:
+        await ensure_schema(db, {"documents": INDEXES["documents"]})
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    for base in range(0, count, SEED_BATCH):
+        batch = []
+        for i in range(base, min(base + SEED_BATCH, count)):
+            row = {
+                "doc_id": f"doc-{i:07d}", "title": f"Document {i}", "size": 1000, "revision": 1,
+                "owner": f"user-{i % users}",
+                # Whole seconds, so plenty of rows share an updated_at and _id settles ties
+                "updated_at": start + datetime.timedelta(seconds=i // 4),
+            }
+            if i % 10 == 0:
+                row["collaborators"] = [f"user-{(i + 1) % users}"]
+            batch.append(row)
+        await db.documents.insert_many(batch, ordered=False)
+
+def offset_query(user):
+    return {"$or": [{"owner": user}, {"collaborators": user}]}
+
+async def keys_examined(cursor):
+    plan = await cursor.explain()
+    return plan.get("executionStats", {}).get("totalKeysExamined")
+
+async def timed(fetch, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fetch()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+async def main(args):
+    db = make_client()[BENCH_DB_NAME]
+    start = time.perf_counter()
+    await seed(db, args.documents, args.users)
+    results = {"documents": args.documents, "users": args.users, "limit": args.limit,
+               "seed_s": round(time.perf_counter() - start, 1), "depths": {}}
+    store = DocumentStore()
+    await store.start(db.documents)
+    user = "user-0"
+    try:
+        for depth in [int(d) for d in args.depths.split(",")]:
+            skip = (depth - 1) * args.limit
+            after = None
+            if skip:
+                previous = await db.documents.find(offset_query(user), {"updated_at": 1}).sort(SORT).skip(
+                    skip - 1).limit(1).to_list(None)
+                if not previous:
+                    break
+                after = (previous[0]["updated_at"], previous[0]["_id"])
+            keyset_rows, _ = await store.list_documents(user, args.limit, after)
+            offset_rows = await db.documents.find(offset_query(user), LISTING_PROJECTION).sort(SORT).skip(
+                skip).limit(args.limit).to_list(None)
+            # Same page either way
+            assert [row["_id"] for row in keyset_rows] == [row["_id"] for row in offset_rows]
+
+            result = {
+                "keyset_ms": await timed(lambda: store.list_documents(user, args.limit, after), args.repeat),
+                "offset_ms": await timed(
+                    lambda: db.documents.find(offset_query(user), LISTING_PROJECTION).sort(SORT).skip(
+                        skip).limit(args.limit).to_list(None), args.repeat),
+            }
+            if BENCH_MONGO_URI:
+                keyset_query = offset_query(user)
+                if after is not None:
+                    keyset = {"updated_at": {"$lte": after[0]},
+                              "$or": [{"updated_at": {"$lt": after[0]}}, {"_id": {"$lt": after[1]}}]}
+                    keyset_query = {"$or": [dict(branch, **keyset) for branch in keyset_query["$or"]]}
+                result["keyset_keys_examined"] = await keys_examined(
+                    db.documents.find(keyset_query, LISTING_PROJECTION).sort(SORT).limit(args.limit + 1))
+                result["offset_keys_examined"] = await keys_examined(
+                    db.documents.find(offset_query(user), LISTING_PROJECTION).sort(SORT).skip(skip).limit(args.limit))
+            results["depths"][str(depth)] = result
+    finally:
+        await store.stop()
+        await db.documents.drop()
+    report("document_listing", results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=1000000 if BENCH_MONGO_URI else 20000)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--depths", default="1,10,100,1000,4500" if BENCH_MONGO_URI else "1,10,50,100")
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,99 @@
+"""Single-document read latency and batch-fetch throughput.
+
+    python -m benchmarks.bench_document_reads [--docs 500] [--requests 1000] [--batch 50]
+
+single_cold: GET /api/documents/{id} with the store cache emptied each time
+             (one projected find_one)
+single_hot:  the same GET answered from the cache
+missing:     GET of an unknown id (a 404 that writes nothing)
+batch:       `--batch` documents as that many GETs vs one
+             POST /api/documents:batchGet
+"""
+import os
+
+os.environ.setdefault("JOURNAL_DIR", "")
+
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks._common import BENCH_DB_NAME, asgi_client, make_client, report, summarize
+
+async def timed(samples, call):
+    start = time.perf_counter()
+    response = await call
+    samples.append(time.perf_counter() - start)
+    return response
+
+async def main(args):
+    from fastapi import FastAPI
+    from api import routes
+
+    db = make_client()[BENCH_DB_NAME]
+    await db.documents.drop()
+    await db.documents.insert_many([
+        {"doc_id": f"doc-{i}", "content": "x" * args.doc_bytes, "revision": 1} for i in range(args.docs)
+    ])
+    store = routes.live_documents
+    await store.start(db.documents)
+    app = FastAPI()
+    app.include_router(routes.router, prefix="/api")
+    rng = random.Random(1)
+    results = {}
+    async with asgi_client(app) as http:
+        cold = []
+        for _ in range(args.requests):
+            store._states.clear()
+            await timed(cold, http.get(f"/api/documents/doc-{rng.randrange(args.docs)}"))
+        results["single_cold"] = summarize(cold)
+
+        hot = []
+        for _ in range(args.requests):
+            await timed(hot, http.get("/api/documents/doc-0"))
+        results["single_hot"] = summarize(hot)
+
+        missing = []
+        for i in range(args.requests):
+            await timed(missing, http.get(f"/api/documents/missing-{i}"))
+        results["missing"] = summarize(missing)
+        results["missing"]["documents_created"] = await db.documents.count_documents(
+            {"doc_id": {"$regex": "^missing-"}}
+        )
+
+        rounds = max(args.requests // args.batch, 1)
+        per_get, batched = [], []
+        start = time.perf_counter()
+        for _ in range(rounds):
+            store._states.clear()
+            ids = [f"doc-{i}" for i in rng.sample(range(args.docs), args.batch)]
+            call_start = time.perf_counter()
+            for doc_id in ids:
+                await http.get(f"/api/documents/{doc_id}")
+            per_get.append(time.perf_counter() - call_start)
+        per_get_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(rounds):
+            store._states.clear()
+            ids = [f"doc-{i}" for i in rng.sample(range(args.docs), args.batch)]
+            await timed(batched, http.post("/api/documents:batchGet", json={"doc_ids": ids}))
+        batched_elapsed = time.perf_counter() - start
+        results["batch"] = {
+            "individual_gets": summarize(per_get, per_get_elapsed),
+            "batch_get": summarize(batched, batched_elapsed),
+            "documents_per_s_individual": round(rounds * args.batch / per_get_elapsed, 1),
+            "documents_per_s_batch": round(rounds * args.batch / batched_elapsed, 1),
+        }
+    await store.stop()
+    store._states.clear()
+    await db.documents.drop()
+    report("document_reads", results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--doc-bytes", type=int, default=2048)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args))
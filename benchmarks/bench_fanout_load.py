@@ -0,0 +1,96 @@
+"""Fan-out to many clients on one document with a few deliberately slow ones.
+
+    python -m benchmarks.bench_fanout_load [--clients 1000] [--slow 10] [--messages 100]
+
+Compares the old serial broadcast (await every send in turn) with the
+queued ConnectionManager. Latency is broadcast-to-delivery for the fast
+clients; slow clients sleep `--slow-delay-ms` in every send.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks._common import summarize, report
+
+class SimulatedClient:
+    def __init__(self, samples, delay=0.0):
+        self.samples = samples
+        self.delay = delay
+        self.received = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received += 1
+        if self.samples is not None:
+            self.samples.append(time.perf_counter() - json.loads(message)["t"])
+
+    async def close(self, code=1000):
+        pass
+
+def make_clients(count, slow, slow_delay):
+    """Slow clients are spread through the join order, as they would be live"""
+    fast_samples = []
+    step = count // slow if slow else count + 1
+    clients = [
+        SimulatedClient(None, slow_delay) if slow and i % step == 0 and i // step < slow
+        else SimulatedClient(fast_samples)
+        for i in range(count)
+    ]
+    return clients, fast_samples
+
+async def serial(args):
+    clients, samples = make_clients(args.clients, args.slow, args.slow_delay_ms / 1000)
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        message = json.dumps({"type": "op", "t": time.perf_counter()})
+        for client in clients:
+            await client.send_text(message)
+        await asyncio.sleep(args.interval_ms / 1000)
+    return summarize(samples, time.perf_counter() - start)
+
+async def queued(args, policy):
+    from api.websocket import ConnectionManager
+
+    manager = ConnectionManager(queue_size=args.queue_size, slow_consumer_policy=policy)
+    manager.snapshot_provider = lambda doc_id: {"type": "resync", "t": time.perf_counter()}
+    clients, samples = make_clients(args.clients, args.slow, args.slow_delay_ms / 1000)
+    for client in clients:
+        await manager.connect(client, "load-doc")
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        await manager.broadcast({"type": "op", "t": time.perf_counter()}, "load-doc")
+        await asyncio.sleep(args.interval_ms / 1000)
+    expected = args.messages * (args.clients - args.slow)
+    deadline = time.perf_counter() + 30
+    while len(samples) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    result = summarize(samples, time.perf_counter() - start)
+    result.update(manager.metrics().get("load-doc", {}))
+    await manager.stop()
+    return result
+
+async def main(args):
+    results = {
+        "queued_coalesce": await queued(args, "coalesce"),
+        "queued_disconnect": await queued(args, "disconnect"),
+    }
+    if not args.skip_serial:
+        results["serial_baseline"] = await serial(args)
+    report("fanout_load", results, backend="cpu")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--slow", type=int, default=10)
+    parser.add_argument("--slow-delay-ms", type=float, default=50)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--interval-ms", type=float, default=10)
+    parser.add_argument("--queue-size", type=int, default=32)
+    parser.add_argument("--skip-serial", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args))
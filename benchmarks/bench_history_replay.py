@@ -0,0 +1,95 @@
+"""Point-in-time reconstruction cost versus history length.
+
+    python -m benchmarks.bench_history_replay [--lengths 500,2000,8000] [--snapshot-every 200]
+
+Builds documents with N keystroke ops through the DocumentStore, then reads
+random past revisions. With snapshots the replayed tail, and so the replay
+time, stays bounded by the snapshot interval; without them it grows with N.
+
+``replay`` times only rebuilding the content from the fetched entries.
+``total`` also includes the queries; mongomock scans the whole collection
+for those, so set BENCH_MONGO_URI to see indexed query cost.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks._common import BENCH_DB_NAME, make_client, report, summarize
+from collab.history import HistoryStore, replay
+from collab.ot import TextOperation
+from collab.store import DocumentStore
+from db.schema import INDEXES, ensure_schema
+
+async def build(db, doc_id, length, snapshot_every, flush_every):
+    # keep_op_snapshots is large so the no-snapshot case can replay everything
+    history = HistoryStore(snapshot_every_ops=snapshot_every, snapshot_every_bytes=1 << 60,
+                           keep_op_snapshots=1 << 30)
+    history.start(db.document_ops, db.document_snapshots)
+    store = DocumentStore(flush_interval_ms=60000, history=history)
+    await store.start(db.documents)
+    state = await store.open(doc_id)
+    rng = random.Random(7)
+    for i in range(length):
+        pos = rng.randint(0, len(state.content))
+        state.apply_client_op(state.revision, TextOperation.from_edit(len(state.content), pos, 0, "x"))
+        store.changed(state)
+        if (i + 1) % flush_every == 0:
+            await store.flush()
+    await store.stop()
+    return history
+
+async def measure(history, doc_id, length, reads):
+    rng = random.Random(11)
+    totals = []
+    replays = []
+    for _ in range(reads):
+        revision = rng.randint(1, length)
+        start = time.perf_counter()
+        await history.reconstruct(doc_id, revision)
+        totals.append(time.perf_counter() - start)
+        snapshot = await history.snapshots.find_one(
+            {"doc_id": doc_id, "rev": {"$lte": revision}}, sort=[("rev", -1)]
+        )
+        base_revision, content = (snapshot["rev"], snapshot["content"]) if snapshot else (0, "")
+        entries = await history.ops.find(
+            {"doc_id": doc_id, "rev": {"$gt": base_revision, "$lte": revision}}
+        ).sort("rev", 1).to_list(None)
+        start = time.perf_counter()
+        replay(content, entries)
+        replays.append(time.perf_counter() - start)
+    return {
+        "total": summarize(totals),
+        "replay": summarize(replays),
+        "max_replayed_ops": history.metrics()["max_replayed_ops"],
+    }
+
+async def main(lengths, snapshot_every, flush_every, reads):
+    db = make_client()[BENCH_DB_NAME]
+    for name in ("documents", "document_ops", "document_snapshots"):
+        await db[name].drop()
+    await ensure_schema(db, {
+        name: models for name, models in INDEXES.items()
+        if name in ("documents", "document_ops", "document_snapshots")
+    })
+    results = {}
+    for length in lengths:
+        row = {}
+        for label, interval in (("snapshots", snapshot_every), ("no_snapshots", 1 << 30)):
+            doc_id = f"{label}-{length}"
+            history = await build(db, doc_id, length, interval, flush_every)
+            row[label] = await measure(history, doc_id, length, reads)
+        results[str(length)] = row
+    for name in ("documents", "document_ops", "document_snapshots"):
+        await db[name].drop()
+    report("history_replay", results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lengths", default="500,2000,8000")
+    parser.add_argument("--snapshot-every", type=int, default=200)
+    parser.add_argument("--flush-every", type=int, default=50)
+    parser.add_argument("--reads", type=int, default=50)
+    args = parser.parse_args()
+    lengths = [int(n) for n in args.lengths.split(",")]
+    asyncio.run(main(lengths, args.snapshot_every, args.flush_every, args.reads))
@@ -0,0 +1,89 @@
+"""Bytes and latency of document GETs: full body vs conditional vs diff.
+
+    python -m benchmarks.bench_http_cache [--doc-kb 1024] [--requests 200] [--edits 10]
+
+unchanged:    plain GET vs GET with If-None-Match (304)
+small_change: plain GET vs GET /diff?since=<rev the client has>
+Each is measured with and without gzip (Accept-Encoding).
+"""
+import os
+
+os.environ.setdefault("JOURNAL_DIR", "")
+
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks._common import BENCH_DB_NAME, asgi_client, make_client, report, summarize
+from collab.ot import TextOperation
+
+async def measure(http, url, headers, requests):
+    samples = []
+    sent = 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = await http.get(url, headers=headers)
+        samples.append(time.perf_counter() - start)
+        sent += response.num_bytes_downloaded
+    result = summarize(samples)
+    result["bytes_per_request"] = sent // requests
+    result["status"] = response.status_code
+    return result
+
+async def main(args):
+    from fastapi import FastAPI
+    from fastapi.middleware.gzip import GZipMiddleware
+    from api import routes
+    from db.dependencies import get_db
+
+    db = make_client()[BENCH_DB_NAME]
+    await db.documents.drop()
+    store = routes.live_documents
+    store.history.start(db.document_ops, db.document_snapshots)
+    await store.start(db.documents)
+    app = FastAPI()
+    app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=args.gzip_level)
+    app.include_router(routes.router, prefix="/api")
+
+    async def bench_db():
+        return db
+
+    app.dependency_overrides[get_db] = bench_db
+    rng = random.Random(1)
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing"]
+    content = " ".join(rng.choice(words) for _ in range(args.doc_kb * 180))[:args.doc_kb * 1024]
+    state = await store.write("doc", content)
+    url = "/api/documents/doc"
+    results = {}
+    async with asgi_client(app) as http:
+        etag = (await http.get(url)).headers["etag"]
+        seen = state.revision
+        for encoding in ("identity", "gzip"):
+            base = {"Accept-Encoding": encoding}
+            results[f"unchanged_{encoding}"] = {
+                "full": await measure(http, url, base, args.requests),
+                "if_none_match": await measure(http, url, {**base, "If-None-Match": etag}, args.requests),
+            }
+        for _ in range(args.edits):
+            pos = rng.randint(0, len(state.content))
+            state.apply_client_op(state.revision, TextOperation.from_edit(len(state.content), pos, 0, "edit "))
+            store.changed(state)
+        for encoding in ("identity", "gzip"):
+            base = {"Accept-Encoding": encoding}
+            results[f"small_change_{encoding}"] = {
+                "full": await measure(http, url, base, args.requests),
+                "diff": await measure(http, f"{url}/diff?since={seen}", base, args.requests),
+            }
+    await store.stop()
+    await db.documents.drop()
+    report("http_cache", results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--doc-kb", type=int, default=1024)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--edits", type=int, default=10)
+    parser.add_argument("--gzip-level", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,59 @@
+"""Write-ahead journal append throughput under group-commit settings.
+
+    python -m benchmarks.bench_journal [--writers 64] [--appends 100] [--dir /tmp/realdoc-journal]
+
+Each writer behaves like a websocket client waiting for its ack: it appends
+one keystroke op and waits for the commit before sending the next. Reports
+acked appends per second, ack latency and how many appends each msync
+covered, for several commit intervals with and without msync.
+"""
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+
+from benchmarks._common import report, summarize
+from collab.journal import Journal
+
+async def run(directory, writers, appends, interval_ms, max_entries, fsync):
+    journal = Journal(directory, commit_interval_ms=interval_ms, commit_max_entries=max_entries, fsync=fsync)
+    await journal.start()
+    samples = []
+
+    async def writer(n):
+        doc_id = f"doc-{n % 8}"
+        for revision in range(1, appends + 1):
+            start = time.perf_counter()
+            await journal.append(doc_id, revision, ops=[revision, "x", 100])
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(n) for n in range(writers)))
+    elapsed = time.perf_counter() - start
+    metrics = journal.metrics()
+    await journal.stop()
+    shutil.rmtree(directory, ignore_errors=True)
+    result = {"ack": summarize(samples, elapsed)}
+    result["appends_per_commit"] = metrics["mean_commit"]
+    result["mean_commit_ms"] = metrics["mean_commit_ms"]
+    return result
+
+async def main(args):
+    results = {}
+    for fsync in (True, False):
+        for interval_ms in (0.0, 1.0, 5.0):
+            directory = tempfile.mkdtemp(prefix="journal-", dir=args.dir)
+            label = f"{'msync' if fsync else 'no_msync'}_interval_{interval_ms:g}ms"
+            results[label] = await run(directory, args.writers, args.appends, interval_ms,
+                                       args.max_entries, fsync)
+    report("journal", results, backend="disk")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=64)
+    parser.add_argument("--appends", type=int, default=100)
+    parser.add_argument("--max-entries", type=int, default=256)
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,34 @@
+"""Per-request cost of access-token verification, with and without the cache.
+
+    python -m benchmarks.bench_jwt_verify [--iterations 20000] [--users 100]
+
+Tokens are reused across requests the way a logged-in client reuses its
+access token, so after the first request per user every lookup is a hit.
+"""
+import argparse
+import time
+
+from benchmarks._common import report
+from auth.jwt_handler import TokenCache, create_access_token, verify_token
+
+def time_per_call(tokens, iterations, cache):
+    start = time.perf_counter()
+    for i in range(iterations):
+        verify_token(tokens[i % len(tokens)], cache=cache)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=100)
+    args = parser.parse_args()
+    tokens = [create_access_token({"sub": f"user-{i}"}) for i in range(args.users)]
+    cache = TokenCache()
+    results = {
+        "users": args.users,
+        "decode_every_request_us": round(time_per_call(tokens, args.iterations, None), 3),
+        "cached_us": round(time_per_call(tokens, args.iterations, cache), 3),
+        "cache": cache.metrics(),
+    }
+    results["speedup"] = round(results["decode_every_request_us"] / results["cached_us"], 1)
+    report("jwt_verify", results, backend="cpu")
@@ -0,0 +1,162 @@
+"""Storage, read and upload cost of large documents, inline vs chunked.
+
+    python -m benchmarks.bench_large_documents [--sizes-mb 1 10 100] [--chunk-kb 256]
+
+storage: first flush of the whole body, then the flush after a one-character
+         edit in the middle, with content inline and with DOC_CHUNK_SIZE
+         chunks. Inline rows over 16 MB fail on a real mongod.
+read:    GET /api/documents/{id} encoded in one piece vs streamed
+upload:  POST /api/documents/{id} (JSON body) vs PUT .../content (streamed)
+
+Latency is wall time; memory is the tracemalloc peak above the baseline
+during the request, so it counts every copy the server makes.
+"""
+import os
+
+os.environ.setdefault("JOURNAL_DIR", "")
+
+import argparse
+import asyncio
+import gc
+import json
+import time
+import tracemalloc
+
+from benchmarks._common import BENCH_DB_NAME, make_client, report
+from collab.ot import TextOperation
+from collab.store import DocumentStore
+
+MB = 1024 * 1024
+
+async def measured(call):
+    """(milliseconds, peak MB above the starting point, result) of awaiting call()"""
+    gc.collect()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = await call()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    return round(elapsed * 1000, 2), round(peak / MB, 2), result
+
+async def storage(db, content, chunk_size):
+    await db.documents.drop()
+    await db.document_chunks.drop()
+    store = DocumentStore(flush_interval_ms=60000, chunk_size=chunk_size)
+    await store.start(db.documents, db.document_chunks)
+    state = await store.write("doc", content)
+    result = {}
+    try:
+        result["first_flush_ms"], result["first_flush_peak_mb"], _ = await measured(store.flush)
+        state.apply_client_op(state.revision, TextOperation.from_edit(len(state.content), len(state.content) // 2, 0, "x"))
+        store.changed(state)
+        written = store.stats["chunks_written"]
+        result["edit_flush_ms"], result["edit_flush_peak_mb"], _ = await measured(store.flush)
+        result["edit_flush_chunks_written"] = store.stats["chunks_written"] - written
+        await store.stop()
+    except Exception as e:
+        # e.g. an inline row over MongoDB's 16 MB document limit
+        result["error"] = f"{type(e).__name__}: {str(e)[:120]}"
+    return result
+
+async def call_app(app, method, path, pieces=(), headers=()):
+    """Drive the ASGI app directly, dropping the response body as it arrives,
+    so only the server's own copies show up in the memory peak"""
+    pieces = iter(pieces)
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(k.encode(), v.encode()) for k, v in headers],
+        "client": ("bench", 1), "server": ("bench", 80),
+    }
+    response = {"status": None, "bytes": 0}
+    body_sent = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal body_sent
+        if body_sent:
+            # Streaming responses listen for the client going away
+            await finished.wait()
+            return {"type": "http.disconnect"}
+        piece = next(pieces, None)
+        if piece is None:
+            body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        return {"type": "http.request", "body": piece, "more_body": True}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["bytes"] += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    return response
+
+async def requests(app, store, content):
+    from api import routes
+
+    result = {}
+    await store.write("doc", content)
+    # Warm up the app so first-request imports aren't counted
+    await call_app(app, "GET", "/api/documents/doc/content")
+    for name, threshold in (("get_whole", float("inf")), ("get_streamed", 0)):
+        routes.DOC_STREAM_MIN_CHARS = threshold
+        ms, peak, response = await measured(lambda: call_app(app, "GET", "/api/documents/doc"))
+        result[name] = {"ms": ms, "peak_mb": peak, "status": response["status"]}
+    body = content.encode()
+    json_body = json.dumps({"content": content}).encode()
+    del content
+    uploads = (
+        ("upload_json", "POST", "/api/documents/doc", json_body, "application/json"),
+        ("upload_streamed", "PUT", "/api/documents/doc/content", body, "text/plain"),
+    )
+    for name, method, path, data, content_type in uploads:
+        # The client's bytes already exist; only what the server builds from them counts
+        pieces = [data[i:i + 64 * 1024] for i in range(0, len(data), 64 * 1024)]
+        headers = [("content-type", content_type), ("content-length", str(len(data)))]
+        ms, peak, response = await measured(lambda: call_app(app, method, path, pieces, headers))
+        result[name] = {"ms": ms, "peak_mb": peak, "status": response["status"]}
+    return result
+
+async def main(args):
+    from fastapi import FastAPI
+    from api import routes
+
+    db = make_client()[BENCH_DB_NAME]
+    store = routes.live_documents
+    store.chunk_size = args.chunk_kb * 1024
+    store.history = None
+    await store.start(db.documents, db.document_chunks)
+    routes.DOC_UPLOAD_MAX_BYTES = max(args.sizes_mb) * 2 * MB
+    app = FastAPI()
+    app.include_router(routes.router, prefix="/api")
+    tracemalloc.start()
+    results = {}
+    for size in args.sizes_mb:
+        content = ("lorem ipsum dolor sit amet " * (size * MB // 27 + 1))[:size * MB]
+        results[f"{size}mb"] = {
+            "storage_inline": await storage(db, content, 0),
+            "storage_chunked": await storage(db, content, args.chunk_kb * 1024),
+        }
+        await db.documents.drop()
+        await db.document_chunks.drop()
+        store._states.clear()
+        results[f"{size}mb"].update(await requests(app, store, content))
+        store._states.clear()
+        del content
+    tracemalloc.stop()
+    await store.stop()
+    await db.documents.drop()
+    await db.document_chunks.drop()
+    report("large_documents", results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--chunk-kb", type=int, default=256)
+    args = parser.parse_args()
+    asyncio.run(main(args))
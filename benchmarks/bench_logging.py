@@ -0,0 +1,105 @@
+"""Save throughput with logging off, written inline, and queued.
+
+    python -m benchmarks.bench_logging [--requests 2000] [--sizes-kb 1 1024] [--rounds 3] [--sink-delay-us 100]
+
+POST /api/documents/{doc_id} driven straight through the ASGI app, with:
+off:    level WARNING, so the INFO lines are never built
+inline: INFO through a StreamHandler, formatted and written on the event loop
+queued: INFO through telemetry.logs (formatted and written by a thread)
+debug:  the same at DEBUG; document content is still never formatted
+
+Output is thrown away after --sink-delay-us per write, standing in for a
+stderr pipe that a log collector drains (0 for a sink that never blocks).
+Best of --rounds.
+"""
+import os
+
+os.environ.setdefault("JOURNAL_DIR", "")
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from benchmarks._common import BENCH_DB_NAME, make_client, report
+from telemetry.logs import configure_logging, stop_logging
+
+class Sink:
+    """A stream whose writes block for a while, like a pipe with a slow reader"""
+    def __init__(self, delay):
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return len(text)
+
+    def flush(self):
+        pass
+
+def set_mode(mode, sink):
+    stop_logging()
+    root = logging.getLogger()
+    if mode in ("queued", "debug"):
+        configure_logging("DEBUG" if mode == "debug" else "INFO", stream=sink)
+    elif mode == "inline":
+        handler = logging.StreamHandler(sink)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+        root.handlers = [handler]
+        root.setLevel(logging.INFO)
+    else:
+        root.handlers = []
+        root.setLevel(logging.WARNING)
+
+async def save_rate(app, body, requests):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/api/documents/doc", "raw_path": b"/api/documents/doc", "query_string": b"",
+        "root_path": "", "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("bench", 1), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return requests / (time.perf_counter() - start)
+
+async def main(args):
+    from fastapi import FastAPI
+    from api import routes
+
+    store = routes.live_documents
+    store.history = None
+    await store.start(make_client()[BENCH_DB_NAME].documents)
+    app = FastAPI()
+    app.include_router(routes.router, prefix="/api")
+    results = {}
+    sink = Sink(args.sink_delay_us / 1e6)
+    for size in args.sizes_kb:
+        body = json.dumps({"content": "x" * (size * 1024)}).encode()
+        requests = max(args.requests * 4 // max(size, 4), 20)
+        results[f"{size}kb"] = {}
+        for mode in ("off", "inline", "queued", "debug"):
+            best = 0.0
+            for _ in range(args.rounds):
+                set_mode(mode, sink)
+                best = max(best, await save_rate(app, body, requests))
+            results[f"{size}kb"][f"{mode}_saves_per_s"] = round(best, 1)
+    set_mode("off", sink)
+    await store.stop()
+    report("logging", results, backend="cpu")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--sizes-kb", type=int, nargs="+", default=[1, 1024])
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--sink-delay-us", type=float, default=100)
+    asyncio.run(main(parser.parse_args()))
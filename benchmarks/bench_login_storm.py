@@ -0,0 +1,94 @@
+"""Event-loop responsiveness while a burst of logins is being verified.
+
+    python -m benchmarks.bench_login_storm [--logins 40] [--rounds 12]
+
+A websocket-style echo task bounces a message through an asyncio queue every
+few milliseconds and records the time from send to echo, the same path a relayed op takes
+through the loop. Logins are verified either inline on the loop (the old
+behaviour: a fresh CryptContext per request) or through PasswordHasher.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks._common import report, summarize
+from auth.passwords import PasswordHasher
+
+async def echo_loop(samples, stop, interval):
+    inbox = asyncio.Queue()
+    outbox = asyncio.Queue()
+
+    async def echo_server():
+        while True:
+            message = await inbox.get()
+            await outbox.put(message)
+
+    server = asyncio.create_task(echo_server())
+    sent_at = time.perf_counter()
+    try:
+        while not stop.is_set():
+            # The client sends on a fixed schedule, so time spent blocked
+            # before the message is even read counts towards its latency
+            await inbox.put(sent_at)
+            await outbox.get()
+            now = time.perf_counter()
+            samples.append(now - sent_at)
+            sent_at += interval
+            if sent_at < now:
+                sent_at = now
+            await asyncio.sleep(sent_at - now)
+    finally:
+        server.cancel()
+
+async def storm(login, logins, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with slots:
+            await login()
+
+    await asyncio.gather(*(one() for _ in range(logins)))
+
+async def run(mode, hashed, args):
+    if mode == "inline":
+        async def login():
+            from passlib.context import CryptContext
+            CryptContext(schemes=["bcrypt"], deprecated="auto").verify("correct horse", hashed)
+            # Yield like a request handler would between awaits
+            await asyncio.sleep(0)
+    else:
+        hasher = PasswordHasher(rounds=args.rounds, workers=args.workers, max_queue=args.logins)
+        hasher.start()
+
+        async def login():
+            await hasher.verify("correct horse", hashed)
+
+    samples = []
+    stop = asyncio.Event()
+    echo = asyncio.create_task(echo_loop(samples, stop, args.interval_ms / 1000))
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    await storm(login, args.logins, args.concurrency)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await echo
+    result = {"echo": summarize(samples), "logins_per_s": round(args.logins / elapsed, 2)}
+    result["echo"]["max_ms"] = round(max(samples) * 1000, 3) if samples else 0.0
+    if mode == "hasher":
+        result["hasher"] = hasher.metrics()
+        hasher.stop()
+    return result
+
+async def main(args):
+    hashed = await PasswordHasher(rounds=args.rounds).hash("correct horse")
+    return {mode: await run(mode, hashed, args) for mode in ("inline", "hasher")}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--interval-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    report("login_storm", asyncio.run(main(args)), backend="cpu")
@@ -0,0 +1,138 @@
+"""Throughput cost of the /metrics instrumentation.
+
+    python -m benchmarks.bench_metrics [--requests 2000] [--clients 500] [--messages 50] [--rounds 20]
+
+observe:  ns per histogram observation and counter increment on a bound child
+rest:     GET /api/documents/{doc_id} (document in memory) driven straight
+          through the ASGI app, with and without MetricsMiddleware
+fanout:   broadcasts to --clients simulated websockets, with the fan-out
+          and delivery histograms live and with them swapped for a no-op
+
+Rounds alternate between the two variants (swapping which goes first) and
+the best round of each is kept, so a noisy neighbour doesn't land on one
+side only.
+"""
+import os
+
+os.environ.setdefault("JOURNAL_DIR", "")
+
+import argparse
+import asyncio
+import time
+
+from benchmarks._common import BENCH_DB_NAME, make_client, report
+
+class NoOp:
+    """Stands in for a bound histogram; a builtin call keeps it as cheap as possible"""
+    observe = staticmethod(float)
+
+class CountingClient:
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+def per_call_ns(call, iterations=500000):
+    start = time.perf_counter()
+    for i in range(iterations):
+        call(0.003)
+    return round((time.perf_counter() - start) / iterations * 1e9, 1)
+
+async def rest_rate(app, requests):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/api/documents/doc", "raw_path": b"/api/documents/doc",
+        "query_string": b"", "root_path": "", "headers": [], "client": ("bench", 1), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        # The router writes into the scope, so each request gets its own
+        await app(dict(scope), receive, send)
+    return requests / (time.perf_counter() - start)
+
+async def fanout_rate(clients, messages):
+    from api.websocket import ConnectionManager
+
+    manager = ConnectionManager()
+    sockets = [CountingClient() for _ in range(clients)]
+    for socket in sockets:
+        await manager.connect(socket, "doc")
+    start = time.perf_counter()
+    for i in range(messages):
+        await manager.broadcast({"type": "op", "rev": i, "ops": [i, "x"]}, "doc")
+        # Let the senders drain before the next one
+        while any(c.queue for c in manager.active_connections["doc"].values()):
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    await manager.stop()
+    return clients * messages / elapsed
+
+def compare(name, measure, rounds):
+    """Best of `rounds` alternating runs; `measure(instrumented)` returns a rate"""
+    best = {True: 0.0, False: 0.0}
+    for round_number in range(rounds):
+        for instrumented in ((False, True) if round_number % 2 == 0 else (True, False)):
+            best[instrumented] = max(best[instrumented], measure(instrumented))
+    return {
+        f"{name}_per_s_plain": round(best[False], 1),
+        f"{name}_per_s_instrumented": round(best[True], 1),
+        "overhead_pct": round((1 - best[True] / best[False]) * 100, 2),
+    }
+
+def main(args):
+    from fastapi import FastAPI
+    from api import routes
+    from api import websocket as ws_module
+    from telemetry.metrics import MetricsMiddleware, registry
+
+    counter = registry.counter("bench_calls", "Benchmark counter").labels()
+    histogram = registry.histogram("bench_seconds", "Benchmark histogram").labels()
+    results = {"observe": {
+        "histogram_observe_ns": per_call_ns(histogram.observe),
+        "counter_inc_ns": per_call_ns(counter.inc),
+    }}
+
+    plain = FastAPI()
+    plain.include_router(routes.router, prefix="/api")
+    instrumented = MetricsMiddleware(plain)
+    loop = asyncio.new_event_loop()
+    store = routes.live_documents
+    store.history = None
+    loop.run_until_complete(store.start(make_client()[BENCH_DB_NAME].documents))
+    loop.run_until_complete(store.write("doc", "hello world " * 100))
+    results["rest"] = compare(
+        "requests",
+        lambda on: loop.run_until_complete(rest_rate(instrumented if on else plain, args.requests)),
+        args.rounds
+    )
+    loop.run_until_complete(store.stop())
+
+    live = (ws_module._fanout_recipients, ws_module._delivery_seconds)
+
+    def fanout(on):
+        ws_module._fanout_recipients, ws_module._delivery_seconds = live if on else (NoOp, NoOp)
+        return loop.run_until_complete(fanout_rate(args.clients, args.messages))
+
+    results["fanout"] = compare("deliveries", fanout, args.rounds)
+    ws_module._fanout_recipients, ws_module._delivery_seconds = live
+    loop.close()
+    report("metrics", results, backend="cpu")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    main(parser.parse_args())
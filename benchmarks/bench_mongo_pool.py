@@ -0,0 +1,67 @@
+"""p50/p99 of GET /api/documents/{doc_id}: client-per-request vs pooled client.
+
+    python -m benchmarks.bench_mongo_pool [--requests 2000] [--concurrency 50]
+"""
+import os
+
+# Thousands of requests from one address would otherwise hit RATE_LIMIT_REST
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import argparse
+import asyncio
+
+from benchmarks._common import (
+    BENCH_DB_NAME, client_factory, run_concurrent, summarize, asgi_client, report
+)
+
+DOC_ID = "bench-pool-doc"
+
+async def main(requests, concurrency):
+    import main as app_module
+    from db import mongo
+    from db.dependencies import get_db
+
+    app = app_module.app
+    new_client = client_factory()
+    seed = new_client()
+    await seed[BENCH_DB_NAME].documents.update_one(
+        {"doc_id": DOC_ID}, {"$set": {"content": "x" * 1024}}, upsert=True
+    )
+    results = {}
+
+    # Before: the old behaviour, a new client plus an admin ping per request
+    async def per_request_db():
+        client = new_client()
+        await client.admin.command("ping")
+        return client[BENCH_DB_NAME]
+
+    app.dependency_overrides[get_db] = per_request_db
+    async with asgi_client(app) as http:
+        samples, elapsed = await run_concurrent(
+            lambda: http.get(f"/api/documents/{DOC_ID}"), requests, concurrency)
+    results["client_per_request"] = summarize(samples, elapsed)
+    app.dependency_overrides.clear()
+
+    # After: one pooled client created up front, no per-request ping
+    await mongo.connect_mongo(client=new_client(), health_interval=0)
+    shared = mongo.get_client()
+
+    async def pooled_db():
+        return shared[BENCH_DB_NAME]
+
+    app.dependency_overrides[get_db] = pooled_db
+    async with asgi_client(app) as http:
+        samples, elapsed = await run_concurrent(
+            lambda: http.get(f"/api/documents/{DOC_ID}"), requests, concurrency)
+    results["pooled_client"] = summarize(samples, elapsed)
+    app.dependency_overrides.clear()
+    await mongo.close_mongo()
+
+    report("mongo_pool_get_document", results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,54 @@
+"""Transform throughput of collab.ot in ops/sec.
+
+    python -m benchmarks.bench_ot_transform [--doc-size 100000] [--ops 20000]
+
+Measures pairwise transform() of single-edit operations (the common
+keystroke case) and server-side apply_client_op() of an op that is
+several revisions behind the head.
+"""
+import argparse
+import random
+import time
+
+from benchmarks._common import report
+from collab.document import DocumentState
+from collab.ot import TextOperation, transform
+
+def random_edit(rng, length):
+    pos = rng.randrange(length + 1)
+    if length and rng.random() < 0.3:
+        return TextOperation.from_edit(length, min(pos, length - 1), delete=1)
+    return TextOperation.from_edit(length, pos, text=rng.choice("abcdef "))
+
+def bench_transform(doc_size, count):
+    rng = random.Random(1)
+    pairs = [(random_edit(rng, doc_size), random_edit(rng, doc_size)) for _ in range(count)]
+    start = time.perf_counter()
+    for a, b in pairs:
+        transform(a, b)
+    elapsed = time.perf_counter() - start
+    return {"transforms": count, "ops_per_s": round(count / elapsed, 1)}
+
+def bench_server_apply(doc_size, count, lag):
+    """apply_client_op() for ops based `lag` revisions behind the head"""
+    rng = random.Random(2)
+    state = DocumentState("bench", "x" * doc_size, history_limit=lag + 1)
+    lengths = [doc_size]  # document length at each revision
+    start = time.perf_counter()
+    for _ in range(count):
+        base = max(state.oldest_revision, state.revision - lag)
+        state.apply_client_op(base, random_edit(rng, lengths[base]))
+        lengths.append(state.length)
+    elapsed = time.perf_counter() - start
+    return {"ops": count, "lag": lag, "ops_per_s": round(count / elapsed, 1)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--doc-size", type=int, default=100000)
+    parser.add_argument("--ops", type=int, default=20000)
+    args = parser.parse_args()
+    report("ot_transform", {
+        "transform_pairs": bench_transform(args.doc_size, args.ops),
+        "server_apply_at_head": bench_server_apply(args.doc_size, args.ops // 10, 0),
+        "server_apply_10_behind": bench_server_apply(args.doc_size, args.ops // 10, 10),
+    }, backend="cpu")
@@ -0,0 +1,94 @@
+"""Cursor traffic for many active users on one document.
+
+    python -m benchmarks.bench_presence [--clients 500] [--move-hz 30] [--seconds 3] [--tick-hz 20]
+
+Every client moves its cursor `--move-hz` times a second. Compares sending
+each move through ConnectionManager.broadcast with the presence tick,
+which coalesces moves per session and sends one delta per tick. Reports
+frames written to sockets per second and CPU per connection.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks._common import report
+
+class CountingClient:
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message):
+        self.frames += 1
+        self.bytes += len(message)
+
+    async def close(self, code=1000):
+        pass
+
+async def run(args, mode):
+    from api.websocket import ConnectionManager
+
+    manager = ConnectionManager(queue_size=args.queue_size, presence_tick_hz=args.tick_hz)
+    await manager.start()
+    clients = [CountingClient() for _ in range(args.clients)]
+    for i, client in enumerate(clients):
+        await manager.connect(client, "doc", user=f"user-{i}", presence=True)
+    await asyncio.sleep(0.1)
+    for client in clients:
+        client.frames = client.bytes = 0
+    interval = 1.0 / args.move_hz
+    moves = 0
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    deadline = start + args.seconds
+    next_round = start
+    while time.perf_counter() < deadline:
+        for i, client in enumerate(clients):
+            message = {"type": "cursor", "cursor": moves + i, "selection": None}
+            if mode == "broadcast":
+                await manager.broadcast(message, "doc", exclude=client)
+            else:
+                manager.update_presence(client, "doc", message)
+        moves += 1
+        next_round += interval
+        # Let the senders drain; a driver that falls behind just skips ahead
+        await asyncio.sleep(max(next_round - time.perf_counter(), 0))
+    # Whatever is still queued counts against the run
+    drain_deadline = time.perf_counter() + 5
+    while time.perf_counter() < drain_deadline and any(c.queue for c in manager.active_connections["doc"].values()):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    frames = sum(client.frames for client in clients)
+    stats = manager.metrics()["doc"]
+    await manager.stop()
+    return {
+        "cursor_moves_per_s": round(moves * args.clients / elapsed, 1),
+        "move_rounds": moves,
+        "frames_per_s": round(frames / elapsed, 1),
+        "bytes_per_s": round(sum(client.bytes for client in clients) / elapsed, 1),
+        "cpu_ms_per_connection_per_s": round(cpu / args.clients / elapsed * 1000, 4),
+        "cpu_utilisation": round(cpu / elapsed, 3),
+        "dropped": stats["dropped"],
+        "mean_latency_ms": stats["mean_latency_ms"],
+    }
+
+async def main(args):
+    results = {"presence_tick": await run(args, "presence")}
+    if not args.skip_broadcast:
+        results["broadcast_each_move"] = await run(args, "broadcast")
+    report("presence", results, backend="cpu")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--move-hz", type=float, default=30)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--tick-hz", type=float, default=20)
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--skip-broadcast", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args))
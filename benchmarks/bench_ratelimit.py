@@ -0,0 +1,72 @@
+"""Per-check cost of the rate limiter.
+
+    python -m benchmarks.bench_ratelimit [--iterations 200000] [--keys 1 1000 100000]
+
+single:    RateLimiter.hit for one of --keys keys
+websocket: MessageLimits.check (connection, user and document limits)
+rest:      RouteLimits.check (overall limit plus a per-route one)
+middleware: one ASGI request through an empty app, with and without
+           RateLimitMiddleware in front of it
+
+The rates are high enough that every check is allowed, the common case.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks._common import report
+from api.ratelimit import MessageLimits, Rate, RateLimiter, RateLimitMiddleware, RouteLimits, parse_routes
+
+FAST = Rate(10 ** 9, 1.0)
+
+def per_call_ns(call, keys, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        call(keys[i % len(keys)])
+    return round((time.perf_counter() - start) / iterations * 1e9, 1)
+
+def asgi_request_ns(app, iterations):
+    scope = {
+        "type": "http", "method": "GET", "path": "/api/documents/doc", "headers": [],
+        "client": ("10.0.0.1", 1234),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def run():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            await app(scope, receive, send)
+        return time.perf_counter() - start
+
+    return round(asyncio.run(run()) / iterations * 1e9, 1)
+
+async def empty_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--keys", type=int, nargs="+", default=[1, 1000, 100000])
+    args = parser.parse_args()
+    results = {}
+    for count in args.keys:
+        keys = [f"key-{i}" for i in range(count)]
+        limiter = RateLimiter(FAST, max_keys=max(count, 10000))
+        messages = MessageLimits(FAST, FAST, FAST)
+        routes = RouteLimits(FAST, parse_routes("POST /api/auth/login=5/60,PUT /api/documents/*=1000000000/1"))
+        results[f"{count}_keys"] = {
+            "single_ns": per_call_ns(lambda key: limiter.hit(key), keys, args.iterations),
+            "websocket_ns": per_call_ns(lambda key: messages.check(key, key, "doc"), keys, args.iterations),
+            "rest_ns": per_call_ns(lambda key: routes.check("PUT", "/api/documents/d", key), keys, args.iterations),
+        }
+    iterations = args.iterations // 4
+    plain = asgi_request_ns(empty_app, iterations)
+    limited = asgi_request_ns(RateLimitMiddleware(empty_app, RouteLimits(FAST)), iterations)
+    results["middleware"] = {"without_ns": plain, "with_ns": limited, "overhead_ns": round(limited - plain, 1)}
+    report("ratelimit", results, backend="cpu")
@@ -0,0 +1,146 @@
+"""Every client of many documents reconnecting at once.
+
+    python -m benchmarks.bench_reconnect_storm [--docs 50] [--clients 2000] [--missed 20] [--doc-kb 50]
+
+Clients saw revision R, then `missed` ops were made on each document while
+they were away. Compared ways to catch up:
+
+- reload: the old behaviour, every client re-reads the document from MongoDB
+- snapshot: reconnect without ``since`` and get the live snapshot
+- resume_blip: reconnect with ``since=R`` to the same worker (ops from memory)
+- resume_restart: the same after a deploy, so missed ops come from the op log
+
+Reports wall time until every client is caught up, bytes sent and MongoDB
+reads.
+"""
+import os
+
+# Benchmarks never write journal files into the working directory
+os.environ.setdefault("JOURNAL_DIR", "")
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from benchmarks._common import BENCH_DB_NAME, make_client, report
+import api.websocket as ws
+from collab.history import HistoryStore
+from collab.ot import TextOperation
+from collab.store import DocumentStore
+from db.schema import INDEXES, ensure_schema
+
+class Client:
+    __slots__ = ("bytes", "messages")
+
+    def __init__(self):
+        self.bytes = 0
+        self.messages = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message):
+        self.bytes += len(message)
+        self.messages += 1
+
+    async def send_bytes(self, message):
+        self.bytes += len(message)
+        self.messages += 1
+
+    async def close(self, code=1000):
+        pass
+
+def new_store(db):
+    history = HistoryStore()
+    history.start(db.document_ops, db.document_snapshots)
+    return DocumentStore(flush_interval_ms=60000, history=history)
+
+async def populate(db, docs, doc_kb, missed):
+    rng = random.Random(5)
+    store = new_store(db)
+    await store.start(db.documents)
+    seen = {}
+    for d in range(docs):
+        state = await store.open(f"doc-{d}")
+        state.replace_content("".join(rng.choices("abcdefgh ", k=doc_kb * 1024)))
+        store.changed(state)
+        seen[state.doc_id] = state.revision
+        for _ in range(missed):
+            pos = rng.randint(0, len(state.content))
+            state.apply_client_op(state.revision, TextOperation.from_edit(len(state.content), pos, 0, "x"))
+            store.changed(state)
+    await store.flush()
+    return store, seen
+
+async def storm(store, clients, seen, with_since):
+    manager = ws.ConnectionManager(queue_size=1 << 16)
+    ws.documents = store
+    reads_before = store.stats["misses"] + store.history.stats["resume_reads"]
+    sockets = [Client() for _ in range(clients)]
+    doc_ids = list(seen)
+
+    async def reconnect(i, websocket):
+        doc_id = doc_ids[i % len(doc_ids)]
+        since = seen[doc_id] if with_since else None
+        state = await store.open(doc_id)
+        logged = await ws.fetch_missed(state, since)
+        await manager.connect(websocket, doc_id)
+        for message in ws.catch_up_messages(state, since, logged):
+            manager.send(websocket, doc_id, message)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(reconnect(i, s) for i, s in enumerate(sockets)))
+    while any(c.queue for conns in manager.active_connections.values() for c in conns.values()):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    await manager.stop()
+    return {
+        "seconds": round(elapsed, 4),
+        "bytes_sent": sum(s.bytes for s in sockets),
+        "db_reads": store.stats["misses"] + store.history.stats["resume_reads"] - reads_before,
+    }
+
+async def reload(db, clients, seen):
+    doc_ids = list(seen)
+    sent = 0
+
+    async def fetch(i):
+        nonlocal sent
+        document = await db.documents.find_one({"doc_id": doc_ids[i % len(doc_ids)]})
+        sent += len(json.dumps({"content": document["content"]}))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(fetch(i) for i in range(clients)))
+    return {"seconds": round(time.perf_counter() - start, 4), "bytes_sent": sent, "db_reads": clients}
+
+async def main(args):
+    db = make_client()[BENCH_DB_NAME]
+    names = ("documents", "document_ops", "document_snapshots")
+    for name in names:
+        await db[name].drop()
+    await ensure_schema(db, {name: INDEXES[name] for name in names})
+    store, seen = await populate(db, args.docs, args.doc_kb, args.missed)
+    results = {
+        "reload": await reload(db, args.clients, seen),
+        "snapshot": await storm(store, args.clients, seen, with_since=False),
+        "resume_blip": await storm(store, args.clients, seen, with_since=True),
+    }
+    restarted = new_store(db)
+    await restarted.start(db.documents)
+    results["resume_restart"] = await storm(restarted, args.clients, seen, with_since=True)
+    await restarted.stop()
+    await store.stop()
+    for name in names:
+        await db[name].drop()
+    report("reconnect_storm", results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--missed", type=int, default=20)
+    parser.add_argument("--doc-kb", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args))
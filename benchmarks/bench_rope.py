@@ -0,0 +1,96 @@
+"""Applying edits to a plain str versus collab.rope.Rope, and their memory.
+
+    python -m benchmarks.bench_rope [--sizes 100000,1000000,10000000] [--edits 10000]
+
+Each size gets --edits random single-character inserts and deletes, as
+clients send them, applied to a str (a new copy per edit) and to a Rope.
+``to_str`` is building the full string from the rope once, as a flush or a
+snapshot does. Memory is what tracemalloc sees allocated for the text after
+building it and after the edits.
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from benchmarks._common import report
+from collab.ot import TextOperation
+from collab.rope import Rope
+
+def edits(size, count, seed):
+    rng = random.Random(seed)
+    ops = []
+    length = size
+    for _ in range(count):
+        pos = rng.randrange(length + 1)
+        if length and rng.random() < 0.3:
+            ops.append(TextOperation.from_edit(length, min(pos, length - 1), delete=1))
+            length -= 1
+        else:
+            ops.append(TextOperation.from_edit(length, pos, text=rng.choice("abcdef \n")))
+            length += 1
+    return ops
+
+def text(size, seed):
+    rng = random.Random(seed)
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "\n"]
+    return "".join(rng.choice(words) + " " for _ in range(size // 4))[:size]
+
+def allocated(build):
+    """(object, bytes allocated while building it)"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        value = build()
+        return value, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+def run(size, count):
+    content = text(size, size)
+    ops = edits(size, count, size)
+
+    start = time.perf_counter()
+    edited = content
+    for op in ops:
+        edited = op.apply(edited)
+    str_elapsed = time.perf_counter() - start
+
+    rope, rope_bytes = allocated(lambda: Rope(content))
+    start = time.perf_counter()
+    for op in ops:
+        rope.apply(op)
+    rope_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    result = str(rope)
+    to_str = time.perf_counter() - start
+    assert result == edited
+
+    copy, str_bytes = allocated(lambda: "".join([content[:size // 2], content[size // 2:]]))
+
+    def edited_rope():
+        fresh = Rope(content)
+        for op in ops:
+            fresh.apply(op)
+        return fresh
+
+    _, edited_rope_bytes = allocated(edited_rope)
+    return {
+        "str": {"edits_per_s": round(count / str_elapsed, 1), "bytes": str_bytes},
+        "rope": {
+            "edits_per_s": round(count / rope_elapsed, 1),
+            "to_str_ms": round(to_str * 1000, 3),
+            "bytes": rope_bytes,
+            "bytes_after_edits": edited_rope_bytes,
+        },
+        "speedup": round(str_elapsed / rope_elapsed, 2),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100000,1000000,10000000")
+    parser.add_argument("--edits", type=int, default=10000)
+    args = parser.parse_args()
+    report("rope", {
+        str(size): run(size, args.edits) for size in (int(s) for s in args.sizes.split(","))
+    }, backend="cpu")
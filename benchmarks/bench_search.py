@@ -0,0 +1,148 @@
+"""Search index update cost per save and query latency.
+
+    python -m benchmarks.bench_search [--documents N] [--words 80] [--vocabulary 20000]
+                                      [--saves 200] [--queries N]
+
+Indexes --documents documents of --words words drawn from a Zipf-like
+vocabulary, in batches like the background indexer. Then:
+
+save:   the cost of a save to the request is ``queue``; the indexer then
+        reindexes the document with one word changed, alone and in batches
+        of 100, writing only the postings that changed
+query:  a common word, a rare word, two words, a typed prefix, and the one-
+        and two-letter prefixes search as you type sends first
+
+With BENCH_MONGO_URI the defaults are 100k documents and 200 queries of
+each kind. mongomock has no real indexes and every lookup scans, so there
+they are 200 documents and 10 queries; only the save costs mean much.
+"""
+import os
+import argparse
+import asyncio
+import random
+import time
+
+os.environ.setdefault("JOURNAL_DIR", "")
+
+from benchmarks._common import BENCH_DB_NAME, BENCH_MONGO_URI, make_client, report, summarize
+from collab.search import SearchIndex
+from db.schema import INDEXES, ensure_schema
+
+SEED_BATCH = 1000
+
+def vocabulary(size):
+    # Pronounceable, distinct, and not stop words
+    consonants, vowels = "bdfgklmnprstvz", "aeiou"
+    words = []
+    for i in range(size):
+        word, n = "", i
+        for _ in range(3):
+            word += consonants[n % len(consonants)] + vowels[(n // len(consonants)) % len(vowels)]
+            n //= len(consonants) * len(vowels)
+        words.append(word + str(i % 7))
+    return words
+
+def documents(count, words, vocab, rng):
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]
+    for i in range(count):
+        yield f"doc-{i}", rng.choices(vocab, weights, k=words)
+
+async def main(args):
+    db = make_client()[BENCH_DB_NAME]
+    await db.search_postings.drop()
+    await db.search_documents.drop()
+    await db.search_terms.drop()
+    if BENCH_MONGO_URI:
+        # mongomock checks unique indexes by scanning, which makes seeding quadratic
+        await ensure_schema(db, {
+            name: INDEXES[name] for name in ("search_postings", "search_documents", "search_terms")
+        })
+    index = SearchIndex(batch_size=SEED_BATCH)
+    index.documents, index.postings, index.terms = db.search_documents, db.search_postings, db.search_terms
+    rng = random.Random(7)
+    vocab = vocabulary(args.vocabulary)
+    texts = {}
+    batch = []
+    start = time.perf_counter()
+    for doc_id, words in documents(args.documents, args.words, vocab, rng):
+        texts[doc_id] = words
+        batch.append((doc_id, 1, " ".join(words)))
+        if len(batch) == SEED_BATCH:
+            await index.index(batch)
+            batch = []
+    await index.index(batch)
+    seeded = time.perf_counter() - start
+    results = {"seed": {
+        "documents": args.documents,
+        "postings": await db.search_postings.estimated_document_count(),
+        "documents_per_s": round(args.documents / seeded, 1),
+    }}
+
+    def edited(doc_id, revision):
+        words = texts[doc_id]
+        words[rng.randrange(len(words))] = rng.choice(vocab)
+        return doc_id, revision, " ".join(words)
+
+    doc_ids = list(texts)
+    queue_samples = []
+    queued = SearchIndex()
+    for i in range(args.saves):
+        item = edited(rng.choice(doc_ids), 2 + i)
+        start = time.perf_counter()
+        queued.queue(*item)
+        queue_samples.append(time.perf_counter() - start)
+    written = index.stats["postings_written"] + index.stats["postings_deleted"]
+    single = []
+    for i in range(args.saves):
+        item = edited(rng.choice(doc_ids), 10 ** 6 + i)
+        start = time.perf_counter()
+        await index.index([item])
+        single.append(time.perf_counter() - start)
+    changed = index.stats["postings_written"] + index.stats["postings_deleted"] - written
+    batched = []
+    for i in range(0, args.saves, 100):
+        items = [edited(doc_id, 2 * 10 ** 6 + i) for doc_id in rng.sample(doc_ids, 100)]
+        start = time.perf_counter()
+        await index.index(items)
+        batched.append((time.perf_counter() - start) / len(items))
+    results["save"] = {
+        "queue": summarize(queue_samples),
+        "reindex_alone": summarize(single),
+        "reindex_in_batches_of_100_per_document": summarize(batched),
+        "postings_changed_per_save": round(changed / args.saves, 2),
+        "postings_per_document": round(results["seed"]["postings"] / args.documents, 2),
+    }
+
+    queries = {
+        "common_word": lambda: vocab[rng.randrange(5)],
+        "rare_word": lambda: vocab[rng.randrange(len(vocab) // 2, len(vocab))],
+        "two_words": lambda: f"{vocab[rng.randrange(50)]} {vocab[rng.randrange(50, 2000)]}",
+        "prefix": lambda: vocab[rng.randrange(200)][:3],
+        # Search as you type: the first keystrokes match a large share of the vocabulary
+        "prefix_1_char": lambda: vocab[rng.randrange(len(vocab))][:1],
+        "prefix_2_chars": lambda: vocab[rng.randrange(len(vocab))][:2],
+    }
+    results["query"] = {}
+    for name, make_query in queries.items():
+        samples = []
+        matches = 0
+        for _ in range(args.queries):
+            query = make_query()
+            start = time.perf_counter()
+            total, _ = await index.search(query, limit=20)
+            samples.append(time.perf_counter() - start)
+            matches += total
+        results["query"][name] = dict(summarize(samples), mean_matches=round(matches / args.queries, 1))
+    await db.search_postings.drop()
+    await db.search_documents.drop()
+    await db.search_terms.drop()
+    report("search", results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=100000 if BENCH_MONGO_URI else 200)
+    parser.add_argument("--words", type=int, default=80)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--saves", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200 if BENCH_MONGO_URI else 10)
+    asyncio.run(main(parser.parse_args()))
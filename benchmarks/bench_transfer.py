@@ -0,0 +1,135 @@
+"""Bulk import and export throughput, against one write per document.
+
+    python -m benchmarks.bench_transfer [--documents N] [--chars 1000]
+                                        [--batch-sizes 1000] [--baseline N]
+
+Writes an NDJSON file of --documents documents of --chars characters, then:
+
+import:    db.transfer.import_lines from the file into an empty collection,
+           once per --batch-sizes entry (insert_many, ordered=False)
+baseline:  --baseline of the same documents as one upsert each, as
+           thousands of POST /api/documents/{doc_id} calls would write them
+export:    the collection back out as NDJSON, plain and gzip, to /dev/null
+
+``peak_rss_mb`` is the process high-water mark after each step; a flat line
+means the step streamed. With BENCH_MONGO_URI the defaults are a million
+documents and a 10k baseline; mongomock scans for every lookup, so there
+they are 5000 and 500.
+"""
+import os
+import argparse
+import asyncio
+import json
+import random
+import resource
+import tempfile
+import time
+
+os.environ.setdefault("JOURNAL_DIR", "")
+
+from benchmarks._common import BENCH_DB_NAME, BENCH_MONGO_URI, make_client, report
+from collab.store import DocumentStore
+from db.schema import INDEXES, ensure_schema
+from db.transfer import export_lines, import_lines
+
+READ_BYTES = 1024 * 1024
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def write_dataset(path, count, chars):
+    rng = random.Random(11)
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+    with open(path, "w") as f:
+        for i in range(count):
+            text = " ".join(rng.choice(words) for _ in range(chars // 6))[:chars]
+            f.write(json.dumps({"type": "document", "doc_id": f"doc-{i:07d}", "content": text, "rev": 1}) + "\n")
+    return os.path.getsize(path)
+
+async def read(path):
+    with open(path, "rb") as f:
+        while True:
+            piece = await asyncio.to_thread(f.read, READ_BYTES)
+            if not piece:
+                return
+            yield piece
+
+async def fresh_store(db):
+    await db.documents.drop()
+    await db.document_chunks.drop()
+    if BENCH_MONGO_URI:
+        # mongomock checks unique indexes by scanning, which makes loading quadratic
+        await ensure_schema(db, {name: INDEXES[name] for name in ("documents", "document_chunks")})
+    store = DocumentStore()
+    await store.start(db.documents, db.document_chunks)
+    return store
+
+async def main(args):
+    db = make_client()[BENCH_DB_NAME]
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+    results = {"documents": args.documents, "chars": args.chars}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "export.ndjson")
+        size = write_dataset(path, args.documents, args.chars)
+        results["file_mb"] = round(size / 2 ** 20, 1)
+        results["import"] = {}
+        for batch_size in batch_sizes:
+            store = await fresh_store(db)
+            start = time.perf_counter()
+            outcome = await import_lines(store, db.users, read(path), batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+            assert outcome["documents_inserted"] == args.documents, outcome
+            await store.stop()
+            results["import"][str(batch_size)] = {
+                "documents_per_s": round(args.documents / elapsed, 1),
+                "mb_per_s": round(size / 2 ** 20 / elapsed, 2),
+                "seconds": round(elapsed, 2),
+                "peak_rss_mb": peak_rss_mb(),
+            }
+
+        rows = []
+        with open(path) as f:
+            for _, line in zip(range(args.baseline), f):
+                rows.append(json.loads(line))
+        await db.baseline.drop()
+        if BENCH_MONGO_URI:
+            await db.baseline.create_index("doc_id", unique=True)
+        start = time.perf_counter()
+        for row in rows:
+            await db.baseline.update_one(
+                {"doc_id": row["doc_id"]}, {"$set": {"content": row["content"], "revision": row["rev"]}}, upsert=True
+            )
+        elapsed = time.perf_counter() - start
+        results["baseline_one_upsert_each"] = {"documents": len(rows), "documents_per_s": round(len(rows) / elapsed, 1)}
+        await db.baseline.drop()
+
+    results["export"] = {}
+    for name, level in (("plain", None), ("gzip", 5)):
+        store = DocumentStore()
+        await store.start(db.documents, db.document_chunks)
+        written = 0
+        start = time.perf_counter()
+        with open(os.devnull, "wb") as out:
+            async for piece in export_lines(store, db.users, ["documents"], batch_sizes[0], level):
+                written += len(piece)
+                out.write(piece)
+        elapsed = time.perf_counter() - start
+        await store.stop()
+        results["export"][name] = {
+            "documents_per_s": round(args.documents / elapsed, 1),
+            "output_mb": round(written / 2 ** 20, 1),
+            "seconds": round(elapsed, 2),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    await db.documents.drop()
+    await db.document_chunks.drop()
+    report("transfer", results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=1000000 if BENCH_MONGO_URI else 5000)
+    parser.add_argument("--chars", type=int, default=1000)
+    parser.add_argument("--batch-sizes", default="1000")
+    parser.add_argument("--baseline", type=int, default=10000 if BENCH_MONGO_URI else 500)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,74 @@
+"""Write-through update_one per change vs the write-behind DocumentStore.
+
+    python -m benchmarks.bench_write_behind [--editors 12] [--edits 200] [--docs 5]
+
+Each of `editors` collaborators on each of `docs` documents makes `edits`
+keystroke ops. Reports database writes issued, wall time and the store's
+hit rate / flush batch metrics.
+"""
+import argparse
+import asyncio
+import datetime
+import time
+
+from benchmarks._common import BENCH_DB_NAME, make_client, report
+from collab.ot import TextOperation
+from collab.store import DocumentStore
+
+async def write_through(collection, editors, edits, docs):
+    content = {f"doc-{d}": "" for d in range(docs)}
+    writes = 0
+    start = time.perf_counter()
+    for _ in range(edits):
+        for doc_id in content:
+            for _ in range(editors):
+                content[doc_id] += "x"
+                await collection.update_one(
+                    {"doc_id": doc_id},
+                    {"$set": {"content": content[doc_id], "updated_at": datetime.datetime.utcnow()}},
+                    upsert=True
+                )
+                writes += 1
+    return {"db_writes": writes, "seconds": round(time.perf_counter() - start, 4)}
+
+async def write_behind(collection, editors, edits, docs, interval_ms, max_ops):
+    store = DocumentStore(flush_interval_ms=interval_ms, flush_max_ops=max_ops)
+    await store.start(collection)
+    states = [await store.open(f"doc-{d}") for d in range(docs)]
+    start = time.perf_counter()
+    for _ in range(edits):
+        for state in states:
+            for _ in range(editors):
+                state.apply_client_op(state.revision, TextOperation().retain(len(state.content)).insert("x"))
+                store.changed(state)
+        # Yield like a real server between websocket frames
+        await asyncio.sleep(0)
+    await store.stop()
+    elapsed = time.perf_counter() - start
+    metrics = store.metrics()
+    return {
+        "db_writes": metrics["documents_written"],
+        "flushes": metrics["flushes"],
+        "mean_batch": metrics["mean_batch"],
+        "writes_saved": metrics["writes_saved"],
+        "seconds": round(elapsed, 4),
+    }
+
+async def main(editors, edits, docs, interval_ms, max_ops):
+    db = make_client()[BENCH_DB_NAME]
+    await db.documents.drop()
+    results = {"write_through": await write_through(db.documents, editors, edits, docs)}
+    await db.documents.drop()
+    results["write_behind"] = await write_behind(db.documents, editors, edits, docs, interval_ms, max_ops)
+    await db.documents.drop()
+    report("write_behind", results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--editors", type=int, default=12)
+    parser.add_argument("--edits", type=int, default=200)
+    parser.add_argument("--docs", type=int, default=5)
+    parser.add_argument("--flush-interval-ms", type=int, default=500)
+    parser.add_argument("--flush-max-ops", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.editors, args.edits, args.docs, args.flush_interval_ms, args.flush_max_ops))
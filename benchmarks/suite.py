@@ -0,0 +1,302 @@
+"""End-to-end scenarios against the real app, booted in-process.
+
+    python -m benchmarks.suite [--scenarios login get save fanout reconnect]
+                               [--concurrency 50] [--requests 1000] [--clients 200]
+                               [--output results.json] [--compare baseline.json]
+
+``main:app`` runs with its lifespan (schema, document store, websocket
+manager) against mongomock-motor, or the mongod at BENCH_MONGO_URI. HTTP
+goes through httpx's ASGI transport and websockets through ASGIWebSocket
+below, so nothing listens on a port and runs are repeatable.
+
+login:     POST /api/auth/login for --users existing users
+get:       GET /api/documents/{doc_id} over --docs documents
+save:      POST /api/documents/{doc_id} with --doc-kb of content
+fanout:    one writer sends --ops ops to a document --clients are watching;
+           latency is from sending an op to each client receiving it
+reconnect: --clients connected across --docs documents drop, --missed ops
+           are made, and all reconnect at once with ?since=; latency is
+           from connecting to being caught up
+
+Every scenario reports throughput and p50/p95/p99 in milliseconds. The JSON
+also records the commit and arguments; pass an earlier run to --compare to
+get the change of every number.
+"""
+import os
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from collections import Counter
+from urllib.parse import urlencode
+
+from benchmarks._common import BENCH_DB_NAME, asgi_client, make_client, run_concurrent, summarize
+
+PASSWORD = "correct horse battery staple"
+
+class ASGIWebSocket:
+    """A websocket client talking to an ASGI app in-process"""
+
+    def __init__(self, app, path: str, **params):
+        self.app = app
+        self.path = path
+        self.query = urlencode(params).encode()
+        self.incoming: "asyncio.Queue[dict]" = asyncio.Queue()
+        self.outgoing: "asyncio.Queue[dict]" = asyncio.Queue()
+        self.task = None
+        self.close_code = None
+
+    async def connect(self):
+        scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "http_version": "1.1",
+            "path": self.path, "raw_path": self.path.encode(), "query_string": self.query,
+            "root_path": "", "headers": [], "subprotocols": [],
+            "client": ("bench", 1), "server": ("bench", 80),
+        }
+        await self.outgoing.put({"type": "websocket.connect"})
+        self.task = asyncio.create_task(self.app(scope, self.outgoing.get, self.incoming.put))
+        event = await self.incoming.get()
+        if event["type"] != "websocket.accept":
+            raise ConnectionError(f"Handshake refused: {event}")
+        return self
+
+    async def send_json(self, message: dict):
+        await self.outgoing.put({"type": "websocket.receive", "text": json.dumps(message)})
+
+    async def receive_json(self) -> dict:
+        event = await self.incoming.get()
+        if event["type"] == "websocket.close":
+            self.close_code = event.get("code", 1000)
+            raise ConnectionError(f"Closed with {self.close_code}")
+        return json.loads(event["text"] if event.get("text") is not None else event["bytes"])
+
+    async def close(self):
+        if self.task is not None and not self.task.done():
+            await self.outgoing.put({"type": "websocket.disconnect", "code": 1000})
+            await self.task
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def with_statuses(samples, elapsed, statuses: Counter) -> dict:
+    result = summarize(samples, elapsed)
+    result["statuses"] = {str(status): count for status, count in sorted(statuses.items())}
+    return result
+
+async def http_scenario(client, request, args) -> dict:
+    """Run ``request(i)`` --requests times at --concurrency, counting statuses"""
+    statuses = Counter()
+    counter = iter(range(args.requests))
+
+    async def one():
+        response = await request(next(counter))
+        statuses[response.status_code] += 1
+
+    samples, elapsed = await run_concurrent(one, args.requests, args.concurrency)
+    return with_statuses(samples, elapsed, statuses)
+
+async def login(app, db, args) -> dict:
+    from auth.passwords import password_hasher
+
+    hashed = await password_hasher.hash(PASSWORD)
+    await db.users.insert_many([
+        {"username": f"bench-{i}", "password": hashed, "email": f"bench-{i}@example.com"}
+        for i in range(args.users)
+    ])
+    async with asgi_client(app) as client:
+        return await http_scenario(client, lambda i: client.post(
+            "/api/auth/login", json={"username": f"bench-{i % args.users}", "password": PASSWORD}
+        ), args)
+
+async def seed_documents(client, args):
+    content = "lorem ipsum " * (args.doc_kb * 1024 // 12)
+    for d in range(args.docs):
+        await client.post(f"/api/documents/doc-{d}", json={"content": content})
+    return content
+
+async def get(app, db, args) -> dict:
+    rng = random.Random(1)
+    async with asgi_client(app) as client:
+        await seed_documents(client, args)
+        return await http_scenario(
+            client, lambda i: client.get(f"/api/documents/doc-{rng.randrange(args.docs)}"), args
+        )
+
+async def save(app, db, args) -> dict:
+    rng = random.Random(2)
+    content = "lorem ipsum " * (args.doc_kb * 1024 // 12)
+    async with asgi_client(app) as client:
+        return await http_scenario(client, lambda i: client.post(
+            f"/api/documents/doc-{rng.randrange(args.docs)}", json={"content": f"{i} {content}"}
+        ), args)
+
+def token(i: int) -> str:
+    from auth.jwt_handler import create_access_token
+    return create_access_token({"sub": f"bench-{i}"})
+
+async def fanout(app, db, args) -> dict:
+    writer = await ASGIWebSocket(app, "/ws/fanout-doc", token=token(0)).connect()
+    snapshot = await writer.receive_json()
+    readers = []
+    for i in range(args.clients):
+        reader = await ASGIWebSocket(app, "/ws/fanout-doc", token=token(i + 1)).connect()
+        await reader.receive_json()
+        readers.append(reader)
+    sent_at = {}
+    samples = []
+
+    async def read(reader):
+        for _ in range(args.ops):
+            message = await reader.receive_json()
+            samples.append(time.perf_counter() - sent_at[message["rev"]])
+
+    receiving = [asyncio.create_task(read(reader)) for reader in readers]
+    rev, length = snapshot["rev"], len(snapshot["content"])
+    start = time.perf_counter()
+    for _ in range(args.ops):
+        sent_at[rev + 1] = time.perf_counter()
+        await writer.send_json({"type": "op", "rev": rev, "ops": [length, "x"] if length else ["x"]})
+        ack = await writer.receive_json()
+        rev, length = ack["rev"], length + 1
+    await asyncio.gather(*receiving)
+    elapsed = time.perf_counter() - start
+    for websocket in [writer] + readers:
+        await websocket.close()
+    result = summarize(samples, elapsed)
+    result["ops_per_s"] = round(args.ops / elapsed, 2)
+    return result
+
+async def reconnect(app, db, args) -> dict:
+    doc_ids = [f"reconnect-{d}" for d in range(args.docs)]
+    revisions = {}
+    clients = []
+    for i in range(args.clients):
+        websocket = await ASGIWebSocket(app, f"/ws/{doc_ids[i % args.docs]}", token=token(i)).connect()
+        revisions[doc_ids[i % args.docs]] = (await websocket.receive_json())["rev"]
+        clients.append(websocket)
+    for websocket in clients:
+        await websocket.close()
+    # Edits made while everyone was away
+    for doc_id in doc_ids:
+        editor = await ASGIWebSocket(app, f"/ws/{doc_id}", token=token(0)).connect()
+        snapshot = await editor.receive_json()
+        rev, length = snapshot["rev"], len(snapshot["content"])
+        for _ in range(args.missed):
+            await editor.send_json({"type": "op", "rev": rev, "ops": [length, "x"] if length else ["x"]})
+            rev, length = (await editor.receive_json())["rev"], length + 1
+        await editor.close()
+    samples = []
+    kinds = Counter()
+
+    async def catch_up(i):
+        doc_id = doc_ids[i % args.docs]
+        start = time.perf_counter()
+        websocket = await ASGIWebSocket(
+            app, f"/ws/{doc_id}", token=token(i), since=revisions[doc_id]
+        ).connect()
+        first = await websocket.receive_json()
+        kinds[first["type"]] += 1
+        if first["type"] == "resume":
+            while (await websocket.receive_json())["rev"] < first["rev"]:
+                pass
+        samples.append(time.perf_counter() - start)
+        return websocket
+
+    start = time.perf_counter()
+    websockets = await asyncio.gather(*(catch_up(i) for i in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    for websocket in websockets:
+        await websocket.close()
+    result = summarize(samples, elapsed)
+    result["caught_up_by"] = dict(kinds)
+    return result
+
+SCENARIOS = {"login": login, "get": get, "save": save, "fanout": fanout, "reconnect": reconnect}
+
+def flatten(results, prefix=""):
+    numbers = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            numbers.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            numbers[prefix + key] = value
+    return numbers
+
+def compare(before: dict, after: dict) -> dict:
+    """Every number present in both runs, with its change in percent"""
+    old, new = flatten(before["results"]), flatten(after["results"])
+    return {
+        key: {"before": old[key], "after": new[key],
+              "change_pct": round((new[key] - old[key]) / old[key] * 100, 2) if old[key] else None}
+        for key in sorted(old.keys() & new.keys())
+    }
+
+async def run(args) -> dict:
+    from db import mongo
+    import main
+
+    client = make_client()
+    db = client[BENCH_DB_NAME]
+    for name in await db.list_collection_names():
+        await db[name].drop()
+    # The lifespan reuses this client instead of connecting to MONGODB_URI
+    await mongo.connect_mongo(client, health_interval=0)
+    results = {}
+    try:
+        async with main.app.router.lifespan_context(main.app):
+            for name in args.scenarios:
+                results[name] = await SCENARIOS[name](main.app, db, args)
+    finally:
+        for name in await db.list_collection_names():
+            await db[name].drop()
+    return results
+
+def main(args):
+    # Fixed before the app is imported; limits and shedding would make runs
+    # measure the protections rather than the paths behind them
+    os.environ.setdefault("JOURNAL_DIR", "")
+    os.environ.setdefault("MONGO_DB_NAME", BENCH_DB_NAME)
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    os.environ.setdefault("WS_MAX_LOOP_LAG_MS", "0")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("BCRYPT_ROUNDS", str(args.bcrypt_rounds))
+    results = asyncio.run(run(args))
+    output = {
+        "benchmark": "suite",
+        "backend": "mongod" if os.getenv("BENCH_MONGO_URI") else "mongomock",
+        "commit": git_commit(),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        output["compared_to"] = baseline.get("commit")
+        output["changes"] = compare(baseline, output)
+    print(json.dumps(output, indent=2, sort_keys=True))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--doc-kb", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--ops", type=int, default=50)
+    parser.add_argument("--missed", type=int, default=10)
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--compare", help="an earlier --output file to compare against")
+    main(parser.parse_args())
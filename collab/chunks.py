@@ -0,0 +1,151 @@
+"""Chunked storage for content too large to keep in one MongoDB document.
+
+MongoDB caps a document at 16 MB, and rewriting a whole large body on
+every flush wastes I/O. Large content is therefore split into blocks of
+about ``chunk_size`` characters, stored one per row and listed, in order,
+by the row that owns them.
+
+A live document's blocks live in ``document_chunks`` as ``{doc_id, n, data}``.
+The ChunkLayout tracks which blocks edits touched, so a flush only writes
+those. Blocks are copy-on-write: a changed block gets a new number, and the
+old row is deleted only after the document row lists the new numbers. A
+crash mid-flush therefore leaves only unreferenced rows behind, never a
+document pointing at half-written content.
+
+History snapshots and whole-content op log entries that are too large go
+to ``history_chunks`` as ``{doc_id, kind, rev, n, data}``. They never change,
+so they are numbered ``0 .. chunks-1``.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from collab.ot import TextOperation
+
+def split(content: str, chunk_size: int) -> List[str]:
+    return [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)] or [""]
+
+class MissingChunkError(RuntimeError):
+    """A row lists a chunk that is not stored"""
+
+def in_order(owner: str, numbers: List[int], rows: Dict[int, str]) -> List[str]:
+    """Chunk texts in the order ``numbers`` lists them"""
+    try:
+        return [rows[n] for n in numbers]
+    except KeyError as e:
+        raise MissingChunkError(f"{owner} is missing chunk {e.args[0]}")
+
+class Chunk:
+    __slots__ = ("length", "number", "version")
+
+    def __init__(self, length: int, number: Optional[int] = None):
+        self.length = length
+        # Stored row holding this chunk's current text; None once edited
+        self.number = number
+        # Bumped by every edit, so a flush can tell the chunk changed under it
+        self.version = 0
+
+class ChunkLayout:
+    """Lengths and stored numbers of a live document's chunks, kept in step with its edits"""
+    __slots__ = ("chunks", "next_number")
+
+    def __init__(self, chunks: List[Chunk], next_number: int = 0):
+        self.chunks = chunks
+        self.next_number = next_number
+
+    @classmethod
+    def stored(cls, numbers: List[int], pieces: List[str]) -> "ChunkLayout":
+        return cls([Chunk(len(piece), n) for n, piece in zip(numbers, pieces)],
+                   max(numbers, default=-1) + 1)
+
+    def replace(self, length: int):
+        """Whole-content replacement; the next plan splits it up again"""
+        self.chunks = [Chunk(length)]
+
+    def edit(self, op: TextOperation):
+        """Follow an applied op, marking the chunks it touches"""
+        chunks = self.chunks
+        index = 0
+        offset = 0
+        for component in op.ops:
+            if isinstance(component, str):
+                if not chunks:
+                    chunks.append(Chunk(0))
+                if index == len(chunks):
+                    # Appending at the very end goes into the last chunk
+                    index -= 1
+                    offset = chunks[index].length
+                chunk = chunks[index]
+                chunk.length += len(component)
+                offset += len(component)
+                self._touch(chunk)
+            elif component > 0:
+                remaining = component
+                while remaining:
+                    room = chunks[index].length - offset
+                    if remaining < room:
+                        offset += remaining
+                        break
+                    remaining -= room
+                    index += 1
+                    offset = 0
+            else:
+                remaining = -component
+                while remaining:
+                    chunk = chunks[index]
+                    taken = min(remaining, chunk.length - offset)
+                    if taken:
+                        chunk.length -= taken
+                        remaining -= taken
+                        self._touch(chunk)
+                    if remaining:
+                        index += 1
+                        offset = 0
+
+    @staticmethod
+    def _touch(chunk: Chunk):
+        chunk.number = None
+        chunk.version += 1
+
+    def plan(self, content: str, chunk_size: int) -> Tuple[List[int], List[Tuple[Chunk, int, int, str]]]:
+        """Rebalance, then number the changed chunks for a flush of ``content``.
+
+        Returns the chunk numbers in order and ``(chunk, version, number, text)``
+        for each chunk to write. Pass the latter to ``commit`` once they and
+        the numbers are stored.
+        """
+        rebalanced: List[Chunk] = []
+        for chunk in self.chunks:
+            if chunk.length == 0:
+                continue
+            if chunk.length > 2 * chunk_size:
+                pieces, rest = divmod(chunk.length, chunk_size)
+                rebalanced.extend(Chunk(chunk_size) for _ in range(pieces))
+                if rest:
+                    rebalanced.append(Chunk(rest))
+                continue
+            previous = rebalanced[-1] if rebalanced else None
+            if (previous is not None and (previous.number is None or chunk.number is None)
+                    and previous.length + chunk.length <= chunk_size):
+                # Fold fragments into their neighbour while it is rewritten anyway
+                previous.length += chunk.length
+                self._touch(previous)
+                continue
+            rebalanced.append(chunk)
+        self.chunks = rebalanced
+        numbers = []
+        writes = []
+        offset = 0
+        for chunk in rebalanced:
+            number = chunk.number
+            if number is None:
+                number = self.next_number
+                self.next_number += 1
+                writes.append((chunk, chunk.version, number, content[offset:offset + chunk.length]))
+            numbers.append(number)
+            offset += chunk.length
+        return numbers, writes
+
+    def commit(self, writes: List[Tuple[Chunk, int, int, str]]):
+        """Mark planned chunks as stored, unless they were edited since"""
+        for chunk, version, number, _ in writes:
+            if chunk.version == version:
+                chunk.number = number
@@ -0,0 +1,175 @@
+from collections import deque
+from itertools import islice
+from typing import List, Optional, Set, Tuple
+import time
+
+from collab.chunks import ChunkLayout
+from collab.ot import OTError, TextOperation, transform
+from collab.rope import Rope
+
+DEFAULT_HISTORY_LIMIT = 1000
+# Documents at least this long are edited in a Rope; below it copying the
+# str per edit is cheaper
+DEFAULT_ROPE_MIN_CHARS = 64 * 1024
+# Listing titles are the first non-blank line, cut to this many characters
+TITLE_MAX_CHARS = 100
+
+def document_title(content: str) -> str:
+    # Only the start is looked at, so a huge document costs no more
+    for line in content[:TITLE_MAX_CHARS * 40].splitlines():
+        line = line.strip()
+        if line:
+            return line[:TITLE_MAX_CHARS]
+    return ""
+
+class StaleRevisionError(OTError):
+    """The client's base revision is no longer in the server history"""
+
+class DocumentState:
+    """Authoritative in-memory state of a document with live sessions.
+
+    ``revision`` counts every accepted change. ``history`` keeps the most
+    recent operations so an op made against an older revision can be
+    transformed forward before it is applied.
+
+    When ``log`` is a list, every change is also appended to it as
+    ``(revision, ops, content, timestamp)`` (``ops`` for an op, ``content``
+    for a full replacement) until the store writes it to the op log.
+
+    ``chunks`` is the ChunkLayout of a document stored in chunks, or None.
+
+    Once a document reaches ``rope_min_chars``, edits go to a Rope and
+    ``content`` builds the string on first use after a change, so a burst of
+    edits costs O(log n) each and one O(n) copy when it is next flushed or sent.
+
+    ``owner`` is the user who created the document (or first edited one that
+    had no owner); ``editors`` collects the other users who changed it since
+    the last flush, which adds them to the stored collaborators.
+    """
+    __slots__ = (
+        "doc_id", "_text", "_rope", "rope_min_chars", "revision", "history",
+        "persisted_revision", "log", "snapshot_revision", "log_bytes", "chunks",
+        "owner", "editors"
+    )
+
+    def __init__(self, doc_id: str, content: str = "", revision: int = 0,
+                 history_limit: int = DEFAULT_HISTORY_LIMIT,
+                 rope_min_chars: int = DEFAULT_ROPE_MIN_CHARS):
+        self.doc_id = doc_id
+        # The text as a str, a Rope, or both; _text is None while it is stale
+        self._text: Optional[str] = content
+        self._rope: Optional[Rope] = None
+        self.rope_min_chars = rope_min_chars
+        self.revision = revision
+        self.history = deque(maxlen=history_limit)
+        # Revision last written to the database
+        self.persisted_revision = revision
+        self.log: Optional[List[Tuple[int, Optional[list], Optional[str], float]]] = None
+        # Latest revision with a stored snapshot; None if history has no base yet
+        self.snapshot_revision: Optional[int] = 0 if revision == 0 else None
+        # Approximate size of the changes since that snapshot
+        self.log_bytes = 0
+        self.chunks: Optional[ChunkLayout] = None
+        self.owner: Optional[str] = None
+        self.editors: Optional[Set[str]] = None
+
+    @property
+    def content(self) -> str:
+        if self._text is None:
+            self._text = str(self._rope)
+        return self._text
+
+    @content.setter
+    def content(self, content: str):
+        self._text = content
+        self._rope = None
+
+    @property
+    def length(self) -> int:
+        """Length of the content, without building it"""
+        return len(self._text) if self._text is not None else len(self._rope)
+
+    @property
+    def dirty(self) -> bool:
+        return self.revision != self.persisted_revision
+
+    @property
+    def pending_changes(self) -> int:
+        """Changes accepted since the last write to the database"""
+        return self.revision - self.persisted_revision
+
+    @property
+    def oldest_revision(self) -> int:
+        """Oldest base revision an incoming op may still be made against"""
+        return self.revision - len(self.history)
+
+    def ops_since(self, revision: int) -> Optional[List[Tuple[int, TextOperation]]]:
+        """``(revision, op)`` for every change after ``revision``, or None if
+        they are no longer all in the history"""
+        if revision < self.oldest_revision or revision > self.revision:
+            return None
+        ops = islice(self.history, revision - self.oldest_revision, None)
+        return list(enumerate(ops, revision + 1))
+
+    def backfill_history(self, older: List[Tuple[int, TextOperation]]) -> bool:
+        """Prepend ops (e.g. read back from the op log) ending right before
+        the oldest one in memory, as far as the history length allows"""
+        if not older or older[-1][0] != self.oldest_revision:
+            return False
+        if self.history.maxlen is not None:
+            room = self.history.maxlen - len(self.history)
+            if room <= 0:
+                return False
+            older = older[-room:]
+        self.history.extendleft(op for _, op in reversed(older))
+        return True
+
+    def apply_client_op(self, base_revision, op: TextOperation) -> TextOperation:
+        """Transform op from base_revision to the head, apply it and return it"""
+        if not isinstance(base_revision, int) or isinstance(base_revision, bool):
+            raise OTError("op is missing an integer rev")
+        if base_revision > self.revision or base_revision < self.oldest_revision:
+            raise StaleRevisionError(
+                f"revision {base_revision} outside history [{self.oldest_revision}, {self.revision}]"
+            )
+        for past in islice(self.history, base_revision - self.oldest_revision, None):
+            _, op = transform(past, op)
+        if self._rope is None and self.length >= self.rope_min_chars:
+            self._rope = Rope(self._text)
+        if self._rope is not None:
+            self._rope.apply(op)
+            self._text = None
+        else:
+            self._text = op.apply(self._text)
+        if self.chunks is not None:
+            self.chunks.edit(op)
+        self.history.append(op)
+        self.revision += 1
+        if self.log is not None:
+            ops = op.to_json()
+            self.log.append((self.revision, ops, None, time.time()))
+            self.log_bytes += sum(len(c) if isinstance(c, str) else (-c if c < 0 else 0) for c in ops)
+        return op
+
+    def edited_by(self, user: Optional[str]):
+        """Note who made a change; anonymous changes are not attributed"""
+        if user is None or user == self.owner:
+            return
+        if self.owner is None:
+            self.owner = user
+        elif self.editors is None:
+            self.editors = {user}
+        else:
+            self.editors.add(user)
+
+    def replace_content(self, content: str) -> int:
+        """Full-content fallback; pending ops from older revisions must resync"""
+        self.content = content
+        if self.chunks is not None:
+            self.chunks.replace(len(content))
+        self.history.clear()
+        self.revision += 1
+        if self.log is not None:
+            self.log.append((self.revision, None, content, time.time()))
+            self.log_bytes += len(content)
+        return self.revision
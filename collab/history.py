@@ -0,0 +1,224 @@
+"""Document version history: an append-only op log plus periodic snapshots.
+
+Every accepted change is written to ``document_ops`` as
+``{doc_id, rev, ops | content, ts}`` in the store's write-behind batches.
+Once a document has collected ``snapshot_every_ops`` changes, or roughly
+``snapshot_every_bytes`` of edits, since its last snapshot, its full content
+is written to ``document_snapshots``. Reading a past revision loads the
+nearest snapshot at or below it and replays at most one interval of ops.
+
+Ops older than the ``keep_op_snapshots``-th most recent snapshot are
+deleted after each snapshot, so older history is kept at snapshot
+granularity and storage stays bounded.
+
+Snapshots and whole-content entries longer than ``chunk_size`` characters
+keep their content in ``history_chunks`` (see ``collab.chunks``) and record
+only how many chunks it has.
+"""
+from typing import Iterable, List, Optional, Tuple
+import datetime
+import logging
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from collab.chunks import in_order, split
+from collab.document import DocumentState
+from collab.ot import TextOperation
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+class HistoryUnavailableError(LookupError):
+    """The requested revision is not (or no longer) in the stored history"""
+
+def _ignore_duplicates(error: BulkWriteError):
+    # A retried flush re-sends entries that already made it; those are fine
+    if any(e.get("code") != DUPLICATE_KEY for e in error.details.get("writeErrors", [])):
+        raise error
+    if error.details.get("writeConcernErrors"):
+        raise error
+
+def replay(content: str, entries: Iterable[dict]) -> str:
+    """Apply op log entries, in revision order, to content"""
+    for entry in entries:
+        if "content" in entry:
+            content = entry["content"]
+        else:
+            content = TextOperation.from_json(entry["ops"]).apply(content)
+    return content
+
+class HistoryStore:
+    def __init__(self, snapshot_every_ops: int = 200, snapshot_every_bytes: int = 64 * 1024,
+                 keep_op_snapshots: int = 10, chunk_size: int = 0):
+        self.snapshot_every_ops = snapshot_every_ops
+        self.snapshot_every_bytes = snapshot_every_bytes
+        self.keep_op_snapshots = keep_op_snapshots
+        self.chunk_size = chunk_size
+        self.ops = None
+        self.snapshots = None
+        self.chunks = None
+        self.stats = {
+            "ops_written": 0,
+            "snapshots_written": 0,
+            "ops_compacted": 0,
+            "reconstructions": 0,
+            "replayed_ops": 0,
+            "max_replayed_ops": 0,
+            "resume_reads": 0,
+        }
+
+    def start(self, ops, snapshots, chunks=None):
+        """Bind to the op log, snapshot and (optionally) chunk collections"""
+        self.ops = ops
+        self.snapshots = snapshots
+        self.chunks = chunks
+
+    def snapshot_due(self, state: DocumentState) -> bool:
+        if state.snapshot_revision is None:
+            # Loaded without a history base (written before history existed)
+            return True
+        return (state.revision - state.snapshot_revision >= self.snapshot_every_ops
+                or state.log_bytes >= self.snapshot_every_bytes)
+
+    # Writing ------------------------------------------------------------
+
+    async def record(self, entries: Iterable[Tuple[str, list]], snapshots: List[Tuple[str, int, str]]):
+        """Append logged changes and write due snapshots.
+
+        ``entries`` pairs a doc_id with its ``DocumentState.log`` items;
+        ``snapshots`` holds ``(doc_id, revision, content)``.
+        """
+        documents = []
+        chunk_rows = []
+        for doc_id, log in entries:
+            for revision, ops, content, ts in log:
+                entry = {"doc_id": doc_id, "rev": revision, "ts": datetime.datetime.utcfromtimestamp(ts)}
+                if ops is not None:
+                    entry["ops"] = ops
+                elif self._chunked(content):
+                    entry["chunks"] = self._chunk_rows(chunk_rows, doc_id, "op", revision, content)
+                else:
+                    entry["content"] = content
+                documents.append(entry)
+        stored = []
+        for doc_id, revision, content in snapshots:
+            if self._chunked(content):
+                count = self._chunk_rows(chunk_rows, doc_id, "snapshot", revision, content)
+                stored.append((doc_id, revision, {"chunks": count}))
+            else:
+                stored.append((doc_id, revision, {"content": content}))
+        if chunk_rows:
+            # Chunks first, so no entry lists chunks that aren't stored
+            await self.chunks.bulk_write(chunk_rows, ordered=False)
+        if documents:
+            try:
+                await self.ops.insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                _ignore_duplicates(e)
+            self.stats["ops_written"] += len(documents)
+        if not snapshots:
+            return
+        now = datetime.datetime.utcnow()
+        await self.snapshots.bulk_write([
+            UpdateOne(
+                {"doc_id": doc_id, "rev": revision},
+                {"$setOnInsert": {**fields, "ts": now}},
+                upsert=True
+            )
+            for doc_id, revision, fields in stored
+        ], ordered=False)
+        self.stats["snapshots_written"] += len(snapshots)
+        for doc_id, _, _ in snapshots:
+            await self.compact(doc_id)
+
+    async def compact(self, doc_id: str) -> int:
+        """Drop ops that only older snapshots still need; returns how many"""
+        cutoff = await self.snapshots.find_one(
+            {"doc_id": doc_id}, {"rev": 1}, sort=[("rev", -1)], skip=self.keep_op_snapshots
+        )
+        if cutoff is None:
+            return 0
+        result = await self.ops.delete_many({"doc_id": doc_id, "rev": {"$lte": cutoff["rev"]}})
+        if self.chunks is not None:
+            await self.chunks.delete_many({"doc_id": doc_id, "kind": "op", "rev": {"$lte": cutoff["rev"]}})
+        self.stats["ops_compacted"] += result.deleted_count
+        return result.deleted_count
+
+    def _chunked(self, content: str) -> bool:
+        return self.chunks is not None and 0 < self.chunk_size < len(content)
+
+    def _chunk_rows(self, rows: list, doc_id: str, kind: str, revision: int, content: str) -> int:
+        pieces = split(content, self.chunk_size)
+        rows.extend(
+            UpdateOne({"doc_id": doc_id, "kind": kind, "rev": revision, "n": n},
+                      {"$setOnInsert": {"data": piece}}, upsert=True)
+            for n, piece in enumerate(pieces)
+        )
+        return len(pieces)
+
+    async def _read_chunks(self, doc_id: str, kind: str, revision: int, count: int) -> str:
+        rows = {}
+        async for row in self.chunks.find({"doc_id": doc_id, "kind": kind, "rev": revision}, {"n": 1, "data": 1}):
+            rows[row["n"]] = row["data"]
+        return "".join(in_order(f"{kind} {revision} of {doc_id}", list(range(count)), rows))
+
+    # Reading ------------------------------------------------------------
+
+    async def ops_after(self, doc_id: str, revision: int, until: int) -> Optional[List[Tuple[int, list]]]:
+        """``(rev, ops)`` for revisions ``revision+1 .. until`` from the op log,
+        or None if any is missing or was a whole-content replacement"""
+        self.stats["resume_reads"] += 1
+        entries = await self.ops.find(
+            {"doc_id": doc_id, "rev": {"$gt": revision, "$lte": until}}, {"rev": 1, "ops": 1}
+        ).sort("rev", 1).to_list(None)
+        if len(entries) != until - revision or any("ops" not in entry for entry in entries):
+            return None
+        return [(entry["rev"], entry["ops"]) for entry in entries]
+
+    async def revision_at(self, doc_id: str, at: datetime.datetime) -> Optional[int]:
+        """Latest revision stored at or before ``at``"""
+        query = {"doc_id": doc_id, "ts": {"$lte": at}}
+        revisions = []
+        for collection in (self.ops, self.snapshots):
+            latest = await collection.find_one(query, {"rev": 1}, sort=[("rev", -1)])
+            if latest is not None:
+                revisions.append(latest["rev"])
+        return max(revisions) if revisions else None
+
+    async def reconstruct(self, doc_id: str, revision: int) -> str:
+        """Content of the document at ``revision``"""
+        snapshot = await self.snapshots.find_one(
+            {"doc_id": doc_id, "rev": {"$lte": revision}}, sort=[("rev", -1)]
+        )
+        base_revision, content = 0, ""
+        if snapshot is not None:
+            base_revision = snapshot["rev"]
+            if "chunks" in snapshot:
+                content = await self._read_chunks(doc_id, "snapshot", base_revision, snapshot["chunks"])
+            else:
+                content = snapshot["content"]
+        entries = await self.ops.find(
+            {"doc_id": doc_id, "rev": {"$gt": base_revision, "$lte": revision}}
+        ).sort("rev", 1).to_list(None)
+        # Revisions are unique, so a short count means compaction left a gap
+        if len(entries) != revision - base_revision:
+            raise HistoryUnavailableError(f"revision {revision} of {doc_id} is not in the history")
+        for entry in entries:
+            if "chunks" in entry:
+                entry["content"] = await self._read_chunks(doc_id, "op", entry["rev"], entry["chunks"])
+        content = replay(content, entries)
+        replayed = revision - base_revision
+        self.stats["reconstructions"] += 1
+        self.stats["replayed_ops"] += replayed
+        self.stats["max_replayed_ops"] = max(self.stats["max_replayed_ops"], replayed)
+        return content
+
+    def metrics(self) -> dict:
+        stats = dict(self.stats)
+        replayed = stats.pop("replayed_ops")
+        stats["mean_replayed_ops"] = (
+            round(replayed / stats["reconstructions"], 2) if stats["reconstructions"] else 0.0
+        )
+        return stats
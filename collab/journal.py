@@ -0,0 +1,304 @@
+"""Write-ahead journal for accepted edits that are not in MongoDB yet.
+
+Each worker appends to its own memory-mapped segment files in ``directory``
+(``<pid>-<token>-<seq>.wal``), holding an exclusive ``flock`` on each one while it is
+alive. A record is::
+
+    length (4 bytes) | crc32 (4 bytes) | JSON payload
+
+and a zero length marks the end of a segment. Appends only copy into the
+mapping; a background task group-commits them with ``msync`` and resolves
+the futures ``append`` returned. Appends that arrive while a sync is running
+go out together in the next one; ``commit_interval_ms`` additionally waits
+that long (or until ``commit_max_entries`` are waiting) to batch more. Once the store has flushed every
+change in a segment, the segment is deleted, or, for the one being
+appended to, rewound and reused, so a steady trickle of edits never
+creates files.
+
+On startup, segments whose owner is gone (the lock can be taken) are read
+back by ``recover`` so the store can replay them into MongoDB.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+import asyncio
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("<II")
+PAGE = mmap.PAGESIZE
+
+class JournalError(RuntimeError):
+    """The journal could not make a record durable"""
+
+class Segment:
+    __slots__ = ("path", "fd", "map", "size", "offset", "synced", "syncing", "max_revisions")
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        self.size = size
+        self.offset = 0
+        # Bytes known to be on disk; commits sync [synced, offset)
+        self.synced = 0
+        self.syncing = False
+        # Highest revision journaled here per document
+        self.max_revisions: Dict[str, int] = {}
+
+    def close(self, delete: bool = False):
+        self.map.close()
+        if delete:
+            os.unlink(self.path)
+        os.close(self.fd)
+
+def _encode(doc_id: str, revision: int, ops: Optional[list], content: Optional[str]) -> bytes:
+    payload = {"d": doc_id, "r": revision}
+    if ops is not None:
+        payload["o"] = ops
+    else:
+        payload["c"] = content
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+def read_segment(path: str) -> List[dict]:
+    """Records of a segment up to its end marker or the first torn record"""
+    records = []
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        length, checksum = HEADER.unpack_from(data, offset)
+        start = offset + HEADER.size
+        if length == 0 or start + length > len(data):
+            break
+        payload = data[start:start + length]
+        if zlib.crc32(payload) != checksum:
+            # Torn write at the moment of the crash; nothing after it was acked
+            logger.warning(f"Journal {path}: bad checksum at offset {offset}, stopping")
+            break
+        records.append(json.loads(payload))
+        offset = start + length
+    return records
+
+class Journal:
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024,
+                 commit_interval_ms: float = 0.0, commit_max_entries: int = 256, fsync: bool = True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.commit_interval = commit_interval_ms / 1000.0
+        self.commit_max_entries = commit_max_entries
+        self.fsync = fsync
+        self._segments: List[Segment] = []
+        # Unique per process, so a reused pid never collides with a dead worker's files
+        self._prefix = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._sequence = 0
+        self._waiting: List[asyncio.Future] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._committer: Optional[asyncio.Task] = None
+        self._claimed: List[Tuple[str, int]] = []
+        self.stats = {
+            "appends": 0,
+            "bytes": 0,
+            "commits": 0,
+            "largest_commit": 0,
+            "commit_time_total": 0.0,
+            "segments_released": 0,
+            "segments_rewound": 0,
+            "recovered_records": 0,
+        }
+
+    # Lifecycle ----------------------------------------------------------
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._committer = asyncio.create_task(self._commit_loop())
+
+    async def stop(self):
+        """Commit what's pending and close the segments (they stay on disk)"""
+        if self._committer is not None:
+            self._committer.cancel()
+            try:
+                await self._committer
+            except asyncio.CancelledError:
+                pass
+            self._committer = None
+        if self._waiting:
+            await self._commit()
+        for segment in self._segments:
+            segment.close()
+        self._segments.clear()
+
+    # Recovery -----------------------------------------------------------
+
+    def recover(self) -> List[dict]:
+        """Claim segments left by dead workers and return their records.
+
+        Call ``release_recovered`` once the records are safely in MongoDB.
+        """
+        records = []
+        if not os.path.isdir(self.directory):
+            return records
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".wal"):
+                continue
+            path = os.path.join(self.directory, name)
+            fd = os.open(path, os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # A live worker owns it
+                os.close(fd)
+                continue
+            self._claimed.append((path, fd))
+            records.extend(read_segment(path))
+        self.stats["recovered_records"] += len(records)
+        if records:
+            logger.info(f"Recovered {len(records)} journal records from {len(self._claimed)} segments")
+        return records
+
+    def release_recovered(self):
+        for path, fd in self._claimed:
+            os.unlink(path)
+            os.close(fd)
+        self._claimed.clear()
+
+    # Appending ----------------------------------------------------------
+
+    def append(self, doc_id: str, revision: int, ops: Optional[list] = None,
+               content: Optional[str] = None) -> asyncio.Future:
+        """Journal one change; the future resolves once it is durable"""
+        payload = _encode(doc_id, revision, ops, content)
+        segment = self._segments[-1] if self._segments else None
+        needed = HEADER.size + len(payload)
+        # Keep room for the zero end marker
+        if segment is None or segment.offset + needed + HEADER.size > segment.size:
+            segment = self._open_segment(needed + HEADER.size)
+        HEADER.pack_into(segment.map, segment.offset, len(payload), zlib.crc32(payload))
+        segment.map[segment.offset + HEADER.size:segment.offset + needed] = payload
+        segment.offset += needed
+        # A rewound segment still holds older records past this point
+        HEADER.pack_into(segment.map, segment.offset, 0, 0)
+        if revision > segment.max_revisions.get(doc_id, -1):
+            segment.max_revisions[doc_id] = revision
+        self.stats["appends"] += 1
+        self.stats["bytes"] += needed
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append(future)
+        self._wakeup.set()
+        if len(self._waiting) >= self.commit_max_entries:
+            self._full.set()
+        return future
+
+    def barrier(self) -> Optional[asyncio.Future]:
+        """Future for the latest append, or None if everything is durable"""
+        if self._waiting:
+            return self._waiting[-1]
+        return None
+
+    def _open_segment(self, needed: int) -> Segment:
+        self._sequence += 1
+        path = os.path.join(self.directory, f"{self._prefix}-{self._sequence:08d}.wal")
+        segment = Segment(path, max(self.segment_bytes, needed))
+        self._segments.append(segment)
+        return segment
+
+    # Group commit -------------------------------------------------------
+
+    async def _commit_loop(self):
+        while True:
+            await self._wakeup.wait()
+            if self.commit_interval and len(self._waiting) < self.commit_max_entries:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.commit_interval)
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self._commit()
+            except Exception as e:
+                logger.error(f"Journal commit failed: {str(e)}", exc_info=True)
+
+    async def _commit(self):
+        self._wakeup.clear()
+        self._full.clear()
+        waiting, self._waiting = self._waiting, []
+        if not waiting:
+            return
+        ranges = [(s, s.synced, s.offset) for s in self._segments if s.offset > s.synced]
+        for segment, _, _ in ranges:
+            segment.syncing = True
+        start = time.perf_counter()
+        try:
+            if self.fsync:
+                await asyncio.get_running_loop().run_in_executor(None, _sync, ranges)
+        except Exception as e:
+            error = JournalError(f"journal sync failed: {e}")
+            for future in waiting:
+                if not future.done():
+                    future.set_exception(error)
+            raise
+        finally:
+            for segment, _, _ in ranges:
+                segment.syncing = False
+        for segment, _, end in ranges:
+            segment.synced = max(segment.synced, end)
+        elapsed = time.perf_counter() - start
+        self.stats["commits"] += 1
+        self.stats["largest_commit"] = max(self.stats["largest_commit"], len(waiting))
+        self.stats["commit_time_total"] += elapsed
+        for future in waiting:
+            if not future.done():
+                future.set_result(None)
+
+    # Truncation ---------------------------------------------------------
+
+    def checkpoint(self, persisted_revision: Callable[[str], int]) -> int:
+        """Delete sealed segments whose changes are all in MongoDB and rewind
+        the active one if it is all in too; returns how many were deleted"""
+        released = 0
+        for segment in list(self._segments):
+            if segment.syncing or segment.synced < segment.offset:
+                continue
+            if any(persisted_revision(doc_id) < revision
+                   for doc_id, revision in segment.max_revisions.items()):
+                continue
+            if segment is self._segments[-1]:
+                if segment.offset:
+                    # Records left behind the new end marker are all in MongoDB
+                    # already, so replaying them after a crash skips them
+                    HEADER.pack_into(segment.map, 0, 0, 0)
+                    segment.offset = segment.synced = 0
+                    segment.max_revisions.clear()
+                    self.stats["segments_rewound"] += 1
+                continue
+            self._segments.remove(segment)
+            segment.close(delete=True)
+            released += 1
+        self.stats["segments_released"] += released
+        return released
+
+    def metrics(self) -> dict:
+        stats = dict(self.stats)
+        commits = stats["commits"]
+        stats["mean_commit"] = round(stats["appends"] / commits, 2) if commits else 0.0
+        stats["mean_commit_ms"] = round(stats.pop("commit_time_total") / commits * 1000, 3) if commits else 0.0
+        stats["pending"] = len(self._waiting)
+        stats["segments"] = len(self._segments)
+        return stats
+
+def _sync(ranges):
+    for segment, start, end in ranges:
+        # msync needs a page-aligned start
+        aligned = start - start % PAGE
+        segment.map.flush(aligned, end - aligned)
@@ -0,0 +1,245 @@
+"""Operational transform for plain-text documents.
+
+An operation is a list of components that walks the whole document:
+
+    positive int  -> retain that many characters
+    str           -> insert the string
+    negative int  -> delete that many characters
+
+so ``[5, "abc", -2, 10]`` keeps 5 chars, inserts "abc", deletes 2 and keeps
+the remaining 10. This is the same wire format used by ot.js, which lets the
+frontend reuse an existing client implementation.
+"""
+from typing import List, Tuple, Union
+
+Component = Union[int, str]
+
+class OTError(ValueError):
+    """Raised when an operation is malformed or does not fit the document"""
+
+class TextOperation:
+    __slots__ = ("ops", "base_length", "target_length")
+
+    def __init__(self):
+        self.ops: List[Component] = []
+        self.base_length = 0
+        self.target_length = 0
+
+    def __eq__(self, other):
+        return isinstance(other, TextOperation) and self.ops == other.ops
+
+    def __repr__(self):
+        return f"TextOperation({self.ops!r})"
+
+    # Builders -----------------------------------------------------------
+
+    def retain(self, n: int) -> "TextOperation":
+        if n == 0:
+            return self
+        if n < 0:
+            raise OTError("retain expects a positive integer")
+        self.base_length += n
+        self.target_length += n
+        if self.ops and _is_retain(self.ops[-1]):
+            self.ops[-1] += n
+        else:
+            self.ops.append(n)
+        return self
+
+    def insert(self, text: str) -> "TextOperation":
+        if not text:
+            return self
+        self.target_length += len(text)
+        ops = self.ops
+        if ops and isinstance(ops[-1], str):
+            ops[-1] += text
+        elif ops and _is_delete(ops[-1]):
+            # Keep inserts before deletes so equal operations compare equal
+            if len(ops) > 1 and isinstance(ops[-2], str):
+                ops[-2] += text
+            else:
+                ops.insert(len(ops) - 1, text)
+        else:
+            ops.append(text)
+        return self
+
+    def delete(self, n: int) -> "TextOperation":
+        if n == 0:
+            return self
+        if n < 0:
+            n = -n
+        self.base_length += n
+        if self.ops and _is_delete(self.ops[-1]):
+            self.ops[-1] -= n
+        else:
+            self.ops.append(-n)
+        return self
+
+    def is_noop(self) -> bool:
+        return not self.ops or (len(self.ops) == 1 and _is_retain(self.ops[0]))
+
+    # Serialisation ------------------------------------------------------
+
+    def to_json(self) -> List[Component]:
+        return list(self.ops)
+
+    @classmethod
+    def from_json(cls, ops) -> "TextOperation":
+        if not isinstance(ops, list):
+            raise OTError("operation must be a list")
+        op = cls()
+        for component in ops:
+            if isinstance(component, bool):
+                raise OTError(f"invalid component: {component!r}")
+            if isinstance(component, str):
+                op.insert(component)
+            elif isinstance(component, int):
+                if component > 0:
+                    op.retain(component)
+                else:
+                    op.delete(component)
+            else:
+                raise OTError(f"invalid component: {component!r}")
+        return op
+
+    @classmethod
+    def from_edit(cls, doc_length: int, pos: int, delete: int = 0, text: str = "") -> "TextOperation":
+        """Build an operation from a single positional edit"""
+        if pos < 0 or delete < 0 or pos + delete > doc_length:
+            raise OTError("edit is out of range")
+        return cls().retain(pos).delete(delete).insert(text).retain(doc_length - pos - delete)
+
+    # Core algorithms ----------------------------------------------------
+
+    def apply(self, doc: str) -> str:
+        if len(doc) != self.base_length:
+            raise OTError(
+                f"operation base length {self.base_length} does not match document length {len(doc)}"
+            )
+        parts = []
+        index = 0
+        for component in self.ops:
+            if isinstance(component, str):
+                parts.append(component)
+            elif component > 0:
+                parts.append(doc[index:index + component])
+                index += component
+            else:
+                index -= component
+        return "".join(parts)
+
+    def compose(self, other: "TextOperation") -> "TextOperation":
+        """Return one operation equivalent to applying self then other"""
+        if self.target_length != other.base_length:
+            raise OTError("compose: target length of the first op must match base length of the second")
+        result = TextOperation()
+        ops1, ops2 = self.ops, other.ops
+        i1 = i2 = 0
+        op1 = ops1[0] if ops1 else None
+        op2 = ops2[0] if ops2 else None
+        while op1 is not None or op2 is not None:
+            if op1 is not None and _is_delete(op1):
+                result.delete(op1)
+                i1 += 1
+                op1 = ops1[i1] if i1 < len(ops1) else None
+                continue
+            if op2 is not None and isinstance(op2, str):
+                result.insert(op2)
+                i2 += 1
+                op2 = ops2[i2] if i2 < len(ops2) else None
+                continue
+            if op1 is None or op2 is None:
+                raise OTError("compose: operations have mismatched lengths")
+
+            if _is_retain(op1) and _is_retain(op2):
+                n = min(op1, op2)
+                result.retain(n)
+                op1, i1 = _advance(ops1, i1, op1, n)
+                op2, i2 = _advance(ops2, i2, op2, n)
+            elif isinstance(op1, str) and _is_delete(op2):
+                n = min(len(op1), -op2)
+                op1, i1 = _advance(ops1, i1, op1, n)
+                op2, i2 = _advance(ops2, i2, op2, n)
+            elif isinstance(op1, str) and _is_retain(op2):
+                n = min(len(op1), op2)
+                result.insert(op1[:n])
+                op1, i1 = _advance(ops1, i1, op1, n)
+                op2, i2 = _advance(ops2, i2, op2, n)
+            elif _is_retain(op1) and _is_delete(op2):
+                n = min(op1, -op2)
+                result.delete(n)
+                op1, i1 = _advance(ops1, i1, op1, n)
+                op2, i2 = _advance(ops2, i2, op2, n)
+            else:
+                raise OTError("compose: unreachable component combination")
+        return result
+
+def transform(a: TextOperation, b: TextOperation) -> Tuple[TextOperation, TextOperation]:
+    """Transform two concurrent operations against each other.
+
+    Returns ``(a', b')`` such that ``apply(apply(doc, a), b') ==
+    apply(apply(doc, b), a')``. When both insert at the same position ``a``'s
+    text goes first, so callers pass the operation that won the race (the
+    one already in the server history) as ``a``.
+    """
+    if a.base_length != b.base_length:
+        raise OTError("transform: both operations must share the same base document")
+    a_prime = TextOperation()
+    b_prime = TextOperation()
+    ops1, ops2 = a.ops, b.ops
+    i1 = i2 = 0
+    op1 = ops1[0] if ops1 else None
+    op2 = ops2[0] if ops2 else None
+    while op1 is not None or op2 is not None:
+        if op1 is not None and isinstance(op1, str):
+            a_prime.insert(op1)
+            b_prime.retain(len(op1))
+            i1 += 1
+            op1 = ops1[i1] if i1 < len(ops1) else None
+            continue
+        if op2 is not None and isinstance(op2, str):
+            a_prime.retain(len(op2))
+            b_prime.insert(op2)
+            i2 += 1
+            op2 = ops2[i2] if i2 < len(ops2) else None
+            continue
+        if op1 is None or op2 is None:
+            raise OTError("transform: operations have mismatched lengths")
+
+        if _is_retain(op1) and _is_retain(op2):
+            n = min(op1, op2)
+            a_prime.retain(n)
+            b_prime.retain(n)
+        elif _is_delete(op1) and _is_delete(op2):
+            # Both deleted the same span; nothing left to do on either side
+            n = min(-op1, -op2)
+        elif _is_delete(op1) and _is_retain(op2):
+            n = min(-op1, op2)
+            a_prime.delete(n)
+        elif _is_retain(op1) and _is_delete(op2):
+            n = min(op1, -op2)
+            b_prime.delete(n)
+        else:
+            raise OTError("transform: unreachable component combination")
+        op1, i1 = _advance(ops1, i1, op1, n)
+        op2, i2 = _advance(ops2, i2, op2, n)
+    return a_prime, b_prime
+
+def _is_retain(component) -> bool:
+    return isinstance(component, int) and component > 0
+
+def _is_delete(component) -> bool:
+    return isinstance(component, int) and component < 0
+
+def _advance(ops, index, component, n):
+    """Consume n characters of the current component, moving on when spent"""
+    if isinstance(component, str):
+        rest = component[n:]
+    elif component > 0:
+        rest = component - n
+    else:
+        rest = component + n
+    if rest:
+        return rest, index
+    index += 1
+    return (ops[index] if index < len(ops) else None), index
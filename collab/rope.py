@@ -0,0 +1,283 @@
+"""Rope: a text buffer with O(log n) edits.
+
+Text is kept as pieces of at most ``LEAF_CHARS`` characters in a treap (a
+binary tree balanced by random priorities), in document order. Every node
+also knows the length and line breaks of its subtree, so finding a position
+or a line takes O(log n). An insert or delete splits at most two pieces and
+relinks O(log n) nodes, where a ``str`` copies the whole text. Building the
+full string (``str(rope)``) is O(n) and is left for when something needs it,
+such as writing to the database.
+"""
+from typing import List, Optional, Tuple
+import random
+
+from collab.ot import OTError, TextOperation
+
+# Longest piece; inserts are appended to a piece until it reaches this
+LEAF_CHARS = 2048
+
+class _Node:
+    __slots__ = ("text", "breaks", "priority", "left", "right", "size", "lines")
+
+    def __init__(self, text: str, priority: float):
+        self.text = text
+        # Line breaks in this piece, and size/lines of the whole subtree
+        self.breaks = text.count("\n")
+        self.priority = priority
+        self.left: Optional[_Node] = None
+        self.right: Optional[_Node] = None
+        self.size = len(text)
+        self.lines = self.breaks
+
+def _update(node: _Node):
+    size, lines = len(node.text), node.breaks
+    if node.left is not None:
+        size += node.left.size
+        lines += node.left.lines
+    if node.right is not None:
+        size += node.right.size
+        lines += node.right.lines
+    node.size = size
+    node.lines = lines
+
+def _split(node: Optional[_Node], pos: int) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """The first ``pos`` characters and the rest, cutting a piece if needed"""
+    if node is None:
+        return None, None
+    left_size = node.left.size if node.left is not None else 0
+    if pos <= left_size:
+        left, node.left = _split(node.left, pos)
+        _update(node)
+        return left, node
+    pos -= left_size
+    if pos >= len(node.text):
+        node.right, right = _split(node.right, pos - len(node.text))
+        _update(node)
+        return node, right
+    # The cut-off half is a new node; a copied priority would line the
+    # halves of repeatedly cut pieces up into a list
+    right = _merge(_Node(node.text[pos:], random.random()), node.right)
+    node.text = node.text[:pos]
+    node.breaks = node.text.count("\n")
+    node.right = None
+    _update(node)
+    return node, right
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+def _build(pieces: List[str], lo: int, hi: int, depth: int) -> Optional[_Node]:
+    # Balanced, with priorities falling by depth; nodes inserted later get
+    # random priorities below all of these
+    if lo >= hi:
+        return None
+    mid = (lo + hi) // 2
+    node = _Node(pieces[mid], 2.0 - depth / 1024)
+    node.left = _build(pieces, lo, mid, depth + 1)
+    node.right = _build(pieces, mid + 1, hi, depth + 1)
+    _update(node)
+    return node
+
+def _pieces(text: str) -> List[str]:
+    return [text[i:i + LEAF_CHARS] for i in range(0, len(text), LEAF_CHARS)]
+
+class Rope:
+    __slots__ = ("root",)
+
+    def __init__(self, text: str = ""):
+        pieces = _pieces(text)
+        self.root = _build(pieces, 0, len(pieces), 0)
+
+    def __len__(self) -> int:
+        return self.root.size if self.root is not None else 0
+
+    def __str__(self) -> str:
+        return self.slice(0, len(self))
+
+    @property
+    def line_count(self) -> int:
+        return (self.root.lines if self.root is not None else 0) + 1
+
+    # Editing ------------------------------------------------------------
+
+    def insert(self, pos: int, text: str):
+        if not 0 <= pos <= len(self):
+            raise IndexError(f"insert position {pos} outside 0..{len(self)}")
+        if not text or self._edit_piece(pos, 0, text):
+            return
+        left, right = _split(self.root, pos)
+        if left is not None and self._append(left, text):
+            self.root = _merge(left, right)
+            return
+        pieces = _pieces(text)
+        middle = None
+        for piece in pieces:
+            middle = _merge(middle, _Node(piece, random.random()))
+        self.root = _merge(_merge(left, middle), right)
+
+    def _edit_piece(self, pos: int, count: int, text: str) -> bool:
+        """Edit one piece in place if the change falls inside it and it stays
+        within LEAF_CHARS: the common keystroke, and no new nodes"""
+        path = []
+        node = self.root
+        while node is not None:
+            path.append(node)
+            left_size = node.left.size if node.left is not None else 0
+            if pos < left_size:
+                node = node.left
+            elif pos > left_size + len(node.text):
+                pos -= left_size + len(node.text)
+                node = node.right
+            else:
+                pos -= left_size
+                break
+        if node is None:
+            return False
+        old = node.text
+        if pos + count > len(old) or not 0 < len(old) - count + len(text) <= LEAF_CHARS:
+            return False
+        removed = old.count("\n", pos, pos + count) if count else 0
+        breaks = text.count("\n") - removed
+        node.text = old[:pos] + text + old[pos + count:]
+        node.breaks += breaks
+        delta = len(text) - count
+        for parent in path:
+            parent.size += delta
+            parent.lines += breaks
+        return True
+
+    @staticmethod
+    def _append(tree: _Node, text: str) -> bool:
+        """Add text to the last piece of tree if it stays short enough"""
+        path = [tree]
+        while path[-1].right is not None:
+            path.append(path[-1].right)
+        last = path[-1]
+        if len(last.text) + len(text) > LEAF_CHARS:
+            return False
+        breaks = text.count("\n")
+        last.text += text
+        last.breaks += breaks
+        for node in path:
+            node.size += len(text)
+            node.lines += breaks
+        return True
+
+    def delete(self, pos: int, count: int):
+        if pos < 0 or count < 0 or pos + count > len(self):
+            raise IndexError(f"delete of {count} at {pos} outside 0..{len(self)}")
+        if not count or self._edit_piece(pos, count, ""):
+            return
+        left, rest = _split(self.root, pos)
+        _, right = _split(rest, count)
+        self.root = _merge(left, right)
+
+    def apply(self, op: TextOperation):
+        """Apply an operation in place; one split per insert or delete it makes"""
+        if op.base_length != len(self):
+            raise OTError(
+                f"operation base length {op.base_length} does not match document length {len(self)}"
+            )
+        pos = 0
+        for component in op.ops:
+            if isinstance(component, str):
+                self.insert(pos, component)
+                pos += len(component)
+            elif component > 0:
+                pos += component
+            else:
+                self.delete(pos, -component)
+
+    # Reading ------------------------------------------------------------
+
+    def slice(self, start: int, end: int) -> str:
+        """The text in [start, end)"""
+        start, end = max(start, 0), min(end, len(self))
+        parts = []
+        # Iterative in-order walk over the nodes overlapping [start, end)
+        stack = []
+        node, offset = self.root, 0
+        while stack or node is not None:
+            while node is not None:
+                left_size = node.left.size if node.left is not None else 0
+                if offset + left_size > start and node.left is not None:
+                    stack.append((node, offset))
+                    node = node.left
+                else:
+                    stack.append((node, offset))
+                    node = None
+            node, offset = stack.pop()
+            left_size = node.left.size if node.left is not None else 0
+            piece_start = offset + left_size
+            if piece_start >= end:
+                break
+            piece_end = piece_start + len(node.text)
+            if piece_end > start:
+                parts.append(node.text[max(start - piece_start, 0):end - piece_start])
+            node, offset = node.right, piece_end
+        return "".join(parts)
+
+    def line_col(self, pos: int) -> Tuple[int, int]:
+        """Zero-based (line, column) of a position"""
+        if not 0 <= pos <= len(self):
+            raise IndexError(f"position {pos} outside 0..{len(self)}")
+        line, remaining, node = 0, pos, self.root
+        while node is not None:
+            left = node.left
+            left_size = left.size if left is not None else 0
+            if remaining <= left_size:
+                node = left
+                continue
+            if left is not None:
+                line += left.lines
+            remaining -= left_size
+            if remaining <= len(node.text):
+                line += node.text.count("\n", 0, remaining)
+                break
+            line += node.breaks
+            remaining -= len(node.text)
+            node = node.right
+        return line, pos - self.line_start(line)
+
+    def line_start(self, line: int) -> int:
+        """Position of the first character of a zero-based line"""
+        if line == 0:
+            return 0
+        if not 0 < line < self.line_count:
+            raise IndexError(f"line {line} outside 0..{self.line_count - 1}")
+        # Find the line-th break; the line starts right after it
+        remaining, offset, node = line, 0, self.root
+        while True:
+            left = node.left
+            left_lines = left.lines if left is not None else 0
+            if remaining <= left_lines:
+                node = left
+                continue
+            remaining -= left_lines
+            offset += left.size if left is not None else 0
+            if remaining <= node.breaks:
+                index = -1
+                for _ in range(remaining):
+                    index = node.text.index("\n", index + 1)
+                return offset + index + 1
+            remaining -= node.breaks
+            offset += len(node.text)
+            node = node.right
+
+    def position(self, line: int, column: int) -> int:
+        """Position of a zero-based (line, column)"""
+        pos = self.line_start(line) + column
+        end = self.line_start(line + 1) - 1 if line + 1 < self.line_count else len(self)
+        if not 0 <= column <= end - self.line_start(line):
+            raise IndexError(f"column {column} outside line {line}")
+        return pos
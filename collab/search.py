@@ -0,0 +1,419 @@
+"""Full-text search over document content.
+
+An inverted index kept in three collections:
+
+    search_postings   {term, doc_id, tf}             one row per term of a document
+    search_documents  {doc_id, rev, length, terms}   what each document was indexed as
+    search_terms      {term, df}                     how many documents contain each term
+
+The store hands every document it flushes to ``queue``. A background task
+indexes what is queued in batches, every ``interval_ms`` or once
+``batch_size`` documents are waiting, so saves and edits never wait on it
+and a document edited many times in between is indexed once. Reindexing a
+document diffs its terms against the stored ones and writes only the
+postings that changed.
+
+``search`` ranks the documents containing every query term with BM25
+(without length normalisation). Document frequencies come from
+search_terms, kept up to date as documents are indexed, and at most
+``max_postings_per_term`` postings are read per term, highest tf first, so
+a query costs the same however large the corpus grows; matches beyond
+that are not counted. The last query term, and any ending in
+``*``, also matches as a prefix, expanded to the first ``prefix_expansions``
+terms starting with it in alphabetical order, the typed term itself first.
+
+Documents are normally indexed by the worker editing them. Two workers
+indexing the same document at once can leave postings of the older
+revision behind until it changes again, and a batch that fails halfway
+can leave a document frequency off by one.
+"""
+from collections import Counter
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import heapq
+import logging
+import math
+import re
+
+from pymongo import DeleteMany, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+TOKEN = re.compile(r"\w+")
+QUERY_TERM = re.compile(r"(\w+)(\*)?")
+MAX_TERM_CHARS = 40
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for if in into is it no not of on or such "
+    "that the their then there these they this to was will with".split()
+)
+# BM25 term frequency saturation
+K1 = 1.2
+# Score of a term matched through a prefix, relative to the typed term itself
+PREFIX_WEIGHT = 0.5
+
+def tokenize(text: str, max_terms: int = 0) -> Dict[str, int]:
+    """Term frequencies of text, keeping the ``max_terms`` most frequent terms"""
+    counts = Counter(
+        term for term in TOKEN.findall(text.lower())
+        if len(term) <= MAX_TERM_CHARS and term not in STOP_WORDS
+    )
+    if max_terms and len(counts) > max_terms:
+        return dict(counts.most_common(max_terms))
+    return dict(counts)
+
+def parse_query(query: str) -> List[Tuple[str, bool]]:
+    """``(term, prefix)`` pairs; the last term is a prefix (search as you type)"""
+    terms = []
+    matches = list(QUERY_TERM.finditer(query.lower()))
+    for i, match in enumerate(matches):
+        term = match.group(1)[:MAX_TERM_CHARS]
+        prefix = bool(match.group(2)) or i == len(matches) - 1
+        if term in STOP_WORDS and not prefix:
+            continue
+        if (term, prefix) not in terms:
+            terms.append((term, prefix))
+    return terms
+
+def _raise_unless_duplicates(error: BulkWriteError):
+    if any(e.get("code") != DUPLICATE_KEY for e in error.details.get("writeErrors", [])):
+        raise error
+    if error.details.get("writeConcernErrors"):
+        raise error
+
+class SearchIndex:
+    def __init__(self, batch_size: int = 100, interval_ms: int = 1000, max_terms: int = 10000,
+                 prefix_expansions: int = 20, max_postings_per_term: int = 1000):
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000.0
+        # Distinct terms kept per document; the rarest are dropped beyond this
+        self.max_terms = max_terms
+        self.prefix_expansions = prefix_expansions
+        self.max_postings_per_term = max_postings_per_term
+        self.documents = None
+        self.postings = None
+        self.terms = None
+        self._pending: Dict[str, Tuple[int, str]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Store to backfill from at the next wakeup, if any
+        self._backfill = None
+        self.stats = {
+            "queued": 0,
+            "indexed": 0,
+            "skipped_stale": 0,
+            "batches": 0,
+            "postings_written": 0,
+            "postings_deleted": 0,
+            "terms_rebuilt": 0,
+            "backfilled": 0,
+            "index_errors": 0,
+            "queries": 0,
+        }
+
+    # Lifecycle ----------------------------------------------------------
+
+    def start(self, documents, postings, terms, backfill=None):
+        """Bind to the index collections and start indexing in the background.
+
+        With ``backfill`` (a started DocumentStore), documents saved before
+        the index existed, or while no worker was indexing, are indexed first.
+        """
+        self.documents = documents
+        self.postings = postings
+        self.terms = terms
+        self._wakeup = asyncio.Event()
+        self._backfill = backfill
+        self._task = asyncio.create_task(self._index_loop())
+
+    async def stop(self):
+        """Stop the background task and index everything still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.postings is not None:
+            try:
+                while self._pending:
+                    await self.index_pending()
+            except Exception as e:
+                logger.error(f"Search index stopped with {len(self._pending)} documents unindexed: {str(e)}")
+
+    # Indexing -----------------------------------------------------------
+
+    def queue(self, doc_id: str, revision: int, content: str):
+        """Index this revision in the next batch, replacing any older one queued"""
+        self._pending[doc_id] = (revision, content)
+        self.stats["queued"] += 1
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def request_backfill(self, store):
+        """Backfill from ``store`` in the background, e.g. after a bulk import
+        wrote documents without going through it"""
+        self._backfill = store
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _index_loop(self):
+        while True:
+            if self._backfill is not None:
+                store, self._backfill = self._backfill, None
+                try:
+                    await self.backfill(store)
+                except Exception as e:
+                    logger.error(f"Search backfill failed: {str(e)}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while self._pending:
+                    await self.index_pending()
+            except Exception as e:
+                logger.error(f"Search indexing failed: {str(e)}", exc_info=True)
+
+    async def index_pending(self) -> int:
+        """Index up to ``batch_size`` queued documents; returns how many"""
+        doc_ids = list(islice(self._pending, self.batch_size))
+        batch = [(doc_id, *self._pending.pop(doc_id)) for doc_id in doc_ids]
+        try:
+            await self.index(batch)
+        except Exception:
+            self.stats["index_errors"] += 1
+            for doc_id, revision, content in batch:
+                # Retried next time, unless a newer revision was queued meanwhile
+                self._pending.setdefault(doc_id, (revision, content))
+            raise
+        return len(batch)
+
+    async def index(self, batch: List[Tuple[str, int, str]]):
+        """Index ``(doc_id, revision, content)`` items, skipping revisions already indexed"""
+        if not batch:
+            return
+        indexed = {}
+        async for row in self.documents.find(
+            {"doc_id": {"$in": [doc_id for doc_id, _, _ in batch]}}, {"doc_id": 1, "rev": 1, "terms": 1}
+        ):
+            indexed[row["doc_id"]] = row
+        queued = len(batch)
+        batch = [item for item in batch if indexed.get(item[0], {}).get("rev", -1) < item[1]]
+        self.stats["skipped_stale"] += queued - len(batch)
+        if not batch:
+            return
+        # Tokenizing long documents is slow; a thread keeps the event loop responsive
+        terms = await asyncio.to_thread(
+            lambda: [tokenize(content, self.max_terms) for _, _, content in batch]
+        )
+        postings = []
+        rows = []
+        # Change in document frequency per term
+        counts: Dict[str, int] = {}
+        written = deleted = 0
+        for (doc_id, revision, _), new in zip(batch, terms):
+            old = indexed.get(doc_id, {}).get("terms", {})
+            for term, count in new.items():
+                if term not in old:
+                    # Inserted: no lookup, unlike an upsert
+                    postings.append({"term": term, "doc_id": doc_id, "tf": count})
+                    counts[term] = counts.get(term, 0) + 1
+                elif old[term] != count:
+                    postings.append(UpdateOne({"term": term, "doc_id": doc_id}, {"$set": {"tf": count}}))
+                else:
+                    continue
+                written += 1
+            removed = [term for term in old if term not in new]
+            if removed:
+                postings.append(DeleteMany({"doc_id": doc_id, "term": {"$in": removed}}))
+                deleted += len(removed)
+                for term in removed:
+                    counts[term] = counts.get(term, 0) - 1
+            rows.append(UpdateOne(
+                {"doc_id": doc_id, "rev": {"$lt": revision}},
+                {"$set": {"rev": revision, "length": sum(new.values()), "terms": new}},
+                upsert=True
+            ))
+        if postings:
+            await self._write_postings(postings)
+        # Postings before the rows recording them, so a failed batch is retried in full
+        try:
+            await self.documents.bulk_write(rows, ordered=False)
+        except BulkWriteError as e:
+            # A newer revision was indexed meanwhile; its row stays
+            _raise_unless_duplicates(e)
+        # Last, so a retried batch doesn't count its terms twice
+        await self._count_terms(counts)
+        self.stats["batches"] += 1
+        self.stats["indexed"] += len(batch)
+        self.stats["postings_written"] += written
+        self.stats["postings_deleted"] += deleted
+
+    async def _write_postings(self, postings: list):
+        """Write requests, and rows (dicts) to insert"""
+        try:
+            await self.postings.bulk_write([
+                InsertOne(posting) if isinstance(posting, dict) else posting for posting in postings
+            ], ordered=False)
+        except BulkWriteError as e:
+            _raise_unless_duplicates(e)
+            # Rows a failed batch inserted before it could record them
+            await self.postings.bulk_write([
+                UpdateOne({"term": row["term"], "doc_id": row["doc_id"]}, {"$set": {"tf": row["tf"]}})
+                for row in (postings[error["index"]] for error in e.details["writeErrors"])
+            ], ordered=False)
+
+    async def _count_terms(self, counts: Dict[str, int]):
+        changes = [(term, change) for term, change in counts.items() if change]
+        if not changes:
+            return
+        try:
+            await self.terms.bulk_write([
+                UpdateOne({"term": term}, {"$inc": {"df": change}}, upsert=True) for term, change in changes
+            ], ordered=False)
+        except BulkWriteError as e:
+            # Two workers inserted the same new term; the row exists now
+            _raise_unless_duplicates(e)
+            await self.terms.bulk_write([
+                UpdateOne({"term": term}, {"$inc": {"df": change}})
+                for term, change in (changes[error["index"]] for error in e.details["writeErrors"])
+            ], ordered=False)
+        gone = [term for term, change in counts.items() if change < 0]
+        if gone:
+            await self.terms.delete_many({"term": {"$in": gone}, "df": {"$lte": 0}})
+
+    async def rebuild_terms(self) -> int:
+        """Recount search_terms from the postings if it is empty, e.g. for an
+        index built before it existed; returns how many terms were written"""
+        if await self.terms.estimated_document_count() or not await self.postings.estimated_document_count():
+            return 0
+        rows = []
+        written = 0
+        async for row in self.postings.aggregate([{"$group": {"_id": "$term", "df": {"$sum": 1}}}],
+                                                 allowDiskUse=True):
+            rows.append(UpdateOne({"term": row["_id"]}, {"$set": {"df": row["df"]}}, upsert=True))
+            if len(rows) == 1000:
+                await self.terms.bulk_write(rows, ordered=False)
+                written += len(rows)
+                rows = []
+        if rows:
+            await self.terms.bulk_write(rows, ordered=False)
+            written += len(rows)
+        self.stats["terms_rebuilt"] += written
+        return written
+
+    async def backfill(self, store) -> int:
+        """Index every stored document whose indexed revision is behind; returns how many"""
+        await self.rebuild_terms()
+        last = None
+        total = 0
+        while True:
+            query = {"doc_id": {"$gt": last}} if last is not None else {}
+            page = await store.collection.find(query, {"doc_id": 1, "revision": 1}).sort(
+                "doc_id", 1
+            ).limit(self.batch_size).to_list(None)
+            if not page:
+                return total
+            last = page[-1]["doc_id"]
+            indexed = {}
+            async for row in self.documents.find(
+                {"doc_id": {"$in": [document["doc_id"] for document in page]}}, {"doc_id": 1, "rev": 1}
+            ):
+                indexed[row["doc_id"]] = row["rev"]
+            stale = [document["doc_id"] for document in page
+                     if indexed.get(document["doc_id"], -1) < document.get("revision", 0)]
+            if stale:
+                found = await store.read_many(stale)
+                await self.index([(doc_id, revision, content) for doc_id, (content, revision) in found.items()])
+                total += len(found)
+                self.stats["backfilled"] += len(found)
+
+    # Querying -----------------------------------------------------------
+
+    async def _expand(self, prefix: str) -> List[str]:
+        """The first ``prefix_expansions`` indexed terms starting with prefix.
+
+        Walks the term index a page at a time, each page starting past the
+        last term seen, so a one-letter prefix reads at most
+        ``prefix_expansions`` pages however many terms and postings match.
+        """
+        terms: List[str] = []
+        page = self.prefix_expansions
+        while len(terms) < self.prefix_expansions:
+            condition = {"$regex": "^" + re.escape(prefix)}
+            if terms:
+                condition["$gt"] = terms[-1]
+            rows = await self.postings.find({"term": condition}, {"_id": 0, "term": 1}).sort(
+                "term", 1
+            ).limit(page).to_list(None)
+            for row in rows:
+                if not terms or row["term"] != terms[-1]:
+                    terms.append(row["term"])
+            if len(rows) < page:
+                break
+        return terms[:self.prefix_expansions]
+
+    async def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[int, List[Tuple[str, float]]]:
+        """``(matches, [(doc_id, score), ...])`` for one page, best first"""
+        if self.terms is None:
+            raise RuntimeError("Search index has not been started")
+        self.stats["queries"] += 1
+        groups = []
+        for term, prefix in parse_query(query):
+            terms = await self._expand(term) if prefix else [term]
+            if not terms:
+                return 0, []
+            groups.append((term, terms))
+        if not groups:
+            return 0, []
+        frequencies = {}
+        async for row in self.terms.find(
+            {"term": {"$in": sorted({term for _, terms in groups for term in terms})}}, {"_id": 0, "term": 1, "df": 1}
+        ):
+            frequencies[row["term"]] = row["df"]
+        total = max(await self.documents.estimated_document_count(), 1)
+        scores: Optional[Dict[str, float]] = None
+        # Rarest first: later terms only look at documents that are still candidates
+        for typed, terms in sorted(groups, key=lambda group: sum(frequencies.get(t, 0) for t in group[1])):
+            weights = {}
+            for term in terms:
+                df = frequencies.get(term, 0)
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                weights[term] = idf if term == typed else idf * PREFIX_WEIGHT
+            projection = {"_id": 0, "term": 1, "doc_id": 1, "tf": 1}
+            if scores is None:
+                # Each term's best postings, through the (term, tf) index
+                pages = await asyncio.gather(*(
+                    self.postings.find({"term": term}, projection).sort("tf", -1).limit(
+                        self.max_postings_per_term
+                    ).to_list(None) for term in terms
+                ))
+                rows = [row for page in pages for row in page]
+            else:
+                # Only the candidates left, so bounded by the first group's read
+                rows = await self.postings.find(
+                    {"term": {"$in": terms}, "doc_id": {"$in": list(scores)}}, projection
+                ).to_list(None)
+            matched: Dict[str, float] = {}
+            for row in rows:
+                tf = row["tf"]
+                score = weights[row["term"]] * tf * (K1 + 1) / (tf + K1)
+                matched[row["doc_id"]] = matched.get(row["doc_id"], 0.0) + score
+            if scores is None:
+                scores = matched
+            else:
+                scores = {doc_id: scores[doc_id] + score for doc_id, score in matched.items() if doc_id in scores}
+            if not scores:
+                return 0, []
+        # Ties broken by doc_id so pages don't overlap
+        ranked = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        return len(scores), [(doc_id, round(score, 4)) for doc_id, score in ranked[offset:]]
+
+    def metrics(self) -> dict:
+        return dict(self.stats, pending=len(self._pending))
@@ -0,0 +1,514 @@
+"""Authoritative in-memory document store with write-behind to MongoDB.
+
+Documents with live sessions are pinned in memory. Recently read documents
+stay cached until evicted (LRU, bounded by count and total content size).
+Changes are not written through: a background flusher coalesces every
+dirty document into one ``bulk_write`` at most every ``flush_interval_ms``,
+or sooner once a document has collected ``flush_max_ops`` changes.
+
+With a HistoryStore attached, each flush also appends the changes to the
+op log and writes any snapshots that are due, before the documents
+themselves.
+
+With a chunk collection and ``chunk_size``, documents larger than one
+chunk are stored in blocks (see ``collab.chunks``) and a flush rewrites
+only the blocks that changed.
+
+With a SearchIndex attached, every flushed document is queued for
+(re)indexing; the index catches up in its own batches.
+
+Rows also carry listing metadata, written by each flush: ``title`` (the
+first line), ``size`` and ``updated_at``, plus ``owner`` and the other
+``collaborators`` who edited. ``list_documents`` pages through a user's
+documents by those without reading any content.
+
+With a Journal attached, every change is also appended to the local
+write-ahead journal as it is accepted, so a crash between flushes loses
+nothing: ``start`` replays what dead workers left behind, and journal
+segments are dropped once a flush has covered them.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import datetime
+import logging
+import sys
+
+from pymongo import DeleteMany, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from collab.chunks import Chunk, ChunkLayout, in_order
+from collab.document import DEFAULT_HISTORY_LIMIT, DEFAULT_ROPE_MIN_CHARS, DocumentState, document_title
+from collab.history import HistoryStore
+from collab.journal import Journal
+from collab.ot import TextOperation
+from collab.search import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+# What a listing returns per document; never the content
+LISTING_PROJECTION = {"doc_id": 1, "title": 1, "size": 1, "updated_at": 1, "owner": 1, "revision": 1}
+
+class DocumentStore:
+    def __init__(self, max_documents: int = 1000, max_bytes: int = 256 * 1024 * 1024,
+                 flush_interval_ms: int = 500, flush_max_ops: int = 100,
+                 history_limit: int = DEFAULT_HISTORY_LIMIT, history: Optional[HistoryStore] = None,
+                 journal: Optional[Journal] = None, chunk_size: int = 0,
+                 search: Optional[SearchIndex] = None, rope_min_chars: int = DEFAULT_ROPE_MIN_CHARS):
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.flush_max_ops = flush_max_ops
+        self.history_limit = history_limit
+        # Documents at least this long are edited in a Rope (see DocumentState)
+        self.rope_min_chars = rope_min_chars
+        # Version history (op log + snapshots); None keeps only the latest content
+        self.history = history
+        # Local write-ahead journal; None means unflushed changes die with the process
+        self.journal = journal
+        # Documents longer than this many characters are stored in chunks; 0 never chunks
+        self.chunk_size = chunk_size
+        # Full-text index fed with flushed documents; None disables search
+        self.search = search
+        self.collection = None
+        self.chunk_collection = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._states: "OrderedDict[str, DocumentState]" = OrderedDict()
+        self._refs: Dict[str, int] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "changes": 0,
+            "flushes": 0,
+            "documents_written": 0,
+            "largest_batch": 0,
+            "flush_errors": 0,
+            "chunks_written": 0,
+            "chunks_reused": 0,
+            "batch_reads": 0,
+            "batch_documents": 0,
+        }
+
+    # Lifecycle ----------------------------------------------------------
+
+    async def start(self, collection, chunks=None):
+        """Bind to the documents (and chunk) collections, recover the journal and start the flusher"""
+        self.collection = collection
+        self.chunk_collection = chunks
+        self._flush_lock = asyncio.Lock()
+        if self.journal is not None:
+            await self.recover(self.journal.recover())
+            self.journal.release_recovered()
+            await self.journal.start()
+        self._wakeup = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the flusher and write out everything still dirty"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self.collection is not None:
+            await self.flush()
+        if self.journal is not None:
+            await self.journal.stop()
+
+    # Access -------------------------------------------------------------
+
+    def get(self, doc_id: str) -> Optional[DocumentState]:
+        """Cached state without touching the database"""
+        return self._states.get(doc_id)
+
+    async def read(self, doc_id: str) -> Optional[DocumentState]:
+        """Cached state, loading it on a miss; None if the document doesn't exist"""
+        return await self._load(doc_id, create=False)
+
+    async def revision(self, doc_id: str) -> Optional[int]:
+        """Current revision without loading the content; None if the document doesn't exist"""
+        state = self._states.get(doc_id)
+        if state is not None:
+            return state.revision
+        if self.collection is None:
+            raise RuntimeError("Document store has not been started")
+        document = await self.collection.find_one({"doc_id": doc_id}, {"revision": 1})
+        return document.get("revision", 0) if document is not None else None
+
+    async def read_many(self, doc_ids: List[str],
+                        content: bool = True) -> Dict[str, Tuple[Optional[str], int]]:
+        """``(content, revision)`` of every existing document among ``doc_ids``.
+
+        Cached documents are answered from memory and the rest with one
+        ``$in`` query. Those are not added to the cache, so a listing page
+        doesn't evict the documents people are editing.
+        """
+        found = {}
+        uncached = []
+        for doc_id in doc_ids:
+            state = self._states.get(doc_id)
+            if state is not None:
+                found[doc_id] = (state.content if content else None, state.revision)
+            else:
+                uncached.append(doc_id)
+        self.stats["batch_reads"] += 1
+        self.stats["batch_documents"] += len(doc_ids)
+        if uncached:
+            if self.collection is None:
+                raise RuntimeError("Document store has not been started")
+            projection = {"doc_id": 1, "revision": 1}
+            if content:
+                projection.update(content=1, chunks=1)
+            async for document in self.collection.find({"doc_id": {"$in": uncached}}, projection):
+                text = None
+                if content:
+                    text = ("".join(await self._read_chunks(document["doc_id"], document["chunks"]))
+                            if "chunks" in document else document.get("content", ""))
+                found[document["doc_id"]] = (text, document.get("revision", 0))
+        return found
+
+    async def create(self, doc_id: str, owner: Optional[str] = None) -> Tuple[DocumentState, bool]:
+        """Create an empty document unless it exists; returns it and whether it is new.
+
+        Keyed by the unique doc_id, so retried or concurrent creates leave
+        exactly one document and never touch an existing one, except to give
+        an ownerless one its first owner. A document only opened over a
+        websocket is cached but may have no row yet, so this always asks
+        MongoDB.
+        """
+        if self.collection is None:
+            raise RuntimeError("Document store has not been started")
+        now = datetime.datetime.utcnow()
+        fields = {"content": "", "revision": 0, "title": "", "size": 0, "created_at": now, "updated_at": now}
+        if owner is not None:
+            fields["owner"] = owner
+        try:
+            result = await self.collection.update_one({"doc_id": doc_id}, {"$setOnInsert": fields}, upsert=True)
+            created = result.upserted_id is not None
+        except DuplicateKeyError:
+            # Two upserts raced on the unique index and the other one inserted
+            created = False
+        claimed = created
+        if not created and owner is not None:
+            result = await self.collection.update_one(
+                {"doc_id": doc_id, "owner": {"$exists": False}}, {"$set": {"owner": owner}}
+            )
+            claimed = result.modified_count > 0
+        cached = doc_id in self._states
+        state = await self._load(doc_id, create=True)
+        if cached and state.owner is None:
+            if claimed:
+                state.owner = owner
+            elif not created:
+                # Owned before this state was cached; keep flushes from overwriting it
+                row = await self.collection.find_one({"doc_id": doc_id}, {"owner": 1})
+                state.owner = row.get("owner") if row else None
+        return state, created
+
+    async def open(self, doc_id: str) -> DocumentState:
+        """Pin a document for a live session, creating it in memory if needed"""
+        return await self._load(doc_id, create=True, pin=True)
+
+    def close(self, doc_id: str):
+        """Unpin after a session leaves; the state stays cached until evicted"""
+        refs = self._refs.get(doc_id, 0) - 1
+        if refs > 0:
+            self._refs[doc_id] = refs
+        else:
+            self._refs.pop(doc_id, None)
+
+    async def write(self, doc_id: str, content: str, user: Optional[str] = None) -> DocumentState:
+        """Replace the whole content; persisted by the next flush"""
+        state = await self._load(doc_id, create=True)
+        state.replace_content(content)
+        state.edited_by(user)
+        self.changed(state)
+        return state
+
+    def changed(self, state: DocumentState) -> Optional[asyncio.Future]:
+        """Record an accepted change and wake the flusher if it piled up.
+
+        Returns a future that resolves once the change is in the journal, or
+        None without one. Callers hold back acks until it resolves.
+        """
+        self.stats["changes"] += 1
+        if state.pending_changes >= self.flush_max_ops and self._wakeup is not None:
+            self._wakeup.set()
+        if self.journal is not None and state.log:
+            revision, ops, content, _ = state.log[-1]
+            return self.journal.append(state.doc_id, revision, ops, content)
+        return None
+
+    def barrier(self) -> Optional[asyncio.Future]:
+        """Future resolving once every change so far is journaled, if any is pending"""
+        return self.journal.barrier() if self.journal is not None else None
+
+    async def recover(self, records: List[dict]) -> int:
+        """Replay journal records newer than MongoDB and flush them; returns how many applied"""
+        by_document: Dict[str, List[dict]] = {}
+        for record in records:
+            by_document.setdefault(record["d"], []).append(record)
+        applied = 0
+        for doc_id, entries in by_document.items():
+            state = await self._load(doc_id, create=True)
+            for record in sorted(entries, key=lambda r: r["r"]):
+                if record["r"] <= state.revision:
+                    continue
+                if record["r"] != state.revision + 1:
+                    logger.error(
+                        f"Journal for {doc_id} skips from revision {state.revision} to {record['r']}"
+                    )
+                    break
+                if "o" in record:
+                    state.apply_client_op(state.revision, TextOperation.from_json(record["o"]))
+                else:
+                    state.replace_content(record["c"])
+                applied += 1
+        if applied:
+            await self.flush()
+            logger.info(f"Replayed {applied} journaled changes into {len(by_document)} documents")
+        return applied
+
+    async def _load(self, doc_id: str, create: bool, pin: bool = False) -> Optional[DocumentState]:
+        state = self._states.get(doc_id)
+        if state is not None:
+            self.stats["hits"] += 1
+        else:
+            lock = self._locks.setdefault(doc_id, asyncio.Lock())
+            try:
+                async with lock:
+                    state = self._states.get(doc_id)
+                    if state is None:
+                        state = await self._fetch(doc_id, create)
+                        if state is None:
+                            return None
+                        self._states[doc_id] = state
+            finally:
+                if not lock.locked():
+                    self._locks.pop(doc_id, None)
+        self._states.move_to_end(doc_id)
+        if pin:
+            self._refs[doc_id] = self._refs.get(doc_id, 0) + 1
+        if len(self._states) > self.max_documents:
+            self._evict(keep=doc_id)
+        return state
+
+    async def _fetch(self, doc_id: str, create: bool) -> Optional[DocumentState]:
+        self.stats["misses"] += 1
+        if self.collection is None:
+            raise RuntimeError("Document store has not been started")
+        document = await self.collection.find_one(
+            {"doc_id": doc_id}, {"content": 1, "revision": 1, "snapshot_rev": 1, "chunks": 1, "owner": 1}
+        )
+        if document is None:
+            if not create:
+                return None
+            document = {}
+        layout = None
+        if "chunks" in document:
+            pieces = await self._read_chunks(doc_id, document["chunks"])
+            content = "".join(pieces)
+            layout = ChunkLayout.stored(document["chunks"], pieces)
+        else:
+            content = document.get("content", "")
+        state = DocumentState(doc_id, content, document.get("revision", 0), self.history_limit, self.rope_min_chars)
+        state.chunks = layout
+        state.owner = document.get("owner")
+        if self.history is not None or self.journal is not None:
+            state.log = []
+            if "snapshot_rev" in document:
+                state.snapshot_revision = document["snapshot_rev"]
+            elif state.length:
+                # Content from before history was kept; the next flush snapshots it
+                state.snapshot_revision = None
+        return state
+
+    async def _read_chunks(self, doc_id: str, numbers: List[int]) -> List[str]:
+        if self.chunk_collection is None:
+            raise RuntimeError(f"Document {doc_id} is chunked but no chunk collection is bound")
+        rows = {}
+        async for row in self.chunk_collection.find({"doc_id": doc_id, "n": {"$in": numbers}}, {"n": 1, "data": 1}):
+            rows[row["n"]] = row["data"]
+        return in_order(doc_id, numbers, rows)
+
+    def _evict(self, keep: Optional[str] = None):
+        """Drop least recently used documents that are clean and unpinned"""
+        total = None
+        for doc_id in list(self._states):
+            if len(self._states) <= self.max_documents:
+                if total is None:
+                    total = sum(s.length for s in self._states.values())
+                if total <= self.max_bytes:
+                    break
+            state = self._states[doc_id]
+            if doc_id in self._refs or doc_id == keep or state.dirty:
+                continue
+            del self._states[doc_id]
+            self.stats["evictions"] += 1
+            if total is not None:
+                total -= state.length
+
+    # Write-behind -------------------------------------------------------
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Document flush failed: {str(e)}", exc_info=True)
+            self._evict()
+
+    async def flush(self) -> int:
+        """Write every dirty document in one bulk_write; returns the batch size"""
+        if self._flush_lock is None:
+            return await self._flush()
+        # One at a time: chunk rows a flush replaces are deleted at its end
+        async with self._flush_lock:
+            return await self._flush()
+
+    async def _flush(self) -> int:
+        batch = []
+        requests = []
+        chunk_requests = []
+        chunked = []
+        log_entries = []
+        snapshots = []
+        now = datetime.datetime.utcnow()
+        history = self.history
+        for state in self._states.values():
+            if not state.dirty:
+                continue
+            # Capture the values now; edits during the write make it dirty again
+            fields = {
+                "content": state.content, "revision": state.revision, "updated_at": now,
+                "title": document_title(state.content), "size": state.length
+            }
+            update = {"$set": fields}
+            if state.owner is not None:
+                fields["owner"] = state.owner
+            editors = list(state.editors) if state.editors else None
+            if editors:
+                update["$addToSet"] = {"collaborators": {"$each": editors}}
+            if self._chunked(state):
+                if state.chunks is None:
+                    state.chunks = ChunkLayout([Chunk(state.length)])
+                numbers, writes = state.chunks.plan(state.content, self.chunk_size)
+                chunk_requests.extend(
+                    UpdateOne({"doc_id": state.doc_id, "n": number}, {"$set": {"data": text}}, upsert=True)
+                    for _, _, number, text in writes
+                )
+                chunked.append((state, numbers, writes))
+                del fields["content"]
+                fields["chunks"] = numbers
+                update["$unset"] = {"content": ""}
+            logged = len(state.log) if state.log else 0
+            if logged:
+                log_entries.append((state.doc_id, state.log[:logged]))
+            snapshot = history is not None and history.snapshot_due(state)
+            if snapshot:
+                snapshots.append((state.doc_id, state.revision, state.content))
+                fields["snapshot_rev"] = state.revision
+            batch.append((state, state.revision, state.content, logged, state.log_bytes if snapshot else None, editors))
+            requests.append(UpdateOne({"doc_id": state.doc_id}, update, upsert=True))
+        if not requests:
+            return 0
+        try:
+            if history is not None:
+                # Log first: a document never points at a snapshot that isn't stored
+                await history.record(log_entries, snapshots)
+            if chunk_requests:
+                # Chunks before the rows that list them
+                await self.chunk_collection.bulk_write(chunk_requests, ordered=False)
+            await self.collection.bulk_write(requests, ordered=False)
+            # Drop replaced chunks, and any a crashed flush left behind
+            if chunked:
+                await self.chunk_collection.bulk_write([
+                    DeleteMany({"doc_id": state.doc_id, "n": {"$nin": numbers}})
+                    for state, numbers, _ in chunked
+                ], ordered=False)
+        except Exception:
+            self.stats["flush_errors"] += 1
+            raise
+        for state, numbers, writes in chunked:
+            state.chunks.commit(writes)
+            self.stats["chunks_written"] += len(writes)
+            self.stats["chunks_reused"] += len(numbers) - len(writes)
+        for state, revision, content, logged, log_bytes, editors in batch:
+            state.persisted_revision = revision
+            if editors:
+                state.editors.difference_update(editors)
+            if self.search is not None:
+                self.search.queue(state.doc_id, revision, content)
+            if logged:
+                del state.log[:logged]
+            if log_bytes is not None:
+                state.snapshot_revision = revision
+                state.log_bytes -= log_bytes
+        self.stats["flushes"] += 1
+        self.stats["documents_written"] += len(requests)
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(requests))
+        if self.journal is not None:
+            self.journal.checkpoint(self._persisted_revision)
+        return len(requests)
+
+    async def list_documents(self, user: str, limit: int, after: Optional[Tuple[datetime.datetime, Any]] = None,
+                             owned_only: bool = False) -> Tuple[List[dict], bool]:
+        """Listing rows of the documents ``user`` owns or collaborates on, most
+        recently updated first; returns up to ``limit`` and whether more follow.
+
+        Keyset pagination: ``after`` is the ``(updated_at, _id)`` of the last
+        row of the previous page, and the owner_updated / collaborators_updated
+        indexes start each page right there, so page 1000 costs what page 1
+        does. Changes still waiting for a flush show up after it.
+        """
+        if self.collection is None:
+            raise RuntimeError("Document store has not been started")
+        branches = [{"owner": user}] if owned_only else [{"owner": user}, {"collaborators": user}]
+        if after is not None:
+            updated_at, last_id = after
+            # The range bounds the index scan; the $or only settles ties
+            keyset = {
+                "updated_at": {"$lte": updated_at},
+                "$or": [{"updated_at": {"$lt": updated_at}}, {"_id": {"$lt": last_id}}],
+            }
+            branches = [dict(branch, **keyset) for branch in branches]
+        query = branches[0] if len(branches) == 1 else {"$or": branches}
+        rows = await self.collection.find(query, LISTING_PROJECTION).sort(
+            [("updated_at", -1), ("_id", -1)]
+        ).limit(limit + 1).to_list(None)
+        return rows[:limit], len(rows) > limit
+
+    def _chunked(self, state: DocumentState) -> bool:
+        if self.chunk_collection is None or not self.chunk_size:
+            return False
+        return state.chunks is not None or state.length > self.chunk_size
+
+    def _persisted_revision(self, doc_id: str) -> int:
+        state = self._states.get(doc_id)
+        # Only clean documents are evicted, so a missing one is fully persisted
+        return state.persisted_revision if state is not None else sys.maxsize
+
+    def metrics(self) -> dict:
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["mean_batch"] = (
+            round(stats["documents_written"] / stats["flushes"], 2) if stats["flushes"] else 0.0
+        )
+        # Every flushed change would have been its own update_one without coalescing
+        pending = sum(state.pending_changes for state in self._states.values())
+        stats["writes_saved"] = max(stats["changes"] - pending - stats["documents_written"], 0)
+        stats["cached_documents"] = len(self._states)
+        stats["pinned_documents"] = len(self._refs)
+        return stats
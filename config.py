@@ -13,3 +13,144 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 JWT_REFRESH_EXPIRE_HOURS = 72  # 3 days
+
+# MongoDB connection pool (one shared client per worker)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_HEALTH_CHECK_INTERVAL_SECONDS = float(os.getenv("MONGO_HEALTH_CHECK_INTERVAL_SECONDS", "30"))
+
+# Operational transform: ops kept per live document for transforming late edits
+OT_HISTORY_LIMIT = int(os.getenv("OT_HISTORY_LIMIT", "1000"))
+
+# In-memory document store with write-behind flushing
+DOC_CACHE_MAX_DOCUMENTS = int(os.getenv("DOC_CACHE_MAX_DOCUMENTS", "1000"))
+DOC_CACHE_MAX_BYTES = int(os.getenv("DOC_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DOC_FLUSH_INTERVAL_MS = int(os.getenv("DOC_FLUSH_INTERVAL_MS", "500"))
+DOC_FLUSH_MAX_OPS = int(os.getenv("DOC_FLUSH_MAX_OPS", "100"))
+# Documents at least this many characters long are edited in a rope
+# (O(log n) per edit) instead of copying the whole string per edit
+DOC_ROPE_MIN_CHARS = int(os.getenv("DOC_ROPE_MIN_CHARS", str(64 * 1024)))
+
+# Websocket broadcast backplane: "memory" (single worker) or "redis"
+BROADCAST_BACKEND = os.getenv("BROADCAST_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+# Per-connection outbound queue; policy for clients that fall behind:
+# "coalesce" (drop queued messages, send latest snapshot) or "disconnect"
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "coalesce")
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+# Quiet clients get a {"type": "ping"} this often; any frame back counts as
+# alive. Clients silent for the idle timeout (half-open sockets) or connected
+# longer than the max lifetime are closed with 1001; 0 disables each
+WS_PING_INTERVAL_SECONDS = float(os.getenv("WS_PING_INTERVAL_SECONDS", "20"))
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "60"))
+WS_MAX_LIFETIME_SECONDS = float(os.getenv("WS_MAX_LIFETIME_SECONDS", str(24 * 3600)))
+
+# Websocket payloads at least this large are compressed when the client
+# negotiated ?compress=deflate|zstd
+WS_COMPRESS_THRESHOLD_BYTES = int(os.getenv("WS_COMPRESS_THRESHOLD_BYTES", "4096"))
+# Largest client message once inflated; a frame decoding to more closes the
+# socket with 1009
+WS_MAX_MESSAGE_BYTES = int(os.getenv("WS_MAX_MESSAGE_BYTES", str(16 * 1024 * 1024)))
+
+# Password hashing runs in a bounded thread pool off the event loop
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "256"))
+PASSWORD_REHASH_ON_LOGIN = os.getenv("PASSWORD_REHASH_ON_LOGIN", "true").lower() == "true"
+
+# Verified access tokens are cached (keyed by token hash) until they expire
+# or for at most this long
+JWT_CACHE_TTL_SECONDS = float(os.getenv("JWT_CACHE_TTL_SECONDS", "300"))
+JWT_CACHE_MAX_ENTRIES = int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000"))
+# Websocket clients must present an access token: preferably as the subprotocol
+# pair "bearer, <token>", or as ?token=, which is masked in logged URLs
+WS_AUTH_REQUIRED = os.getenv("WS_AUTH_REQUIRED", "true").lower() == "true"
+
+# Version history: op log plus a snapshot every N ops or bytes of edits;
+# ops are kept for this many of the most recent snapshot intervals
+HISTORY_SNAPSHOT_EVERY_OPS = int(os.getenv("HISTORY_SNAPSHOT_EVERY_OPS", "200"))
+HISTORY_SNAPSHOT_EVERY_BYTES = int(os.getenv("HISTORY_SNAPSHOT_EVERY_BYTES", str(64 * 1024)))
+HISTORY_KEEP_OP_SNAPSHOTS = int(os.getenv("HISTORY_KEEP_OP_SNAPSHOTS", "10"))
+
+# Local write-ahead journal for edits not yet flushed to MongoDB (one set of
+# segment files per worker); an empty JOURNAL_DIR disables it
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "journal")
+JOURNAL_SEGMENT_BYTES = int(os.getenv("JOURNAL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+JOURNAL_COMMIT_INTERVAL_MS = float(os.getenv("JOURNAL_COMMIT_INTERVAL_MS", "0"))
+JOURNAL_COMMIT_MAX_ENTRIES = int(os.getenv("JOURNAL_COMMIT_MAX_ENTRIES", "256"))
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "true").lower() == "true"
+
+# HTTP responses at least this large are gzip/brotli compressed. gzip runs on
+# the event loop; level 9 costs ~20x level 5 for ~20% smaller bodies
+HTTP_COMPRESS_MIN_BYTES = int(os.getenv("HTTP_COMPRESS_MIN_BYTES", "1024"))
+HTTP_GZIP_LEVEL = int(os.getenv("HTTP_GZIP_LEVEL", "5"))
+
+# Largest page GET /api/documents returns
+DOC_LIST_MAX_LIMIT = int(os.getenv("DOC_LIST_MAX_LIMIT", "100"))
+
+# Most documents one POST /api/documents:batchGet may ask for
+BATCH_GET_MAX_DOCUMENTS = int(os.getenv("BATCH_GET_MAX_DOCUMENTS", "100"))
+
+# Documents longer than this many characters are stored in chunks of about
+# this size, so no row nears MongoDB's 16 MB limit; 0 keeps content inline
+DOC_CHUNK_SIZE = int(os.getenv("DOC_CHUNK_SIZE", str(256 * 1024)))
+# GET /api/documents/{doc_id} streams bodies longer than this (characters)
+DOC_STREAM_MIN_CHARS = int(os.getenv("DOC_STREAM_MIN_CHARS", str(1024 * 1024)))
+# Largest body PUT /api/documents/{doc_id}/content accepts
+DOC_UPLOAD_MAX_BYTES = int(os.getenv("DOC_UPLOAD_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Full-text search: flushed documents are indexed in the background in
+# batches, at least every SEARCH_INDEX_INTERVAL_MS. Each document keeps its
+# SEARCH_MAX_TERMS most frequent terms and a prefix in a query matches at most
+# SEARCH_PREFIX_EXPANSIONS terms, reading at most SEARCH_MAX_POSTINGS_PER_TERM
+# postings (documents) of each. SEARCH_MAX_RESULTS caps a page of
+# GET /api/search. SEARCH_BACKFILL indexes missing documents at startup
+SEARCH_INDEX_BATCH = int(os.getenv("SEARCH_INDEX_BATCH", "100"))
+SEARCH_INDEX_INTERVAL_MS = int(os.getenv("SEARCH_INDEX_INTERVAL_MS", "1000"))
+SEARCH_MAX_TERMS = int(os.getenv("SEARCH_MAX_TERMS", "10000"))
+SEARCH_PREFIX_EXPANSIONS = int(os.getenv("SEARCH_PREFIX_EXPANSIONS", "20"))
+SEARCH_MAX_POSTINGS_PER_TERM = int(os.getenv("SEARCH_MAX_POSTINGS_PER_TERM", "1000"))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "100"))
+SEARCH_BACKFILL = os.getenv("SEARCH_BACKFILL", "true").lower() == "true"
+
+# Bulk export/import (GET /api/admin/export, POST /api/admin/import) is open to
+# these users only (comma separated usernames); empty turns both off.
+# TRANSFER_BATCH_SIZE rows are read or written per round trip
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
+TRANSFER_BATCH_SIZE = int(os.getenv("TRANSFER_BATCH_SIZE", "1000"))
+
+# Cursor/presence updates are coalesced and sent at most this often per document
+PRESENCE_TICK_HZ = float(os.getenv("PRESENCE_TICK_HZ", "20"))
+
+# Rate limits are "<requests>/<seconds>" token buckets; empty or 0 disables one.
+# REST: per user (bearer token) or client address across /api, plus per route
+# ("METHOD /path=<rate>", comma separated; a trailing * matches a prefix).
+# Behind a proxy, client addresses are only real with uvicorn's
+# --proxy-headers --forwarded-allow-ips; otherwise everyone shares one bucket
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_REST = os.getenv("RATE_LIMIT_REST", "600/60")
+RATE_LIMIT_ROUTES = os.getenv("RATE_LIMIT_ROUTES", "POST /api/auth/login=10/60,POST /api/auth/signup=5/60")
+# Websocket messages per connection, per user and per document; a client that
+# would wait longer than the max wait to be read again is disconnected (1008)
+WS_RATE_LIMIT_CONNECTION = os.getenv("WS_RATE_LIMIT_CONNECTION", "100/1")
+WS_RATE_LIMIT_USER = os.getenv("WS_RATE_LIMIT_USER", "200/1")
+WS_RATE_LIMIT_DOCUMENT = os.getenv("WS_RATE_LIMIT_DOCUMENT", "1000/1")
+WS_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("WS_RATE_LIMIT_MAX_WAIT_SECONDS", "2"))
+
+# New websockets are closed with 1013 (try again later) past this many per
+# worker, or while the event loop lags more than this; 0 disables either
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "10000"))
+WS_MAX_LOOP_LAG_MS = float(os.getenv("WS_MAX_LOOP_LAG_MS", "250"))
+LOOP_LAG_CHECK_INTERVAL_MS = float(os.getenv("LOOP_LAG_CHECK_INTERVAL_MS", "100"))
+
+# Logging goes through a queue to a writer thread. LOG_FORMAT is "json" or
+# "text"; LOG_SAMPLE keeps one in N of the named events ("event=N,...");
+# records arriving while LOG_QUEUE_SIZE are waiting are dropped
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "ws.op_rejected=100,ws.frame_dropped=100")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "1000"))
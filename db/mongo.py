@@ -1,36 +1,194 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from fastapi import Depends
+from pymongo import monitoring
+from typing import Optional
+import asyncio
 import logging
+import threading
+import time
+
+from telemetry.metrics import (
+    mongo_command_failures, mongo_command_seconds, mongo_pool_checkout_failures, mongo_pool_connections, registry
+)
+
+try:
+    from realdoc_api.config import (
+        MONGO_URI, MONGO_DB_NAME, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+        MONGO_MAX_IDLE_TIME_MS, MONGO_HEALTH_CHECK_INTERVAL_SECONDS
+    )
+except ImportError:
+    from config import (
+        MONGO_URI, MONGO_DB_NAME, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+        MONGO_MAX_IDLE_TIME_MS, MONGO_HEALTH_CHECK_INTERVAL_SECONDS
+    )
 
 logger = logging.getLogger(__name__)
 
-async def get_mongo_client():
-    """Create and return a new MongoDB client instance"""
-    try:
-        from realdoc_api.config import MONGO_URI, MONGO_DB_NAME
-    except ImportError:
-        from config import MONGO_URI, MONGO_DB_NAME
+# One client per worker process. Motor keeps its own connection pool, so
+# every request borrows a socket from here instead of opening a new one.
+_client: Optional[AsyncIOMotorClient] = None
+_health_task: Optional[asyncio.Task] = None
+
+# Updated by the background probe; read by /api/health
+health = {"ok": None, "last_check": None, "last_error": None}
+
+class CommandTimer(monitoring.CommandListener):
+    """Feeds command latencies into /metrics.
+
+    pymongo calls listeners from the threads motor runs it on, so updates
+    are made under a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._failures = {}
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._observe(event, False)
+
+    def failed(self, event):
+        self._observe(event, True)
+
+    def _observe(self, event, failed: bool):
+        name = event.command_name
+        with self._lock:
+            latency = self._latency.get(name)
+            if latency is None:
+                latency = self._latency[name] = mongo_command_seconds.labels(name)
+            latency.observe(event.duration_micros / 1e6)
+            if failed:
+                failures = self._failures.get(name)
+                if failures is None:
+                    failures = self._failures[name] = mongo_command_failures.labels(name)
+                failures.inc()
+
+class PoolGauge(monitoring.ConnectionPoolListener):
+    """Open and checked-out pooled connections, for /metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open = mongo_pool_connections.labels("open")
+        self._in_use = mongo_pool_connections.labels("in_use")
+
+    def _add(self, gauge, amount: int):
+        with self._lock:
+            gauge.inc(amount)
+
+    def connection_created(self, event):
+        self._add(self._open, 1)
+
+    def connection_closed(self, event):
+        self._add(self._open, -1)
 
-    client = AsyncIOMotorClient(
-        MONGO_URI,
+    def connection_checked_out(self, event):
+        self._add(self._in_use, 1)
+
+    def connection_checked_in(self, event):
+        self._add(self._in_use, -1)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            mongo_pool_checkout_failures.labels().inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+def create_mongo_client(uri: str = MONGO_URI) -> AsyncIOMotorClient:
+    """Build a pooled client with the configured pool limits"""
+    return AsyncIOMotorClient(
+        uri,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
         serverSelectionTimeoutMS=5000,
         connectTimeoutMS=10000,
         socketTimeoutMS=30000,
         retryWrites=True,
-        retryReads=True
+        retryReads=True,
+        event_listeners=[CommandTimer(), PoolGauge()]
     )
+
+registry.collect(
+    "realdoc_mongo_up", "Whether the last MongoDB health probe succeeded",
+    lambda: [((), 1 if health["ok"] else 0)]
+)
+
+async def _ping(client) -> bool:
     try:
         await client.admin.command('ping')
-        return client
+        health.update(ok=True, last_check=time.time(), last_error=None)
+        return True
     except Exception as e:
-        logger.error(f"Failed to connect to MongoDB: {str(e)}")
-        raise RuntimeError("MongoDB connection failed") from e
+        health.update(ok=False, last_check=time.time(), last_error=str(e))
+        logger.error(f"MongoDB health check failed: {str(e)}")
+        return False
+
+async def _health_probe(client, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        await _ping(client)
+
+async def connect_mongo(client: Optional[AsyncIOMotorClient] = None,
+                        health_interval: float = MONGO_HEALTH_CHECK_INTERVAL_SECONDS):
+    """Create the shared client and start the background health probe.
+
+    Called once from the application lifespan. A custom client (e.g. a
+    mongomock stand-in) can be passed in for tests and benchmarks.
+    """
+    global _client, _health_task
+    if _client is not None:
+        return _client
+    _client = client if client is not None else create_mongo_client()
+    await _ping(_client)
+    if health_interval and health_interval > 0:
+        _health_task = asyncio.create_task(_health_probe(_client, health_interval))
+    logger.info("MongoDB client initialised")
+    return _client
+
+async def close_mongo():
+    """Stop the health probe and release the pooled connections"""
+    global _client, _health_task
+    if _health_task is not None:
+        _health_task.cancel()
+        try:
+            await _health_task
+        except asyncio.CancelledError:
+            pass
+        _health_task = None
+    if _client is not None:
+        _client.close()
+        _client = None
+
+def get_client() -> AsyncIOMotorClient:
+    """Return the shared client, creating it lazily outside the app lifespan"""
+    global _client
+    if _client is None:
+        _client = create_mongo_client()
+    return _client
+
+async def get_mongo_client():
+    """Return the shared MongoDB client instance"""
+    return get_client()
 
 async def get_db(client: AsyncIOMotorClient = Depends(get_mongo_client)):
-    """Get the database instance from a client"""
-    try:
-        from realdoc_api.config import MONGO_DB_NAME
-    except ImportError:
-        from config import MONGO_DB_NAME
-        
+    """Get the database instance from the shared client"""
     return client[MONGO_DB_NAME]
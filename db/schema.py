@@ -0,0 +1,68 @@
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import CollectionInvalid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Collections and indexes the API relies on. Created once at startup so the
+# request handlers never have to check for them.
+INDEXES = {
+    "documents": [
+        IndexModel([("doc_id", ASCENDING)], unique=True, name="doc_id_unique"),
+        IndexModel([("updated_at", DESCENDING)], name="updated_at_desc"),
+        # GET /api/documents: a user's documents, newest first, keyset on (updated_at, _id)
+        IndexModel([("owner", ASCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)], name="owner_updated"),
+        IndexModel([("collaborators", ASCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)],
+                   name="collaborators_updated"),
+    ],
+    "document_chunks": [
+        IndexModel([("doc_id", ASCENDING), ("n", ASCENDING)], unique=True, name="doc_chunk_unique"),
+    ],
+    "history_chunks": [
+        IndexModel([("doc_id", ASCENDING), ("kind", ASCENDING), ("rev", ASCENDING), ("n", ASCENDING)],
+                   unique=True, name="doc_kind_rev_chunk_unique"),
+    ],
+    "document_ops": [
+        IndexModel([("doc_id", ASCENDING), ("rev", ASCENDING)], unique=True, name="doc_rev_unique"),
+        IndexModel([("doc_id", ASCENDING), ("ts", ASCENDING)], name="doc_ts"),
+    ],
+    "document_snapshots": [
+        IndexModel([("doc_id", ASCENDING), ("rev", ASCENDING)], unique=True, name="doc_rev_unique"),
+        IndexModel([("doc_id", ASCENDING), ("ts", ASCENDING)], name="doc_ts"),
+    ],
+    "search_postings": [
+        IndexModel([("term", ASCENDING), ("doc_id", ASCENDING)], unique=True, name="term_doc_unique"),
+        IndexModel([("doc_id", ASCENDING)], name="doc_id"),
+        # A term's best postings first, so queries read a bounded number
+        IndexModel([("term", ASCENDING), ("tf", DESCENDING)], name="term_tf"),
+    ],
+    "search_terms": [
+        IndexModel([("term", ASCENDING)], unique=True, name="term_unique"),
+    ],
+    "search_documents": [
+        IndexModel([("doc_id", ASCENDING)], unique=True, name="doc_id_unique"),
+    ],
+    "users": [
+        IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
+    ],
+}
+
+async def ensure_schema(db, indexes=None):
+    """Create missing collections and indexes. Safe to run on every startup."""
+    indexes = INDEXES if indexes is None else indexes
+    existing = set(await db.list_collection_names())
+    for name, models in indexes.items():
+        if name not in existing:
+            try:
+                await db.create_collection(name)
+                logger.info(f"Created collection: {name}")
+            except CollectionInvalid:
+                # Another worker got there first
+                pass
+        if models:
+            try:
+                created = await db[name].create_indexes(models)
+                logger.info(f"Ensured indexes on {name}: {created}")
+            except Exception as e:
+                # e.g. duplicate usernames left over from before the unique index
+                logger.error(f"Failed to create indexes on {name}: {str(e)}")
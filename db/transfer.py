@@ -0,0 +1,325 @@
+"""Bulk export and import of documents and users as NDJSON.
+
+One JSON object per line, tagged with its type:
+
+    {"type": "document", "doc_id": "notes", "content": "...", "rev": 3, "owner": "ann", "collaborators": ["bo"],
+     "created_at": "...", "updated_at": "..."}
+    {"type": "user", "username": "ann", "password": "<bcrypt hash>", "email": "...", "created_at": "..."}
+
+Export reads batched cursors and yields one piece of output per batch, so
+memory stays flat however large the collections are. Import parses lines as
+they arrive and writes each batch with one ``insert_many(ordered=False)``, so
+a bad or duplicate row doesn't hold up the rest. Both take a started
+DocumentStore: documents it holds in memory are exported as they are there,
+and documents that replace existing ones, or are large enough to be stored in
+chunks, are written through it so live sessions, history and the journal see
+them.
+"""
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple
+import asyncio
+import datetime
+import json
+import logging
+import zlib
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from collab.document import document_title
+
+logger = logging.getLogger(__name__)
+
+EXPORT_KINDS = ("documents", "users")
+USER_FIELDS = ("username", "password", "email", "created_at", "updated_at")
+DUPLICATE_KEY = 11000
+# Line errors listed in an import report; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+# Largest piece a compressed upload is inflated into at once
+INFLATE_PIECE_BYTES = 1024 * 1024
+
+class TransferError(ValueError):
+    """An import that cannot go on, e.g. a line over the size limit"""
+
+# Export -------------------------------------------------------------------
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def _encode(rows: List[dict]) -> bytes:
+    return "".join(
+        json.dumps(row, ensure_ascii=False, default=_json_default) + "\n" for row in rows
+    ).encode()
+
+async def _batches(cursor, size: int) -> AsyncIterator[List[dict]]:
+    batch = []
+    async for row in cursor.batch_size(size):
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def _document_rows(store, batch: List[dict]) -> List[dict]:
+    # Chunked content is read with one query per batch
+    chunked = [row["doc_id"] for row in batch if "chunks" in row and store.get(row["doc_id"]) is None]
+    found = await store.read_many(chunked) if chunked else {}
+    rows = []
+    for row in batch:
+        doc_id = row["doc_id"]
+        state = store.get(doc_id)
+        if state is not None:
+            content, revision = state.content, state.revision
+        elif doc_id in found:
+            content, revision = found[doc_id]
+        else:
+            content, revision = row.get("content", ""), row.get("revision", 0)
+        document = {"type": "document", "doc_id": doc_id, "content": content, "rev": revision}
+        owner = state.owner if state is not None else row.get("owner")
+        if owner is not None:
+            document["owner"] = owner
+        for field in ("collaborators", "created_at", "updated_at"):
+            if row.get(field) is not None:
+                document[field] = row[field]
+        rows.append(document)
+    return rows
+
+async def export_lines(store, users, kinds: Iterable[str] = EXPORT_KINDS, batch_size: int = 1000,
+                       compress_level: Optional[int] = None) -> AsyncIterator[bytes]:
+    """NDJSON for ``kinds``, one piece per batch; gzip at ``compress_level`` if given.
+
+    Encoding and compression run in a thread, a batch at a time.
+    """
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 31) if compress_level is not None else None
+
+    def encode(rows: List[dict]) -> bytes:
+        data = _encode(rows)
+        return compressor.compress(data) if compressor is not None else data
+
+    kinds = set(kinds)
+    if "documents" in kinds:
+        # Documents only in memory are written out first, so none is missed
+        await store.flush()
+        cursor = store.collection.find(
+            {}, {"_id": 0, "doc_id": 1, "content": 1, "chunks": 1, "revision": 1, "owner": 1, "collaborators": 1,
+                 "created_at": 1, "updated_at": 1}
+        )
+        async for batch in _batches(cursor, batch_size):
+            rows = await _document_rows(store, batch)
+            yield await asyncio.to_thread(encode, rows)
+    if "users" in kinds:
+        cursor = users.find({}, {"_id": 0, **{field: 1 for field in USER_FIELDS}})
+        async for batch in _batches(cursor, batch_size):
+            yield await asyncio.to_thread(encode, [{"type": "user", **row} for row in batch])
+    if compressor is not None:
+        yield compressor.flush()
+
+# Import -------------------------------------------------------------------
+
+def _inflate(decompressor, piece: bytes) -> Iterable[bytes]:
+    # Bounded output per call, so a small upload can't inflate into one huge piece
+    while piece:
+        try:
+            yield decompressor.decompress(piece, INFLATE_PIECE_BYTES)
+        except zlib.error as e:
+            raise TransferError(f"Bad compressed data: {str(e)}")
+        piece = decompressor.unconsumed_tail
+
+async def _lines(pieces: AsyncIterator[bytes], compressed: bool, max_line_bytes: int) -> AsyncIterator[bytes]:
+    """Split a byte stream (gzip or zlib if ``compressed``) into lines"""
+    decompressor = zlib.decompressobj(47) if compressed else None
+    parts: List[bytes] = []
+    size = 0
+    async for piece in pieces:
+        for data in (_inflate(decompressor, piece) if decompressor is not None else (piece,)):
+            start = 0
+            while True:
+                end = data.find(b"\n", start)
+                if end < 0:
+                    break
+                if size + end - start > max_line_bytes:
+                    raise TransferError(f"Line longer than {max_line_bytes} bytes")
+                parts.append(data[start:end])
+                yield b"".join(parts)
+                parts, size = [], 0
+                start = end + 1
+            if start < len(data):
+                size += len(data) - start
+                if size > max_line_bytes:
+                    raise TransferError(f"Line longer than {max_line_bytes} bytes")
+                parts.append(data[start:])
+    if decompressor is not None and not decompressor.eof:
+        raise TransferError("Compressed upload ends early")
+    if parts:
+        yield b"".join(parts)
+
+def _timestamp(row: dict, field: str, now: datetime.datetime) -> datetime.datetime:
+    value = row.get(field)
+    if value is None:
+        return now
+    if not isinstance(value, str):
+        raise ValueError(f"{field} must be an ISO 8601 string")
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _string(row: dict, field: str) -> str:
+    value = row.get(field)
+    if not isinstance(value, str) or not value:
+        raise ValueError(f"{field} must be a non-empty string")
+    return value
+
+def _parse(lines: List[Tuple[int, bytes]]) -> Tuple[List[dict], List[dict], List[dict]]:
+    """(documents, users, errors) from numbered lines"""
+    documents, users, errors = [], [], []
+    now = datetime.datetime.utcnow()
+    for number, line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError("expected a JSON object")
+            kind = row.get("type")
+            if kind == "document":
+                content = row.get("content", "")
+                revision = row.get("rev", 0)
+                if not isinstance(content, str):
+                    raise ValueError("content must be a string")
+                if not isinstance(revision, int) or isinstance(revision, bool) or revision < 0:
+                    raise ValueError("rev must be a non-negative integer")
+                document = {
+                    "doc_id": _string(row, "doc_id"), "content": content, "revision": revision,
+                    "title": document_title(content), "size": len(content),
+                    "created_at": _timestamp(row, "created_at", now), "updated_at": _timestamp(row, "updated_at", now)
+                }
+                if row.get("owner") is not None:
+                    document["owner"] = _string(row, "owner")
+                collaborators = row.get("collaborators", [])
+                if not isinstance(collaborators, list) or not all(isinstance(c, str) and c for c in collaborators):
+                    raise ValueError("collaborators must be a list of usernames")
+                if collaborators:
+                    document["collaborators"] = collaborators
+                documents.append(document)
+            elif kind == "user":
+                users.append({
+                    "username": _string(row, "username"), "password": _string(row, "password"),
+                    "email": _string(row, "email"),
+                    "created_at": _timestamp(row, "created_at", now), "updated_at": _timestamp(row, "updated_at", now)
+                })
+            else:
+                raise ValueError(f"unknown type {kind!r}")
+        except ValueError as e:
+            # json.JSONDecodeError and UnicodeDecodeError are ValueErrors too
+            errors.append({"line": number, "error": str(e)})
+    return documents, users, errors
+
+def _duplicates(error: BulkWriteError) -> List[int]:
+    """Indexes of the rows a bulk write skipped as duplicates; raises on anything else"""
+    write_errors = error.details.get("writeErrors", [])
+    if error.details.get("writeConcernErrors") or any(e.get("code") != DUPLICATE_KEY for e in write_errors):
+        raise error
+    return [e["index"] for e in write_errors]
+
+async def _import_documents(store, rows: List[dict], replace: bool,
+                            on_replace: Optional[Callable[..., Awaitable]], report: dict):
+    by_id = {}
+    for row in rows:
+        # The last line for a document wins
+        by_id[row["doc_id"]] = row
+    report["documents_skipped"] += len(rows) - len(by_id)
+    existing = {doc_id for doc_id in by_id if store.get(doc_id) is not None}
+    async for row in store.collection.find({"doc_id": {"$in": list(by_id)}}, {"doc_id": 1}):
+        existing.add(row["doc_id"])
+    inserts, through_store = [], []
+    for doc_id, row in by_id.items():
+        if doc_id in existing:
+            if replace:
+                through_store.append(row)
+            else:
+                report["documents_skipped"] += 1
+        elif store.chunk_size and len(row["content"]) > store.chunk_size:
+            # Too large for one row; the store's flush writes it in chunks
+            through_store.append(row)
+        else:
+            inserts.append(row)
+    if inserts:
+        skipped = 0
+        try:
+            await store.collection.insert_many(inserts, ordered=False)
+        except BulkWriteError as e:
+            # Created since the lookup above
+            skipped = len(_duplicates(e))
+        report["documents_inserted"] += len(inserts) - skipped
+        report["documents_skipped"] += skipped
+    for row in through_store:
+        state = await store.write(row["doc_id"], row["content"])
+        if row["doc_id"] in existing:
+            report["documents_replaced"] += 1
+        else:
+            # A new document keeps its owner and collaborators
+            state.owner = row.get("owner")
+            if row.get("collaborators"):
+                state.editors = set(row["collaborators"])
+            report["documents_inserted"] += 1
+        if on_replace is not None:
+            await on_replace(state)
+    if through_store:
+        # Keeps what the store holds dirty to one batch
+        await store.flush()
+
+async def _import_users(users, rows: List[dict], replace: bool, report: dict):
+    if replace:
+        result = await users.bulk_write([
+            UpdateOne({"username": row["username"]}, {"$set": row}, upsert=True) for row in rows
+        ], ordered=False)
+        report["users_inserted"] += result.upserted_count
+        report["users_replaced"] += len(rows) - result.upserted_count
+        return
+    skipped = 0
+    try:
+        await users.insert_many(rows, ordered=False)
+    except BulkWriteError as e:
+        skipped = len(_duplicates(e))
+    report["users_inserted"] += len(rows) - skipped
+    report["users_skipped"] += skipped
+
+async def import_lines(store, users, pieces: AsyncIterator[bytes], batch_size: int = 1000,
+                       replace: bool = False, compressed: bool = False, max_line_bytes: int = 256 * 1024 * 1024,
+                       on_replace: Optional[Callable[..., Awaitable]] = None) -> dict:
+    """Import NDJSON from a stream of byte pieces; returns counts and line errors.
+
+    New documents and users are inserted. Existing ones are skipped, or
+    with ``replace`` overwritten: documents through the store (a new
+    revision, passed to ``on_replace``) and users in place. Lines that fail
+    to parse are reported and skipped.
+    """
+    report = {
+        "lines": 0,
+        "documents_inserted": 0, "documents_replaced": 0, "documents_skipped": 0,
+        "users_inserted": 0, "users_replaced": 0, "users_skipped": 0,
+        "errors": 0, "error_lines": []
+    }
+
+    async def write(lines: List[Tuple[int, bytes]]):
+        documents, user_rows, errors = await asyncio.to_thread(_parse, lines)
+        report["errors"] += len(errors)
+        report["error_lines"].extend(errors[:MAX_REPORTED_ERRORS - len(report["error_lines"])])
+        if documents:
+            await _import_documents(store, documents, replace, on_replace, report)
+        if user_rows:
+            await _import_users(users, user_rows, replace, report)
+
+    batch = []
+    async for line in _lines(pieces, compressed, max_line_bytes):
+        report["lines"] += 1
+        batch.append((report["lines"], line))
+        if len(batch) >= batch_size:
+            await write(batch)
+            batch = []
+    if batch:
+        await write(batch)
+    return report
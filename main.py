@@ -1,23 +1,88 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from api.routes import router as api_router
 from api.auth import router as auth_router
-from api.websocket import ConnectionManager
-import json
+from api.ratelimit import RateLimitExceeded, RateLimitMiddleware, admission, loop_monitor, rest_limits
+from api.websocket import (
+    manager, documents, catch_up_messages, fetch_missed, handle_message, receive_message, throttle_message
+)
+from api.codec import CodecError, MessageTooLarge, negotiate
+from auth.jwt_handler import authenticate_websocket
+from auth.passwords import password_hasher
+from db.mongo import connect_mongo, close_mongo, get_client
+from db.schema import ensure_schema
+from telemetry.logs import configure_logging, parse_sample, stop_logging
+from telemetry.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, registry
+from config import (
+    MONGO_DB_NAME, WS_COMPRESS_THRESHOLD_BYTES, WS_MAX_MESSAGE_BYTES, WS_AUTH_REQUIRED, HTTP_COMPRESS_MIN_BYTES,
+    HTTP_GZIP_LEVEL, LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE, LOG_QUEUE_SIZE, LOG_MAX_FIELD_CHARS, SEARCH_BACKFILL
+)
+from contextlib import asynccontextmanager
 import logging
+import time
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # pragma: no cover - optional, gzip only
+    BrotliMiddleware = None
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-manager = ConnectionManager()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Log lines are formatted and written by a thread, not the event loop
+    configure_logging(LOG_LEVEL, LOG_FORMAT == "json", parse_sample(LOG_SAMPLE), LOG_QUEUE_SIZE, LOG_MAX_FIELD_CHARS)
+    # One pooled Mongo client per worker for the lifetime of the process
+    await connect_mongo()
+    db = get_client()[MONGO_DB_NAME]
+    try:
+        await ensure_schema(db)
+    except Exception as e:
+        logger.error("Schema bootstrap failed", extra={"event": "schema.bootstrap_failed", "error": e}, exc_info=True)
+    documents.history.start(db.document_ops, db.document_snapshots, db.history_chunks)
+    await documents.start(db.documents, db.document_chunks)
+    documents.search.start(db.search_documents, db.search_postings, db.search_terms,
+                           backfill=documents if SEARCH_BACKFILL else None)
+    await manager.start()
+    password_hasher.start()
+    loop_monitor.start()
+    try:
+        yield
+    finally:
+        await loop_monitor.stop()
+        password_hasher.stop()
+        await manager.stop()
+        # Write out any dirty documents before the client goes away
+        await documents.stop()
+        # After the final flush, which queues what it wrote
+        await documents.search.stop()
+        await close_mongo()
+        stop_logging()
+
+app = FastAPI(lifespan=lifespan)
 
-# Add CORS middleware
+# Compress large response bodies (documents); brotli when available, else gzip
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=HTTP_COMPRESS_MIN_BYTES, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=HTTP_COMPRESS_MIN_BYTES, compresslevel=HTTP_GZIP_LEVEL)
+
+# Times everything inside it, including compression; not requests refused below
+app.add_middleware(MetricsMiddleware)
+
+# Outside everything but CORS: over-limit requests cost no decompression or parsing
+app.add_middleware(RateLimitMiddleware, limits=rest_limits)
+
+# Outermost, so responses refused by the rate limiter carry CORS headers too and
+# browsers can read their status and Retry-After
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Temporarily allow all origins for debugging
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Retry-After"],
 )
 
 # Include API routes with proper prefix handling
@@ -26,20 +91,79 @@ app.include_router(auth_router, prefix="/api", tags=["auth"])
 
 @app.websocket("/ws/{document_id}")
 async def websocket_endpoint(websocket: WebSocket, document_id: str):
-    await manager.connect(websocket, document_id)
+    user, subprotocol = authenticate_websocket(websocket)
+    if user is None and WS_AUTH_REQUIRED:
+        logger.info("Rejecting unauthenticated websocket", extra={"event": "ws.unauthenticated", "doc_id": document_id})
+        # Closing before accept turns the handshake into a 403
+        await websocket.close(code=1008)
+        return
+    reason = admission.check(manager.connection_count)
+    if reason is not None:
+        logger.warning("Shedding websocket", extra={"event": "ws.shed", "doc_id": document_id, "reason": reason})
+        # 1013 tells the client to try again later, ideally on another worker
+        await websocket.accept(subprotocol=subprotocol)
+        await websocket.close(code=1013)
+        return
     try:
+        codec = negotiate(
+            websocket.query_params.get("codec"),
+            websocket.query_params.get("compress"),
+            WS_COMPRESS_THRESHOLD_BYTES,
+            WS_MAX_MESSAGE_BYTES
+        )
+    except CodecError as e:
+        logger.info("Rejecting websocket codec", extra={"event": "ws.bad_codec", "doc_id": document_id, "error": e})
+        await websocket.close(code=1003)
+        return
+    since = websocket.query_params.get("since")
+    since = int(since) if since and since.lstrip("-").isdigit() else None
+    state = await documents.open(document_id)
+    try:
+        logged = await fetch_missed(state, since)
+        presence = websocket.query_params.get("presence") in ("1", "true")
+        connection = await manager.connect(websocket, document_id, codec, user, subprotocol, presence)
+        # Queued before any broadcast can reach this socket; clients base
+        # their first op on this revision. A reconnecting client passes the
+        # last revision it saw and only gets what it missed.
+        barrier = documents.barrier()
+        for message in catch_up_messages(state, since, logged):
+            manager.send(websocket, document_id, message, barrier)
+        manager.send_presence(websocket, document_id)
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
-            if message.get('type') == 'content_update':
-                await manager.broadcast(data, document_id)
+            message = await receive_message(websocket, codec)
+            # Any frame, even one that is ignored, shows the peer is alive
+            connection.last_seen = time.monotonic()
+            if message is not None and await throttle_message(connection, message):
+                await handle_message(websocket, manager, state, message, user)
     except WebSocketDisconnect:
-        manager.disconnect(websocket, document_id)
+        pass
+    except MessageTooLarge as e:
+        logger.info("Disconnecting websocket over the message size limit", extra={
+            "event": "ws.message_too_large", "doc_id": document_id, "error": e
+        })
+        await manager.disconnect(websocket, document_id)
+        await websocket.close(code=1009)
+    except RateLimitExceeded as e:
+        logger.info("Disconnecting websocket over its rate limit", extra={
+            "event": "ws.rate_limited", "doc_id": document_id, "reason": e
+        })
+        # Stop its sender first so the close doesn't race a send
+        await manager.disconnect(websocket, document_id)
+        await websocket.close(code=1008)
+    finally:
+        await manager.disconnect(websocket, document_id)
+        documents.close(document_id)
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    # Prometheus text format; scraped per worker
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to RealDoc API", "endpoints": {
         "websocket": "/ws/{document_id}",
         "docs": "/docs",
+        "metrics": "/metrics",
         "redoc": "/redoc"
     }}
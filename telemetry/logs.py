@@ -0,0 +1,189 @@
+"""Logging off the event loop.
+
+configure_logging() gives the root logger a single handler that puts
+records on a bounded queue; a listener thread formats and writes them. The
+event loop only builds the LogRecord, and only for enabled levels.
+Messages are not formatted at the call site either, so ``%s`` args are
+rendered in the listener thread (pass values that won't change meanwhile).
+
+Hot paths log a constant message with structured fields:
+
+    logger.info("Document saved", extra={"event": "document.saved", "doc_id": doc_id})
+
+Fields named in REDACTED_FIELDS (document content, passwords, tokens,
+auth headers) never reach the output, other long values are cut to
+``max_field_chars``, and events listed in ``sample`` are kept one in N.
+Tokens in URL query strings are masked in messages too: uvicorn logs each
+websocket handshake with its full URL, ``?token=`` included.
+"""
+from collections.abc import Mapping
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+import json
+import logging
+import queue
+import re
+import sys
+import time
+
+# Field and header names whose values are never written out
+REDACTED_FIELDS = frozenset((
+    "content", "password", "token", "access_token", "refresh_token", "authorization", "cookie",
+    "set-cookie", "sec-websocket-protocol",
+))
+
+# Query parameters masked wherever a URL shows up in a message
+_QUERY_SECRET = re.compile(r"([?&](?:token|access_token|refresh_token)=)[^&\s\"']+")
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# Loggers that write on their own by default (uvicorn's access log is one
+# line per request) and are moved onto the queue as well
+CAPTURED_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else f"{text[:limit]}... <{len(text)} chars>"
+
+def redact(name: str, value, limit: int = 1000):
+    """The value to write for a field, with secrets and bulk removed"""
+    if name.lower() in REDACTED_FIELDS:
+        return f"<redacted {len(value)} chars>" if isinstance(value, (str, bytes)) else "<redacted>"
+    if isinstance(value, Mapping):
+        # e.g. request headers
+        return {str(key): redact(str(key), item, limit) for key, item in value.items()}
+    if isinstance(value, (bool, int, float)) or value is None:
+        return value
+    return _clip(str(value), limit)
+
+class LogQueueHandler(QueueHandler):
+    """Queues records as they are, without formatting them first"""
+
+    def __init__(self, records: "queue.SimpleQueue", max_queued: int = 10000,
+                 sample: Optional[Dict[str, int]] = None):
+        super().__init__(records)
+        self.max_queued = max_queued
+        self.sample = dict(sample or {})
+        self._seen: Dict[str, int] = {}
+        self.stats = {"queued": 0, "dropped_full": 0, "dropped_sampled": 0}
+
+    def filter(self, record: logging.LogRecord):
+        every = self.sample.get(getattr(record, "event", None))
+        if every and every > 1:
+            seen = self._seen.get(record.event, 0)
+            self._seen[record.event] = seen + 1
+            if seen % every:
+                self.stats["dropped_sampled"] += 1
+                return False
+            record.sampled = every
+        return super().filter(record)
+
+    def handle(self, record: logging.LogRecord):
+        # The queue is thread-safe; skip the handler lock
+        if self.filter(record):
+            self.emit(record)
+        return record
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            # Tracebacks pin their frames; render now and let them go
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.queue.qsize() >= self.max_queued:
+            # Never block the event loop, or grow without bound, on a slow log sink
+            self.stats["dropped_full"] += 1
+            return
+        self.queue.put_nowait(record)
+        self.stats["queued"] += 1
+
+class StructuredFormatter(logging.Formatter):
+    """One line per record: JSON, or ``time level logger message key=value``"""
+
+    def __init__(self, json_lines: bool = True, max_field_chars: int = 1000):
+        super().__init__()
+        self.json_lines = json_lines
+        self.max_field_chars = max_field_chars
+        self._second = None
+        self._second_text = ""
+
+    def timestamp(self, created: float) -> str:
+        """ISO 8601 UTC with milliseconds; the seconds part is reused while it lasts"""
+        second = int(created)
+        if second != self._second:
+            self._second = second
+            self._second_text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        return f"{self._second_text}.{int((created - second) * 1000):03d}Z"
+
+    def format(self, record: logging.LogRecord) -> str:
+        limit = self.max_field_chars
+        attrs = record.__dict__
+        fields = {key: redact(key, attrs[key], limit) for key in attrs.keys() - _RECORD_ATTRS}
+        message = record.getMessage()
+        if "token=" in message:
+            message = _QUERY_SECRET.sub(r"\1<redacted>", message)
+        message = _clip(message, limit)
+        timestamp = self.timestamp(record.created)
+        if self.json_lines:
+            entry = {"ts": timestamp, "level": record.levelname, "logger": record.name, "msg": message}
+            entry.update(fields)
+            if record.exc_text:
+                entry["exc"] = record.exc_text
+            return json.dumps(entry, default=str)
+        line = f"{timestamp} {record.levelname} {record.name} {message}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+_listener: Optional[QueueListener] = None
+_handler: Optional[LogQueueHandler] = None
+
+def parse_sample(spec: Optional[str]) -> Dict[str, int]:
+    """``"ws.op_rejected=100, document.saved=10"`` -> {event: keep one in N}"""
+    sample = {}
+    for entry in (spec or "").split(","):
+        event, _, every = entry.partition("=")
+        if event.strip() and every.strip():
+            sample[event.strip()] = int(every)
+    return sample
+
+def configure_logging(level: str = "INFO", json_lines: bool = True, sample: Optional[Dict[str, int]] = None,
+                      queue_size: int = 10000, max_field_chars: int = 1000, stream=None) -> LogQueueHandler:
+    """Route all logging through the queue and start the writer thread"""
+    global _listener, _handler
+    stop_logging()
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(StructuredFormatter(json_lines, max_field_chars))
+    records = queue.SimpleQueue()
+    _handler = LogQueueHandler(records, queue_size, sample)
+    _listener = QueueListener(records, output, respect_handler_level=False)
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(level.upper())
+    for name in CAPTURED_LOGGERS:
+        captured = logging.getLogger(name)
+        captured.handlers = []
+        captured.propagate = True
+    _listener.start()
+    return _handler
+
+def stop_logging():
+    """Write out what is queued and stop the writer thread"""
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _handler is not None:
+        root = logging.getLogger()
+        if _handler in root.handlers:
+            root.removeHandler(_handler)
+        _handler = None
+
+def metrics() -> Optional[dict]:
+    if _handler is None:
+        return None
+    return dict(_handler.stats, pending=_handler.queue.qsize())
@@ -0,0 +1,276 @@
+"""In-process metrics in the Prometheus text format.
+
+Counters, gauges and histograms are registered once at import time. Each
+label combination is bound once with ``labels(...)`` and the child kept, so
+a hot path only does ``child.inc()`` or ``child.observe(seconds)``: no label
+dict, no string formatting and no locking, since nearly everything runs on
+the event loop (the Mongo listeners, called from driver threads, serialise
+their own updates). Histogram observations land in a per-bucket count and are
+summed into the cumulative ``le`` buckets only when /metrics is scraped.
+
+Values that already live in a component's ``stats`` (connection counts,
+cache sizes) are read at scrape time by a registered collector instead of
+being mirrored on every change.
+"""
+from bisect import bisect_left
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; from sub-millisecond sends up to slow Mongo queries
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+Sample = Tuple[str, Sequence[Tuple[str, str]], float]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    text = ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs)
+    return "{" + text + "}" if text else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+class GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+class HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One count per bucket plus +Inf; made cumulative when scraped
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """The child for these label values; bind it once and keep it"""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def samples(self) -> List[Sample]:
+        return [
+            (self.name, tuple(zip(self.labelnames, key)), child.value)
+            for key, child in self._children.items()
+        ]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return CounterChild()
+
+    def samples(self) -> List[Sample]:
+        return [(self.name + "_total", labels, value) for _, labels, value in super().samples()]
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return GaugeChild()
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self._le = tuple(_number(float(bound)) for bound in self.bounds) + ("+Inf",)
+
+    def _new_child(self):
+        return HistogramChild(self.bounds)
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        for key, child in self._children.items():
+            labels = tuple(zip(self.labelnames, key))
+            total = 0
+            for le, count in zip(self._le, child.counts):
+                total += count
+                samples.append((self.name + "_bucket", labels + (("le", le),), total))
+            samples.append((self.name + "_count", labels, total))
+            samples.append((self.name + "_sum", labels, child.sum))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        # name -> (kind, help, callable returning [(labels, value)], histogram buckets) read at scrape time
+        self._collectors: Dict[str, Tuple[str, str, Callable[[], Iterable], Sequence[float]]] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics or metric.name in self._collectors:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def collect(self, name: str, help: str, read: Callable[[], Iterable], kind: str = "gauge",
+                buckets: Sequence[float] = SIZE_BUCKETS):
+        """Expose ``read()``'s ``[(labels, value)]`` (labels a dict or pairs) at scrape time.
+
+        For ``kind="histogram"``, ``read()`` returns the observations
+        themselves, bucketed into ``buckets`` as they are read.
+        """
+        if name in self._metrics:
+            raise ValueError(f"Metric already registered: {name}")
+        self._collectors[name] = (kind, help, read, buckets)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for name, (kind, help, read, buckets) in self._collectors.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                histogram = Histogram(name, help, buckets=buckets)
+                child = histogram.labels()
+                for value in read():
+                    child.observe(value)
+                for sample, labels, value in histogram.samples():
+                    lines.append(f"{sample}{_labels(labels)} {_number(value)}")
+                continue
+            for labels, value in read():
+                if isinstance(labels, dict):
+                    labels = labels.items()
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# Metrics observed on hot paths, bound by the modules that own those paths
+http_request_seconds = registry.histogram(
+    "realdoc_http_request_seconds", "HTTP request latency by route", ("method", "route")
+)
+http_responses = registry.counter(
+    "realdoc_http_responses", "HTTP responses by route and status", ("method", "route", "status")
+)
+mongo_command_seconds = registry.histogram(
+    "realdoc_mongo_command_seconds", "MongoDB command latency", ("command",)
+)
+mongo_command_failures = registry.counter(
+    "realdoc_mongo_command_failures", "MongoDB commands that failed", ("command",)
+)
+mongo_pool_connections = registry.gauge(
+    "realdoc_mongo_pool_connections", "Pooled MongoDB connections", ("state",)
+)
+mongo_pool_checkout_failures = registry.counter(
+    "realdoc_mongo_pool_checkout_failures", "Failed connection checkouts from the MongoDB pool"
+)
+ws_fanout_recipients = registry.histogram(
+    "realdoc_ws_fanout_recipients", "Local recipients per websocket broadcast", buckets=SIZE_BUCKETS
+)
+ws_delivery_seconds = registry.histogram(
+    "realdoc_ws_delivery_seconds", "Time from queueing a websocket message to sending it"
+)
+password_queue_seconds = registry.histogram(
+    "realdoc_password_hash_queue_seconds", "Time a bcrypt call waited for a worker"
+)
+event_loop_lag_seconds = registry.histogram(
+    "realdoc_event_loop_lag_seconds", "How late the event loop woke a sleeping task",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+class MetricsMiddleware:
+    """Times HTTP requests and counts responses, labelled by route template.
+
+    Labels use the matched route's path (``/api/documents/{doc_id}``), not
+    the request path, so there is one series per route; requests no route
+    matched share ``route="unmatched"``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._latency: Dict[Tuple[str, str], HistogramChild] = {}
+        self._responses: Dict[Tuple[str, str, int], CounterChild] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_and_record_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        finally:
+            elapsed = perf_counter() - start
+            # The router puts the matched route into the shared scope
+            route = getattr(scope.get("route"), "path_format", "unmatched")
+            key = (scope["method"], route)
+            latency = self._latency.get(key)
+            if latency is None:
+                latency = self._latency[key] = http_request_seconds.labels(*key)
+            latency.observe(elapsed)
+            key = (scope["method"], route, status)
+            responses = self._responses.get(key)
+            if responses is None:
+                responses = self._responses[key] = http_responses.labels(*key)
+            responses.inc()
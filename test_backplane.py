@@ -0,0 +1,123 @@
+import asyncio
+import json
+import multiprocessing
+import socket
+import threading
+import pytest
+
+pytest.importorskip("redis")
+fakeredis = pytest.importorskip("fakeredis")
+
+from api.backplane import RedisBackplane
+from api.websocket import ConnectionManager
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message):
+        self.sent.append(message)
+
+@pytest.fixture(scope="module")
+def redis_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = fakeredis.TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"redis://127.0.0.1:{port}"
+    server.shutdown()
+    server.server_close()
+
+async def wait_for(predicate, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("timed out waiting for delivery")
+        await asyncio.sleep(0.01)
+
+def run_subscriber_node(url, ready, results):
+    async def node():
+        manager = ConnectionManager(RedisBackplane(url))
+        await manager.start()
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, "shared-doc")
+        ready.set()
+        await wait_for(lambda: len(websocket.sent) >= 1)
+        # Give a stray message for another document time to show up
+        await asyncio.sleep(0.2)
+        results.put(websocket.sent)
+        await manager.stop()
+
+    asyncio.run(node())
+
+def test_cross_process_fan_out(redis_url):
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Event()
+    results = ctx.Queue()
+    process = ctx.Process(target=run_subscriber_node, args=(redis_url, ready, results))
+    process.start()
+
+    async def publisher():
+        manager = ConnectionManager(RedisBackplane(redis_url))
+        await manager.start()
+        local = FakeWebSocket()
+        await manager.connect(local, "shared-doc")
+        assert await asyncio.get_running_loop().run_in_executor(None, ready.wait, 20)
+        await manager.broadcast("not-for-you", "other-doc")
+        await manager.broadcast("hello", "shared-doc")
+        await manager.stop()
+        return local.sent
+
+    try:
+        assert asyncio.run(publisher()) == ["hello"]
+        assert results.get(timeout=20) == ["hello"]
+    finally:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+
+def test_node_without_subscribers_is_skipped(redis_url):
+    async def scenario():
+        a = ConnectionManager(RedisBackplane(redis_url))
+        b = ConnectionManager(RedisBackplane(redis_url))
+        await a.start()
+        await b.start()
+        ws_a, ws_b = FakeWebSocket(), FakeWebSocket()
+        await a.connect(ws_a, "doc")
+        await b.connect(ws_b, "doc")
+        await a.broadcast("one", "doc", exclude=ws_a)
+        await wait_for(lambda: ws_b.sent == ["one"])
+        assert ws_a.sent == []
+        await b.disconnect(ws_b, "doc")
+        await a.broadcast("two", "doc")
+        await asyncio.sleep(0.2)
+        assert ws_b.sent == ["one"]
+        assert ws_a.sent == ["two"]
+        await a.stop()
+        await b.stop()
+
+    asyncio.run(scenario())
+
+def test_malformed_messages_do_not_stop_the_reader(redis_url):
+    import redis.asyncio as redis
+
+    async def scenario():
+        node = ConnectionManager(RedisBackplane(redis_url))
+        await node.start()
+        websocket = FakeWebSocket()
+        await node.connect(websocket, "doc")
+        client = redis.from_url(redis_url)
+        channel = node.backplane.channel_prefix + "doc"
+        for garbage in (b"not json", b"[1, 2]", b'{"m": "no origin"}'):
+            await client.publish(channel, garbage)
+        await client.publish(channel, json.dumps({"o": "elsewhere", "m": "still here"}))
+        await wait_for(lambda: websocket.sent == ["still here"])
+        await client.aclose()
+        await node.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import pytest
+
+from api.websocket import COALESCE, DISCONNECT, ConnectionManager
+
+class FakeWebSocket:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message):
+        if self.fail:
+            raise RuntimeError("socket is gone")
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0.01)
+
+def test_stalled_client_does_not_delay_others():
+    async def scenario():
+        manager = ConnectionManager(queue_size=4)
+        fast, stalled = FakeWebSocket(), FakeWebSocket(delay=10)
+        await manager.connect(fast, "doc")
+        await manager.connect(stalled, "doc")
+        await manager.broadcast("hello", "doc")
+        await settle()
+        assert fast.sent == ["hello"]
+        assert stalled.sent == []
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+def test_sender_is_excluded_and_dead_sockets_are_evicted():
+    async def scenario():
+        manager = ConnectionManager()
+        sender, dead, peer = FakeWebSocket(), FakeWebSocket(fail=True), FakeWebSocket()
+        for websocket in (sender, dead, peer):
+            await manager.connect(websocket, "doc")
+        await manager.broadcast("edit", "doc", exclude=sender)
+        await settle()
+        assert sender.sent == [] and peer.sent == ["edit"]
+        assert dead not in manager.active_connections["doc"]
+        assert dead.closed_with == 1011
+        assert manager.metrics()["doc"]["disconnects"] == 1
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+def test_heartbeat_pings_quiet_clients_and_closes_idle_and_old_ones():
+    async def scenario():
+        manager = ConnectionManager(ping_interval=10, idle_timeout=30, max_lifetime=100)
+        chatty, quiet = FakeWebSocket(), FakeWebSocket()
+        talking = await manager.connect(chatty, "doc")
+        silent = await manager.connect(quiet, "doc")
+        start = silent.connected_at
+        talking.last_seen = start + 12
+        manager.sweep(start + 15)
+        await settle()
+        assert [json.loads(m)["type"] for m in quiet.sent] == ["ping"] and chatty.sent == []
+        # Half-open: never answers, so it is closed once idle for 30s
+        talking.last_seen = start + 40
+        manager.sweep(start + 45)
+        await settle()
+        assert quiet.closed_with == 1001 and chatty.closed_with is None
+        assert list(manager.connections) == [talking.session_id] and manager.connection_count == 1
+        manager.sweep(start + 100)
+        await settle()
+        assert chatty.closed_with == 1001
+        assert not manager.connections and "doc" not in manager.active_connections
+        assert manager.lifecycle_stats["idle_closed"] == 1 and manager.lifecycle_stats["lifetime_closed"] == 1
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+def test_slow_consumer_is_coalesced_to_latest_snapshot():
+    async def scenario():
+        manager = ConnectionManager(queue_size=2, slow_consumer_policy=COALESCE)
+        latest = {"value": None}
+        manager.snapshot_provider = lambda doc_id: {"type": "resync", "rev": latest["value"]}
+        slow = FakeWebSocket(delay=0.05)
+        await manager.connect(slow, "doc")
+        for i in range(10):
+            latest["value"] = i
+            await manager.broadcast(f"op-{i}", "doc")
+        await asyncio.sleep(0.3)
+        assert json.loads(slow.sent[-1]) == {"type": "resync", "rev": 9}
+        assert len(slow.sent) < 10
+        assert manager.metrics()["doc"]["dropped"] > 0
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+def test_slow_consumer_is_disconnected():
+    async def scenario():
+        manager = ConnectionManager(queue_size=2, slow_consumer_policy=DISCONNECT)
+        slow, fast = FakeWebSocket(delay=0.05), FakeWebSocket()
+        await manager.connect(slow, "doc")
+        await manager.connect(fast, "doc")
+        for i in range(5):
+            await manager.broadcast(f"op-{i}", "doc")
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.2)
+        assert slow.closed_with == 1013
+        assert list(manager.active_connections["doc"]) == [fast]
+        assert len(fast.sent) == 5
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        ConnectionManager(slow_consumer_policy="ignore")
+
+def test_messages_wait_for_their_barrier():
+    async def scenario():
+        manager = ConnectionManager()
+        sender, peer = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(sender, "doc")
+        await manager.connect(peer, "doc")
+        durable = asyncio.get_running_loop().create_future()
+        manager.send(sender, "doc", "ack", durable)
+        await manager.broadcast("op", "doc", exclude=sender, barrier=durable)
+        manager.send(sender, "doc", "later")
+        await settle()
+        assert sender.sent == [] and peer.sent == []
+        durable.set_result(None)
+        await settle()
+        assert sender.sent == ["ack", "later"] and peer.sent == ["op"]
+        failed = asyncio.get_running_loop().create_future()
+        failed.set_exception(RuntimeError("journal sync failed"))
+        manager.send(peer, "doc", "never", failed)
+        await settle()
+        assert peer.sent == ["op"] and peer.closed_with == 1011
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+def test_catch_up_sends_missed_ops_or_a_snapshot():
+    from collab.document import DocumentState
+    from collab.ot import TextOperation
+    from api.websocket import catch_up_messages
+
+    state = DocumentState("doc", "", history_limit=3)
+    for char in "abcd":
+        state.apply_client_op(state.revision, TextOperation().retain(len(state.content)).insert(char))
+    resume, *ops = catch_up_messages(state, 2)
+    assert resume == {"type": "resume", "since": 2, "rev": 4}
+    assert [op["rev"] for op in ops] == [3, 4]
+    for since in (None, 0, 9):
+        assert catch_up_messages(state, since) == [{"type": "snapshot", "rev": 4, "content": "abcd"}]
+
+def test_catch_up_continues_from_the_op_log():
+    from collab.document import DocumentState
+    from collab.ot import TextOperation
+    from api.websocket import catch_up_messages
+
+    # Restarted worker: nothing in memory before revision 4
+    state = DocumentState("doc", "abcd", revision=4)
+    state.apply_client_op(4, TextOperation().retain(4).insert("e"))
+    logged = [(3, [2, "c"]), (4, [3, "d"])]
+    resume, *ops = catch_up_messages(state, 2, logged)
+    assert resume["rev"] == 5
+    assert [(op["rev"], op["ops"]) for op in ops] == [(3, [2, "c"]), (4, [3, "d"]), (5, [4, "e"])]
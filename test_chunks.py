@@ -0,0 +1,96 @@
+import asyncio
+import random
+import pytest
+
+from collab.chunks import Chunk, ChunkLayout
+from collab.ot import TextOperation
+
+def test_edits_touch_only_their_chunks():
+    layout = ChunkLayout([Chunk(10, 0), Chunk(10, 1), Chunk(10, 2)], 3)
+    content = "a" * 30
+    layout.edit(TextOperation().retain(12).insert("xy").retain(18))
+    content = content[:12] + "xy" + content[12:]
+    assert [c.number for c in layout.chunks] == [0, None, 2]
+    numbers, writes = layout.plan(content, 10)
+    assert numbers == [0, 3, 2]
+    assert [(number, text) for _, _, number, text in writes] == [(3, content[10:22])]
+    layout.commit(writes)
+    # A delete spanning a boundary touches both sides
+    layout.edit(TextOperation().retain(21).delete(3).retain(8))
+    assert [c.number for c in layout.chunks] == [0, None, None]
+
+def test_plan_keeps_lengths_in_step_with_content():
+    rng = random.Random(7)
+    content = "".join(rng.choice("abcdef") for _ in range(500))
+    layout = ChunkLayout([Chunk(len(content))])
+    for _ in range(300):
+        pos = rng.randint(0, len(content))
+        deleted = rng.randint(0, min(40, len(content) - pos)) if rng.random() < 0.4 else 0
+        text = "z" * rng.randint(0, 60)
+        op = TextOperation.from_edit(len(content), pos, deleted, text)
+        content = op.apply(content)
+        layout.edit(op)
+        if rng.random() < 0.2:
+            numbers, writes = layout.plan(content, 64)
+            layout.commit(writes)
+            assert sum(c.length for c in layout.chunks) == len(content)
+            assert all(0 < c.length <= 128 for c in layout.chunks)
+            assert len(set(numbers)) == len(numbers)
+
+def test_edit_during_flush_keeps_chunk_dirty():
+    layout = ChunkLayout([Chunk(5, 0), Chunk(5, 1)], 2)
+    layout.edit(TextOperation().retain(7).insert("!").retain(3))
+    numbers, writes = layout.plan("a" * 11, 5)
+    # Lands while the chunk rows are being written
+    layout.edit(TextOperation().retain(8).insert("?").retain(3))
+    layout.commit(writes)
+    assert layout.chunks[1].number is None
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from collab.history import HistoryStore
+from collab.store import DocumentStore
+
+def make_store(db, chunk_size=100):
+    history = HistoryStore(snapshot_every_ops=2, chunk_size=chunk_size)
+    history.start(db.document_ops, db.document_snapshots, db.history_chunks)
+    return DocumentStore(flush_interval_ms=60000, history=history, chunk_size=chunk_size)
+
+def test_large_documents_are_stored_in_chunks():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["chunks-test"]
+        store = make_store(db)
+        await store.start(db.documents, db.document_chunks)
+        original = "".join(str(i % 10) for i in range(1000))
+        state = await store.write("big", original)
+        await store.flush()
+        row = await db.documents.find_one({"doc_id": "big"})
+        assert "content" not in row and len(row["chunks"]) == 10
+        assert await db.document_chunks.count_documents({"doc_id": "big"}) == 10
+        assert await db.history_chunks.count_documents({"doc_id": "big", "kind": "op"}) == 10
+        state.apply_client_op(state.revision, TextOperation.from_edit(1000, 450, 0, "hello"))
+        store.changed(state)
+        written = store.stats["chunks_written"]
+        await store.flush()
+        assert store.stats["chunks_written"] - written == 1
+        # The replaced chunk row is gone
+        assert await db.document_chunks.count_documents({"doc_id": "big"}) == 10
+        # An orphan from a crashed flush is cleaned up by the next one
+        await db.document_chunks.insert_one({"doc_id": "big", "n": 999, "data": "junk"})
+        state.apply_client_op(state.revision, TextOperation.from_edit(1005, 0, 1, ""))
+        store.changed(state)
+        await store.stop()
+        assert await db.document_chunks.count_documents({"doc_id": "big", "n": 999}) == 0
+
+        fresh = make_store(db)
+        await fresh.start(db.documents, db.document_chunks)
+        loaded = await fresh.read("big")
+        assert loaded.content == state.content and loaded.revision == 3
+        assert await fresh.history.reconstruct("big", 1) == original
+        # Revision 2 comes from a snapshot stored in chunks
+        assert await db.history_chunks.count_documents({"doc_id": "big", "kind": "snapshot", "rev": 2}) == 11
+        assert await fresh.history.reconstruct("big", 2) == original[:450] + "hello" + original[450:]
+        assert (await fresh.read_many(["big"]))["big"] == (state.content, 3)
+        await fresh.stop()
+
+    asyncio.run(scenario())
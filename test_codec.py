@@ -0,0 +1,82 @@
+import pytest
+
+from api.codec import JSON, Codec, CodecError, Frame, MessageTooLarge, negotiate, sniff_type
+
+OP = {"type": "op", "rev": 7, "ops": [5, "abc", -2, 10]}
+SNAPSHOT = {"type": "snapshot", "rev": 7, "content": "lorem ipsum " * 2000}
+
+def available(name, compression=None):
+    try:
+        return negotiate(name, compression)
+    except CodecError:
+        pytest.skip(f"{name}/{compression} not installed")
+
+@pytest.mark.parametrize("name,compression", [
+    ("json", None), ("json", "deflate"), ("json", "zstd"),
+    ("msgpack", None), ("msgpack", "deflate"), ("msgpack", "zstd"),
+])
+def test_round_trip(name, compression):
+    codec = available(name, compression)
+    for message in (OP, SNAPSHOT):
+        assert codec.decode(codec.encode(message)) == message
+
+def test_only_large_payloads_are_compressed():
+    codec = available("json", "deflate")
+    assert isinstance(codec.encode(OP), str)
+    encoded = codec.encode(SNAPSHOT)
+    assert isinstance(encoded, bytes) and encoded[0] == 1
+    assert len(encoded) < len(JSON.encode(SNAPSHOT)) / 10
+
+def test_frame_encodes_once_per_codec(monkeypatch):
+    calls = []
+    original = Codec.encode
+
+    def counting(self, message):
+        calls.append(self.key)
+        return original(self, message)
+
+    monkeypatch.setattr(Codec, "encode", counting)
+    frame = Frame(OP)
+    for _ in range(100):
+        frame.encode(JSON)
+    assert calls == [JSON.key]
+
+def test_frame_from_json_passes_text_through():
+    text = '{"type":"op","rev":1,"ops":["x"]}'
+    frame = Frame.from_json(text)
+    assert frame.encode(JSON) is text
+    assert frame.message["rev"] == 1
+
+def test_sniff_type():
+    assert sniff_type('{"type": "cursor", "pos": 4}') == "cursor"
+    assert sniff_type('{"rev": 1, "type": "op"}') is None
+    assert sniff_type(b"\x00\x81") is None
+
+def test_rejects_unknown_codec_and_garbage():
+    with pytest.raises(CodecError):
+        negotiate("xml")
+    with pytest.raises(CodecError):
+        JSON.decode(b"\x07junk")
+
+@pytest.mark.parametrize("compression", ["deflate", "zstd"])
+def test_frames_inflating_past_the_limit_are_refused(compression):
+    import asyncio
+    from api.websocket import receive_message
+
+    available("json", compression)
+    codec = Codec("json", compression, threshold=0, max_message_bytes=1000)
+    fits = {"type": "content_update", "content": "x" * 900}
+    assert codec.decode(codec.encode(fits)) == fits
+    # A few hundred bytes on the wire, megabytes once inflated
+    bomb = codec.encode({"type": "content_update", "content": "x" * 5_000_000})
+    assert len(bomb) < 10_000
+    with pytest.raises(MessageTooLarge):
+        codec.decode(bomb)
+
+    class Socket:
+        async def receive(self):
+            return {"type": "websocket.receive", "bytes": bomb}
+
+    # Not dropped like a garbled frame: the endpoint closes the socket with 1009
+    with pytest.raises(MessageTooLarge):
+        asyncio.run(receive_message(Socket(), codec))
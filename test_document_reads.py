@@ -0,0 +1,198 @@
+import asyncio
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+httpx = pytest.importorskip("httpx")
+
+from fastapi import FastAPI
+
+from api import routes
+from db.dependencies import get_db
+
+@pytest.fixture
+def api(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient()["document-reads-test"]
+    store = routes.live_documents
+    monkeypatch.setattr(store, "journal", None)
+    store.history.start(db.document_ops, db.document_snapshots)
+    app = FastAPI()
+    app.include_router(routes.router, prefix="/api")
+    app.dependency_overrides[get_db] = lambda: db
+
+    async def scenario(body):
+        await store.start(db.documents)
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                await body(client, store, db)
+        finally:
+            await store.stop()
+            store._states.clear()
+
+    return lambda body: asyncio.run(scenario(body))
+
+def test_get_of_missing_document_does_not_create_it(api):
+    async def body(client, store, db):
+        response = await client.get("/api/documents/typo")
+        assert response.status_code == 404
+        assert await db.documents.count_documents({}) == 0
+        assert store.get("typo") is None
+
+    api(body)
+
+def test_create_is_idempotent(api):
+    async def body(client, store, db):
+        responses = await asyncio.gather(*(client.put("/api/documents/new") for _ in range(5)))
+        assert sorted(r.status_code for r in responses) == [200, 200, 200, 200, 201]
+        assert await db.documents.count_documents({"doc_id": "new"}) == 1
+        await store.write("new", "kept")
+        again = await client.put("/api/documents/new")
+        assert again.status_code == 200 and again.json() == {"content": "kept", "rev": 1}
+        assert (await client.get("/api/documents/new")).json()["content"] == "kept"
+
+    api(body)
+
+def test_create_after_open_inserts_the_row(api):
+    async def body(client, store, db):
+        # A websocket session caches the document without writing a row
+        await store.open("opened")
+        assert await db.documents.count_documents({"doc_id": "opened"}) == 0
+        response = await client.put("/api/documents/opened")
+        assert response.status_code == 201
+        assert await db.documents.count_documents({"doc_id": "opened"}) == 1
+        assert (await client.put("/api/documents/opened")).status_code == 200
+        store.close("opened")
+
+    api(body)
+
+def test_batch_get(api):
+    async def body(client, store, db):
+        await db.documents.insert_many([
+            {"doc_id": f"d{i}", "content": f"text {i}", "revision": i} for i in range(3)
+        ])
+        # Cached and dirty: must come from memory, not the stale database row
+        await store.write("d1", "fresh")
+        response = await client.post(
+            "/api/documents:batchGet", json={"doc_ids": ["d2", "nope", "d1", "d0", "d2"]}
+        )
+        assert response.json() == {
+            "documents": [
+                {"doc_id": "d2", "rev": 2, "content": "text 2"},
+                {"doc_id": "d1", "rev": 2, "content": "fresh"},
+                {"doc_id": "d0", "rev": 0, "content": "text 0"},
+            ],
+            "missing": ["nope"],
+        }
+        # Listing pages don't fill the cache
+        assert store.get("d0") is None and store.get("d2") is None
+        revisions = await client.post(
+            "/api/documents:batchGet", json={"doc_ids": ["d0"], "include_content": False}
+        )
+        assert revisions.json()["documents"] == [{"doc_id": "d0", "rev": 0}]
+        too_many = await client.post(
+            "/api/documents:batchGet",
+            json={"doc_ids": [str(i) for i in range(routes.BATCH_GET_MAX_DOCUMENTS + 1)]}
+        )
+        assert too_many.status_code == 422
+
+    api(body)
+
+def test_large_bodies_are_streamed(api, monkeypatch):
+    monkeypatch.setattr(routes, "DOC_STREAM_MIN_CHARS", 1000)
+    monkeypatch.setattr(routes, "STREAM_PIECE_CHARS", 100)
+
+    async def body(client, store, db):
+        content = 'quote " slash \\ é ' * 200
+        await store.write("big", content)
+        response = await client.get("/api/documents/big")
+        assert "content-length" not in response.headers
+        assert response.headers["etag"] == 'W/"r1"' and response.headers["vary"] == "Accept-Encoding"
+        assert response.json() == {"content": content, "rev": 1}
+        raw = await client.get("/api/documents/big/content")
+        assert raw.text == content and raw.headers["content-type"].startswith("text/plain")
+        # Same revision, different representation: only a weak validator may be shared
+        assert raw.headers["etag"] == response.headers["etag"]
+
+    api(body)
+
+def test_streamed_upload(api, monkeypatch):
+    monkeypatch.setattr(routes, "DOC_UPLOAD_MAX_BYTES", 1000)
+
+    async def body(client, store, db):
+        data = "naïve café ".encode() * 50
+
+        async def pieces():
+            # Split mid-character to exercise the incremental decoder
+            for start in range(0, len(data), 7):
+                yield data[start:start + 7]
+
+        response = await client.put("/api/documents/up/content", content=pieces())
+        assert response.status_code == 200 and response.json()["rev"] == 1
+        assert store.get("up").content == data.decode()
+        too_big = await client.put("/api/documents/up/content", content=b"x" * 1001)
+        assert too_big.status_code == 413
+        assert (await client.put("/api/documents/up/content", content=b"\xff")).status_code == 400
+
+    api(body)
+
+def test_listing_pages_through_owned_and_shared_documents(api):
+    from auth.jwt_handler import create_access_token
+
+    ann = {"Authorization": "Bearer " + create_access_token({"sub": "ann"})}
+    bo = {"Authorization": "Bearer " + create_access_token({"sub": "bo"})}
+
+    async def body(client, store, db):
+        for i in range(5):
+            assert (await client.put(f"/api/documents/a{i}", headers=ann)).status_code == 201
+            await client.post(f"/api/documents/a{i}", json={"content": f"\n  Title {i}\nbody"}, headers=ann)
+        await client.post("/api/documents/a2", json={"content": "Edited by bo"}, headers=bo)
+        await client.post("/api/documents/anonymous", json={"content": "nobody's"})
+        # One flush stamps them all with the same updated_at; _id breaks the tie
+        await store.flush()
+
+        async def pages(headers, **params):
+            listed, cursor = [], None
+            while True:
+                query = dict(params, limit=2, **({"cursor": cursor} if cursor else {}))
+                response = await client.get("/api/documents", params=query, headers=headers)
+                assert response.status_code == 200
+                page = response.json()
+                listed.append([document["doc_id"] for document in page["documents"]])
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    return listed, page
+
+        listed, _ = await pages(ann)
+        assert listed == [["a4", "a3"], ["a2", "a1"], ["a0"]]
+        listed, last = await pages(bo)
+        assert listed == [["a2"]]
+        assert {k: v for k, v in last["documents"][0].items() if k != "updated_at"} == {
+            "doc_id": "a2", "title": "Edited by bo", "size": 12, "owner": "ann", "rev": 2
+        }
+        assert (await pages(bo, owned="true"))[0] == [[]]
+        assert (await client.get("/api/documents")).status_code == 401
+        assert (await client.get("/api/documents", params={"cursor": "junk"}, headers=ann)).status_code == 422
+        row = await db.documents.find_one({"doc_id": "a0"})
+        assert (row["title"], row["owner"], "collaborators" in row) == ("Title 0", "ann", False)
+
+    api(body)
+
+def test_create_claims_a_document_opened_before_it(api):
+    from auth.jwt_handler import create_access_token
+
+    ann = {"Authorization": "Bearer " + create_access_token({"sub": "ann"})}
+
+    async def body(client, store, db):
+        # Opened anonymously, then flushed without an owner
+        await store.open("early")
+        await store.write("early", "Early notes")
+        await store.flush()
+        assert "owner" not in await db.documents.find_one({"doc_id": "early"})
+        assert (await client.put("/api/documents/early", headers=ann)).status_code == 200
+        await store.write("early", "Early notes, edited")
+        await store.flush()
+        listed = (await client.get("/api/documents", headers=ann)).json()["documents"]
+        assert [(row["doc_id"], row["owner"]) for row in listed] == [("early", "ann")]
+        store.close("early")
+
+    api(body)
@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+httpx = pytest.importorskip("httpx")
+
+from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
+
+from api import routes
+from collab.ot import TextOperation
+from db.dependencies import get_db
+
+@pytest.fixture
+def api(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient()["http-cache-test"]
+    store = routes.live_documents
+    monkeypatch.setattr(store, "journal", None)
+    store.history.start(db.document_ops, db.document_snapshots)
+    app = FastAPI()
+    app.add_middleware(GZipMiddleware, minimum_size=1024)
+    app.include_router(routes.router, prefix="/api")
+    app.dependency_overrides[get_db] = lambda: db
+
+    async def scenario(body):
+        await store.start(db.documents)
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                await body(client, store, db)
+        finally:
+            await store.stop()
+            store._states.clear()
+
+    return lambda body: asyncio.run(scenario(body))
+
+def test_unchanged_document_is_not_modified(api):
+    async def body(client, store, db):
+        await db.documents.insert_one({"doc_id": "a", "content": "hello", "revision": 3})
+        first = await client.get("/api/documents/a")
+        assert first.json() == {"content": "hello", "rev": 3}
+        etag = first.headers["etag"]
+        assert etag == 'W/"r3"' and first.headers["vary"] == "Accept-Encoding"
+        store._states.clear()
+        again = await client.get("/api/documents/a", headers={"If-None-Match": etag})
+        assert again.status_code == 304 and again.content == b""
+        assert again.headers["etag"] == etag and again.headers["vary"] == "Accept-Encoding"
+        # Compared weakly, so a client that dropped the W/ still matches
+        strong = await client.get("/api/documents/a", headers={"If-None-Match": '"r3"'})
+        assert strong.status_code == 304
+        # Answered from the revision alone
+        assert store.get("a") is None
+        await store.write("a", "changed")
+        changed = await client.get("/api/documents/a", headers={"If-None-Match": etag})
+        assert changed.status_code == 200 and changed.json()["rev"] == 4
+
+    api(body)
+
+def test_diff_since_revision(api):
+    async def body(client, store, db):
+        state = await store.open("b")
+        for char in "abc":
+            state.apply_client_op(state.revision, TextOperation().retain(len(state.content)).insert(char))
+        diff = (await client.get("/api/documents/b/diff", params={"since": 1})).json()
+        assert diff["type"] == "diff" and diff["rev"] == 3
+        assert TextOperation.from_json(diff["ops"]).apply("a") == "abc"
+        state.replace_content("reset")
+        fallback = (await client.get("/api/documents/b/diff", params={"since": 1})).json()
+        assert fallback == {"type": "snapshot", "rev": 4, "content": "reset"}
+        store.close("b")
+
+    api(body)
+
+def test_large_bodies_are_gzipped(api):
+    async def body(client, store, db):
+        await store.write("c", "lorem ipsum " * 5000)
+        response = await client.get("/api/documents/c", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert int(response.headers["content-length"]) < 5000
+
+    api(body)
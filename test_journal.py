@@ -0,0 +1,132 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from collab.journal import Journal, read_segment
+from collab.ot import TextOperation
+from collab.store import DocumentStore
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_appends_are_group_committed_and_released_after_flush(tmp_path):
+    async def scenario():
+        collection = mongomock_motor.AsyncMongoMockClient()["journal-test"].documents
+        journal = Journal(str(tmp_path), segment_bytes=1 << 16, commit_interval_ms=5)
+        store = DocumentStore(flush_interval_ms=60000, journal=journal)
+        await store.start(collection)
+        state = await store.open("a")
+        barriers = []
+        for i in range(20):
+            state.apply_client_op(state.revision, TextOperation().retain(i).insert("x"))
+            barriers.append(store.changed(state))
+        assert store.barrier() is barriers[-1]
+        await asyncio.gather(*barriers)
+        assert store.barrier() is None
+        metrics = journal.metrics()
+        assert metrics["appends"] == 20 and metrics["commits"] <= 2
+        [segment] = os.listdir(tmp_path)
+        records = read_segment(os.path.join(tmp_path, segment))
+        assert [r["r"] for r in records] == list(range(1, 21))
+        await store.flush()
+        # The active segment is rewound for reuse rather than deleted
+        assert os.listdir(tmp_path) == [segment]
+        assert read_segment(os.path.join(tmp_path, segment)) == []
+        state.apply_client_op(state.revision, TextOperation().retain(20).insert("y"))
+        await store.changed(state)
+        assert [r["r"] for r in read_segment(os.path.join(tmp_path, segment))] == [21]
+        await store.stop()
+
+    run(scenario())
+
+def test_sealed_segments_are_deleted_and_the_active_one_reused(tmp_path):
+    async def scenario():
+        journal = Journal(str(tmp_path), segment_bytes=4096, commit_interval_ms=0)
+        await journal.start()
+        for revision in range(1, 101):
+            await journal.append("a", revision, content="x" * 100)
+        files = sorted(os.listdir(tmp_path))
+        assert len(files) > 2
+        # Only segments holding nothing past revision 50 can go
+        early = journal.checkpoint(lambda doc_id: 50)
+        assert 0 < early < len(files) - 1 and journal.metrics()["segments_rewound"] == 0
+        assert journal.checkpoint(lambda doc_id: 100) == len(files) - 1 - early
+        assert os.listdir(tmp_path) == files[-1:]
+        assert journal.metrics()["segments_rewound"] == 1
+        await journal.append("a", 101, content="short")
+        await journal.append("a", 102, content="short")
+        # Longer records from before the rewind are behind the end marker
+        assert [r["r"] for r in read_segment(os.path.join(tmp_path, files[-1]))] == [101, 102]
+        assert len(os.listdir(tmp_path)) == 1
+        await journal.stop()
+
+    run(scenario())
+
+def test_torn_tail_is_ignored(tmp_path):
+    async def scenario():
+        journal = Journal(str(tmp_path), segment_bytes=4096, commit_interval_ms=0)
+        await journal.start()
+        await journal.append("a", 1, ops=["x"])
+        await journal.append("a", 2, content="hello")
+        segment = journal._segments[-1]
+        # Corrupt the last payload byte as if the crash hit mid-write
+        segment.map[segment.offset - 1] ^= 0xFF
+        records = read_segment(segment.path)
+        assert records == [{"d": "a", "r": 1, "o": ["x"]}]
+        await journal.stop()
+
+    run(scenario())
+
+CHILD = textwrap.dedent("""
+    import asyncio, os, signal, sys
+    import mongomock_motor
+    from collab.journal import Journal
+    from collab.ot import TextOperation
+    from collab.store import DocumentStore
+
+    async def main():
+        collection = mongomock_motor.AsyncMongoMockClient()["journal-test"].documents
+        store = DocumentStore(flush_interval_ms=60000, journal=Journal(sys.argv[1]))
+        await store.start(collection)
+        state = await store.open("doc")
+        for char in "durable":
+            state.apply_client_op(state.revision, TextOperation().retain(len(state.content)).insert(char))
+            store.changed(state)
+        state.replace_content("replaced")
+        store.changed(state)
+        state.apply_client_op(state.revision, TextOperation().retain(8).insert("!"))
+        await store.changed(state)
+        print("acked", flush=True)
+        os.kill(os.getpid(), signal.SIGKILL)
+
+    asyncio.run(main())
+""")
+
+def test_recovery_after_kill_9(tmp_path):
+    directory = str(tmp_path / "journal")
+    root = os.path.dirname(os.path.abspath(__file__))
+    child = subprocess.run(
+        [sys.executable, "-c", CHILD, directory], cwd=root, capture_output=True, text=True,
+        env={**os.environ, "PYTHONPATH": root}, timeout=60
+    )
+    assert child.returncode == -signal.SIGKILL
+    assert "acked" in child.stdout
+
+    async def scenario():
+        collection = mongomock_motor.AsyncMongoMockClient()["journal-test"].documents
+        store = DocumentStore(flush_interval_ms=60000, journal=Journal(directory))
+        await store.start(collection)
+        saved = await collection.find_one({"doc_id": "doc"})
+        assert saved["content"] == "replaced!" and saved["revision"] == 9
+        # Recovered segments are gone once the replay is flushed
+        assert store.journal.metrics()["recovered_records"] == 9
+        assert [n for n in os.listdir(directory) if n.endswith(".wal")] == []
+        await store.stop()
+
+    run(scenario())
@@ -0,0 +1,68 @@
+import time
+import pytest
+from fastapi import FastAPI, WebSocket
+from fastapi.testclient import TestClient
+from jose import JWTError
+from starlette.websockets import WebSocketDisconnect
+
+from auth.jwt_handler import (
+    REFRESH, TokenCache, authenticate_websocket, create_access_token,
+    create_refresh_token, verify_token
+)
+
+def test_cache_skips_decoding_repeat_tokens(monkeypatch):
+    cache = TokenCache()
+    token = create_access_token({"sub": "alice"})
+    assert verify_token(token, cache=cache)["sub"] == "alice"
+    import auth.jwt_handler as jwt_handler
+    monkeypatch.setattr(jwt_handler.jwt, "decode", lambda *a, **k: pytest.fail("decoded again"))
+    assert verify_token(token, cache=cache)["sub"] == "alice"
+    assert cache.metrics()["hits"] == 1
+
+def test_cache_entries_expire_and_are_bounded():
+    cache = TokenCache(ttl=300, max_entries=2)
+    cache.put("expired", {"sub": "a", "exp": time.time() - 1})
+    assert cache.get("expired") is None
+    for name in ("a", "b", "c"):
+        cache.put(name, {"sub": name})
+    assert cache.get("a") is None and cache.get("c") == {"sub": "c"}
+    assert cache.metrics()["evictions"] == 1
+
+def test_token_types_are_not_interchangeable():
+    cache = TokenCache()
+    refresh = create_refresh_token({"sub": "alice"})
+    with pytest.raises(JWTError):
+        verify_token(refresh, cache=cache)
+    assert verify_token(refresh, REFRESH, cache=cache)["sub"] == "alice"
+    with pytest.raises(JWTError):
+        verify_token(create_access_token({"sub": "alice"}), REFRESH, cache=cache)
+    with pytest.raises(JWTError):
+        verify_token("not-a-token", cache=cache)
+
+def make_app():
+    app = FastAPI()
+
+    @app.websocket("/ws")
+    async def endpoint(websocket: WebSocket):
+        user, subprotocol = authenticate_websocket(websocket)
+        if user is None:
+            await websocket.close(code=1008)
+            return
+        await websocket.accept(subprotocol=subprotocol)
+        await websocket.send_json({"user": user})
+        await websocket.close()
+
+    return TestClient(app)
+
+def test_websocket_handshake_token():
+    client = make_app()
+    token = create_access_token({"sub": "alice"})
+    with client.websocket_connect(f"/ws?token={token}") as ws:
+        assert ws.receive_json() == {"user": "alice"}
+    with client.websocket_connect("/ws", subprotocols=["bearer", token]) as ws:
+        assert ws.accepted_subprotocol == "bearer"
+        assert ws.receive_json() == {"user": "alice"}
+    for url in ("/ws", "/ws?token=bogus"):
+        with pytest.raises(WebSocketDisconnect):
+            with client.websocket_connect(url):
+                pass
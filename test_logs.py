@@ -0,0 +1,74 @@
+import io
+import json
+import logging
+import queue
+import threading
+
+from telemetry.logs import LogQueueHandler, StructuredFormatter, configure_logging, redact, stop_logging
+
+class RenderedIn:
+    """Remembers which thread turned it into a string"""
+    def __init__(self):
+        self.thread = None
+
+    def __str__(self):
+        self.thread = threading.current_thread().name
+        return "rendered"
+
+def test_records_are_formatted_by_the_listener_thread():
+    stream = io.StringIO()
+    configure_logging("INFO", stream=stream)
+    try:
+        logger = logging.getLogger("test.logs")
+        arg = RenderedIn()
+        logger.info("value %s", arg)
+        logger.debug("not %s", "enabled")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("Failed", extra={"event": "x.failed", "doc_id": "d"})
+    finally:
+        stop_logging()
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line["msg"] for line in lines] == ["value rendered", "Failed"]
+    assert arg.thread != threading.current_thread().name
+    assert lines[1]["doc_id"] == "d" and "ValueError: boom" in lines[1]["exc"]
+
+def test_secrets_and_bulk_are_redacted():
+    formatter = StructuredFormatter(max_field_chars=20)
+    record = logging.LogRecord("t", logging.INFO, "", 0, "Saved", None, None)
+    record.content = "x" * 5000
+    record.headers = {"Authorization": "Bearer abc", "Origin": "https://example.com/" + "a" * 50}
+    record.note = "y" * 30
+    line = json.loads(formatter.format(record))
+    assert line["content"] == "<redacted 5000 chars>"
+    assert line["headers"]["Authorization"] == "<redacted 10 chars>"
+    assert line["headers"]["Origin"].endswith("<70 chars>")
+    assert line["note"] == "y" * 20 + "... <30 chars>"
+    assert redact("password", 12345) == "<redacted>"
+
+def test_query_string_tokens_are_masked_in_messages():
+    formatter = StructuredFormatter(json_lines=False)
+    # How uvicorn logs an accepted websocket handshake
+    record = logging.LogRecord("uvicorn.error", logging.INFO, "", 0, '%s - "WebSocket %s" [accepted]',
+                               ("127.0.0.1:5000", "/ws/doc-1?codec=json&token=eyJhbGciOi.eyJzdWIi.c2ln&since=4"), None)
+    line = formatter.format(record)
+    assert "eyJ" not in line
+    assert '/ws/doc-1?codec=json&token=<redacted>&since=4" [accepted]' in line
+
+def test_sampling_and_a_full_queue_drop_records():
+    records = queue.SimpleQueue()
+    handler = LogQueueHandler(records, 3, {"ws.op_rejected": 10})
+    logger = logging.getLogger("test.logs.sampling")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for _ in range(25):
+            logger.info("Rejected op", extra={"event": "ws.op_rejected"})
+        assert handler.stats["queued"] == 3 and handler.stats["dropped_sampled"] == 22
+        assert records.get_nowait().sampled == 10
+        logger.info("Other")
+        logger.info("Other")
+        assert handler.stats["dropped_full"] == 1
+    finally:
+        logger.removeHandler(handler)
@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+
+from telemetry.metrics import MetricsMiddleware, Registry, http_request_seconds, http_responses
+
+def test_render_prometheus_text():
+    registry = Registry()
+    requests = registry.counter("app_requests", "Requests", ("route",))
+    latency = registry.histogram("app_seconds", "Latency", buckets=(0.1, 1.0))
+    registry.collect("app_open", "Open things", lambda: [({"doc": 'a"b'}, 2)])
+    registry.collect("app_per_doc", "Things per doc", lambda: [1, 3, 12], kind="histogram", buckets=(1, 10))
+    child = requests.labels("/x")
+    assert requests.labels("/x") is child
+    child.inc()
+    child.inc(2)
+    bound = latency.labels()
+    for value in (0.05, 0.1, 0.5, 3.0):
+        bound.observe(value)
+    with pytest.raises(ValueError):
+        requests.labels()
+    assert registry.render().splitlines() == [
+        "# HELP app_requests Requests",
+        "# TYPE app_requests counter",
+        'app_requests_total{route="/x"} 3',
+        "# HELP app_seconds Latency",
+        "# TYPE app_seconds histogram",
+        'app_seconds_bucket{le="0.1"} 2',
+        'app_seconds_bucket{le="1.0"} 3',
+        'app_seconds_bucket{le="+Inf"} 4',
+        "app_seconds_count 4",
+        "app_seconds_sum 3.65",
+        "# HELP app_open Open things",
+        "# TYPE app_open gauge",
+        'app_open{doc="a\\"b"} 2',
+        "# HELP app_per_doc Things per doc",
+        "# TYPE app_per_doc histogram",
+        'app_per_doc_bucket{le="1.0"} 1',
+        'app_per_doc_bucket{le="10.0"} 2',
+        'app_per_doc_bucket{le="+Inf"} 3',
+        "app_per_doc_count 3",
+        "app_per_doc_sum 16.0",
+    ]
+
+def test_middleware_labels_by_route_template():
+    httpx = pytest.importorskip("httpx")
+    from fastapi import FastAPI, HTTPException
+
+    app = FastAPI()
+
+    @app.get("/api/things/{thing_id}")
+    async def thing(thing_id: str):
+        if thing_id == "missing":
+            raise HTTPException(status_code=404)
+        return {}
+
+    app.add_middleware(MetricsMiddleware)
+    route = "/api/things/{thing_id}"
+    before = sum(http_request_seconds.labels("GET", route).counts)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for thing_id in ("a", "b", "missing"):
+                await client.get(f"/api/things/{thing_id}")
+            await client.get("/nowhere")
+
+    asyncio.run(scenario())
+    assert sum(http_request_seconds.labels("GET", route).counts) - before == 3
+    assert http_responses.labels("GET", route, 404).value >= 1
+    assert http_responses.labels("GET", "unmatched", 404).value >= 1
+
+def test_mongo_listeners_feed_metrics():
+    from types import SimpleNamespace
+    from db.mongo import CommandTimer, PoolGauge
+    from telemetry.metrics import mongo_command_failures, mongo_command_seconds, mongo_pool_connections
+
+    timer, pool = CommandTimer(), PoolGauge()
+    histogram = mongo_command_seconds.labels("find")
+    before = sum(histogram.counts)
+    timer.succeeded(SimpleNamespace(command_name="find", duration_micros=1500))
+    timer.failed(SimpleNamespace(command_name="find", duration_micros=500))
+    assert sum(histogram.counts) - before == 2
+    assert mongo_command_failures.labels("find").value >= 1
+    in_use = mongo_pool_connections.labels("in_use")
+    before = in_use.value
+    pool.connection_checked_out(None)
+    pool.connection_checked_out(None)
+    pool.connection_checked_in(None)
+    assert in_use.value - before == 1
@@ -1,5 +1,6 @@
 import asyncio
-from db.mongo import get_db
+from config import MONGO_DB_NAME
+from db.mongo import get_client
 import datetime
 import logging
 
@@ -8,7 +9,8 @@ logger = logging.getLogger(__name__)
 
 async def test_document_operations():
     try:
-        db = get_db()
+        # get_db() is a FastAPI dependency; outside a request use the client directly
+        db = get_client()[MONGO_DB_NAME]
         test_id = "direct-test-doc"
         
         # Test insert
@@ -0,0 +1,116 @@
+import pytest
+
+hypothesis = pytest.importorskip("hypothesis")
+from hypothesis import given, strategies as st
+
+from collab.document import DocumentState, StaleRevisionError
+from collab.ot import OTError, TextOperation, transform
+
+texts = st.text(alphabet="abcxyz \n", max_size=40)
+
+@st.composite
+def doc_and_op(draw, doc=None):
+    if doc is None:
+        doc = draw(texts)
+    op = TextOperation()
+    index = 0
+    while index < len(doc):
+        n = draw(st.integers(min_value=1, max_value=len(doc) - index))
+        kind = draw(st.sampled_from(["retain", "delete", "insert"]))
+        if kind == "insert":
+            op.insert(draw(st.text(alphabet="PQR", min_size=1, max_size=5)))
+        elif kind == "delete":
+            op.delete(n)
+            index += n
+        else:
+            op.retain(n)
+            index += n
+    if draw(st.booleans()):
+        op.insert(draw(st.text(alphabet="PQR", min_size=1, max_size=5)))
+    return doc, op
+
+@st.composite
+def concurrent_ops(draw):
+    doc, a = draw(doc_and_op())
+    _, b = draw(doc_and_op(doc))
+    return doc, a, b
+
+@given(concurrent_ops())
+def test_transform_converges(case):
+    doc, a, b = case
+    a_prime, b_prime = transform(a, b)
+    assert b_prime.apply(a.apply(doc)) == a_prime.apply(b.apply(doc))
+
+@given(st.data())
+def test_compose_matches_sequential_apply(data):
+    doc, a = data.draw(doc_and_op())
+    _, b = data.draw(doc_and_op(a.apply(doc)))
+    assert a.compose(b).apply(doc) == b.apply(a.apply(doc))
+
+@given(st.data())
+def test_json_round_trip(data):
+    doc, op = data.draw(doc_and_op())
+    assert TextOperation.from_json(op.to_json()).apply(doc) == op.apply(doc)
+
+@given(st.data())
+def test_server_keeps_every_concurrent_insert(data):
+    doc = data.draw(texts)
+    state = DocumentState("d", doc)
+    inserts = data.draw(st.lists(st.text(alphabet="PQR", min_size=1, max_size=3), max_size=6))
+    for text in inserts:
+        pos = data.draw(st.integers(min_value=0, max_value=len(doc)))
+        # Every client edited revision 0 without seeing anyone else
+        state.apply_client_op(0, TextOperation.from_edit(len(doc), pos, text=text))
+    assert state.revision == len(inserts)
+    assert len(state.content) == len(doc) + sum(map(len, inserts))
+
+def test_insert_tie_puts_history_first():
+    state = DocumentState("d", "ab")
+    state.apply_client_op(0, TextOperation.from_edit(2, 1, text="X"))
+    state.apply_client_op(0, TextOperation.from_edit(2, 1, text="Y"))
+    assert state.content == "aXYb"
+
+def test_overlapping_deletes():
+    state = DocumentState("d", "abcdef")
+    state.apply_client_op(0, TextOperation.from_edit(6, 1, delete=3))
+    state.apply_client_op(0, TextOperation.from_edit(6, 2, delete=3))
+    assert state.content == "af"
+
+def test_rejects_bad_ops():
+    state = DocumentState("d", "abc", history_limit=2)
+    with pytest.raises(OTError):
+        state.apply_client_op(0, TextOperation.from_json([5]))
+    with pytest.raises(OTError):
+        TextOperation.from_json([1.5])
+    for _ in range(3):
+        state.apply_client_op(state.revision, TextOperation().retain(len(state.content)).insert("x"))
+    with pytest.raises(StaleRevisionError):
+        state.apply_client_op(0, TextOperation().retain(3))
+
+def test_missed_ops_replay_onto_an_old_copy():
+    state = DocumentState("d", "", history_limit=5)
+    copies = {0: ""}
+    for char in "abcdefg":
+        state.apply_client_op(state.revision, TextOperation().retain(len(state.content)).insert(char))
+        copies[state.revision] = state.content
+    assert state.ops_since(1) is None
+    assert state.ops_since(state.revision) == []
+    for since in range(2, 8):
+        content = copies[since]
+        for revision, op in state.ops_since(since):
+            content = op.apply(content)
+            assert content == copies[revision]
+    state.replace_content("new")
+    assert state.ops_since(7) is None
+
+def test_backfilled_history_accepts_older_base_revisions():
+    live = DocumentState("d", "", history_limit=10)
+    for char in "abc":
+        live.apply_client_op(live.revision, TextOperation().retain(len(live.content)).insert(char))
+    # Reloaded after a restart: content and revision, but no ops in memory
+    state = DocumentState("d", live.content, live.revision, history_limit=10)
+    assert not state.backfill_history([(2, live.history[1])])
+    assert state.backfill_history([(2, live.history[1]), (3, live.history[2])])
+    assert state.oldest_revision == 1
+    state.apply_client_op(1, TextOperation().insert("X").retain(1))
+    assert state.content == "Xabc"
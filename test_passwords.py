@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+
+pytest.importorskip("passlib")
+
+from auth.passwords import HasherBusyError, PasswordHasher
+
+def test_hash_and_verify():
+    async def scenario():
+        hasher = PasswordHasher(rounds=4, workers=2)
+        hashed = await hasher.hash("secret")
+        assert await hasher.verify("secret", hashed) == (True, None)
+        assert (await hasher.verify("wrong", hashed))[0] is False
+        assert hasher.metrics()["completed"] == 3
+        hasher.stop()
+
+    asyncio.run(scenario())
+
+def test_outdated_cost_is_rehashed_on_login():
+    async def scenario():
+        old = PasswordHasher(rounds=4)
+        hashed = await old.hash("secret")
+        new = PasswordHasher(rounds=5)
+        valid, new_hash = await new.verify("secret", hashed)
+        assert valid and new_hash is not None and new_hash != hashed
+        assert await new.verify("secret", new_hash) == (True, None)
+        disabled = PasswordHasher(rounds=5, rehash_on_login=False)
+        assert await disabled.verify("secret", hashed) == (True, None)
+        for hasher in (old, new, disabled):
+            hasher.stop()
+
+    asyncio.run(scenario())
+
+def test_event_loop_keeps_running_while_hashing():
+    async def scenario():
+        hasher = PasswordHasher(rounds=10, workers=2)
+        hasher.start()
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await asyncio.gather(*(hasher.hash("secret") for _ in range(4)))
+        task.cancel()
+        assert ticks > 5
+        hasher.stop()
+
+    asyncio.run(scenario())
+
+def test_full_queue_rejects():
+    async def scenario():
+        hasher = PasswordHasher(rounds=8, workers=1, max_queue=1)
+        results = await asyncio.gather(
+            *(hasher.hash("secret") for _ in range(4)), return_exceptions=True
+        )
+        rejected = [r for r in results if isinstance(r, HasherBusyError)]
+        assert len(rejected) == 2
+        assert hasher.metrics()["rejected"] == 2
+        hasher.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+from api.presence import PresenceTracker
+from api.websocket import ConnectionManager, handle_message
+from collab.document import DocumentState
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message):
+        self.sent.append(json.loads(message))
+
+    async def close(self, code=1000):
+        pass
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0.01)
+
+def test_updates_are_coalesced_per_session():
+    tracker = PresenceTracker()
+    tracker.join("doc", "a", "alice")
+    tracker.join("doc", "b", "bob")
+    tracker.drain()
+    for position in range(50):
+        tracker.update("doc", "a", position, None)
+    tracker.update("doc", "b", 3, [1, 3])
+    delta = tracker.drain()["doc"]
+    assert sorted((m["sid"], m["cursor"]) for m in delta["members"]) == [("a", 49), ("b", 3)]
+    assert tracker.stats["coalesced"] == 49
+    assert tracker.drain() == {}
+    # Joined and left within one tick: not worth a message
+    tracker.join("doc", "c", "carol")
+    tracker.leave("doc", "c")
+    tracker.leave("doc", "b")
+    assert tracker.drain()["doc"] == {"type": "presence", "members": [], "left": ["b"]}
+    assert not tracker.update("doc", "b", 1, None)
+
+def test_presence_is_sent_per_tick_to_clients_that_asked():
+    async def scenario():
+        manager = ConnectionManager()
+        alice, bob, legacy = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await manager.connect(alice, "doc", user="alice", presence=True)
+        await manager.connect(legacy, "doc", user="old")
+        await manager.flush_presence()
+        await manager.connect(bob, "doc", user="bob", presence=True)
+        manager.send_presence(bob, "doc")
+        await settle()
+        snapshot = bob.sent[-1]
+        assert snapshot["type"] == "presence"
+        assert sorted(m["user"] for m in snapshot["members"]) == ["alice", "bob", "old"]
+        own_sid = snapshot["sid"]
+        await manager.flush_presence()
+        state = DocumentState("doc")
+        for position in range(100):
+            await handle_message(alice, manager, state, {"type": "cursor", "cursor": position, "selection": [2, 5]})
+        await handle_message(alice, manager, state, {"type": "cursor", "cursor": "bogus"})
+        await manager.flush_presence()
+        await settle()
+        cursor_deltas = [m for m in bob.sent if m["type"] == "presence" and "sid" not in m and m["members"]
+                         and m["members"][0]["user"] == "alice"]
+        assert len(cursor_deltas) == 1
+        assert cursor_deltas[0]["members"][0]["cursor"] is None
+        assert legacy.sent == []
+        await manager.disconnect(bob, "doc")
+        await manager.flush_presence()
+        await settle()
+        assert alice.sent[-1]["left"] == [own_sid]
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+def test_backed_up_client_gets_a_snapshot_instead_of_deltas():
+    async def scenario():
+        manager = ConnectionManager(queue_size=4)
+        busy, mover = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(busy, "doc", presence=True)
+        await manager.connect(mover, "doc", presence=True)
+        connection = manager.active_connections["doc"][busy]
+        connection.sender.cancel()
+        connection.queue.extend([("x", 0.0, None)] * 2)
+        manager.update_presence(mover, "doc", {"cursor": 7})
+        await manager.flush_presence()
+        assert connection.presence_behind and len(connection.queue) == 2
+        connection.queue.clear()
+        manager.update_presence(mover, "doc", {"cursor": 8})
+        await manager.flush_presence()
+        frame = connection.queue[-1][0]
+        assert len(frame.message["members"]) == 2 and "left" not in frame.message
+        await manager.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,129 @@
+import asyncio
+import pytest
+
+from api import websocket as ws_module
+from api.ratelimit import (
+    AdmissionControl, LoopMonitor, MessageLimits, Rate, RateLimitExceeded, RateLimiter, RouteLimits,
+    acquire, parse_rate, parse_routes
+)
+from api.websocket import Connection
+
+def test_bucket_allows_a_burst_then_refills():
+    limiter = RateLimiter(Rate(3, 3.0))
+    assert [limiter.hit("a", 100.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.hit("a", 100.0) == pytest.approx(1.0)
+    # Other keys have their own bucket
+    assert limiter.hit("b", 100.0) == 0.0
+    assert limiter.hit("a", 101.0) == 0.0
+    assert limiter.hit("a", 101.0) == pytest.approx(1.0)
+    assert limiter.stats["allowed"] == 5 and limiter.stats["limited"] == 2
+
+def test_refilled_buckets_are_swept():
+    limiter = RateLimiter(Rate(1, 1.0), max_keys=10)
+    for i in range(9):
+        limiter.hit(str(i), 0.0)
+    limiter.hit("late", 5.0)
+    assert limiter.metrics()["keys"] == 1 and limiter.stats["swept"] == 9
+
+def test_acquire_is_all_or_nothing():
+    generous, strict = RateLimiter(Rate(10, 1.0)), RateLimiter(Rate(1, 1.0))
+    assert acquire([(generous, "k"), (strict, "k")], 0.0) == 0.0
+    assert acquire([(generous, "k"), (strict, "k")], 0.0) == pytest.approx(1.0)
+    # The refused request didn't use up the generous limit
+    assert generous.stats["allowed"] == 1
+
+def test_parse():
+    assert parse_rate("10/60") == Rate(10, 60.0)
+    assert parse_rate("") is None and parse_rate("0") is None
+    with pytest.raises(ValueError):
+        parse_rate("-1/5")
+    assert parse_routes("post /api/auth/login=5/60, PUT /api/documents/*=0") == {
+        "POST /api/auth/login": Rate(5, 60.0)
+    }
+
+def test_middleware_answers_429_per_client():
+    httpx = pytest.importorskip("httpx")
+    from fastapi import FastAPI
+    from api.ratelimit import RateLimitMiddleware
+    from auth.jwt_handler import create_access_token
+
+    app = FastAPI()
+
+    @app.post("/api/auth/login")
+    async def login():
+        return {}
+
+    @app.get("/api/documents/{doc_id}")
+    async def document(doc_id: str):
+        return {}
+
+    limits = RouteLimits(Rate(5, 60), parse_routes("POST /api/auth/login=2/60"))
+    app.add_middleware(RateLimitMiddleware, limits=limits)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            statuses = [(await client.post("/api/auth/login")).status_code for _ in range(3)]
+            assert statuses == [200, 200, 429]
+            limited = await client.post("/api/auth/login")
+            assert limited.json() == {"detail": "Too many requests"}
+            assert int(limited.headers["retry-after"]) >= 29
+            # The two refused logins didn't count against the overall limit
+            statuses = [(await client.get("/api/documents/d")).status_code for _ in range(4)]
+            assert statuses == [200, 200, 200, 429]
+            # A signed-in user has a budget of their own
+            headers = {"Authorization": f"Bearer {create_access_token({'sub': 'alice'})}"}
+            assert (await client.get("/api/documents/d", headers=headers)).status_code == 200
+
+    asyncio.run(scenario())
+
+def test_429_carries_cors_headers(monkeypatch):
+    httpx = pytest.importorskip("httpx")
+    import main
+
+    monkeypatch.setattr(main.rest_limits, "default", RateLimiter(Rate(1, 60)))
+    origin = {"Origin": "https://app.example.com"}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.get("/api/limited", headers=origin)
+            limited = await client.get("/api/limited", headers=origin)
+            assert limited.status_code == 429
+            assert limited.headers["access-control-allow-origin"]
+            assert "retry-after" in limited.headers["access-control-expose-headers"].lower()
+
+    asyncio.run(scenario())
+
+def test_websocket_messages_are_delayed_dropped_or_disconnected(monkeypatch):
+    limits = MessageLimits(Rate(2, 0.1), document=Rate(100, 1.0), max_wait=0.2)
+    monkeypatch.setattr(ws_module, "message_limits", limits)
+
+    async def scenario():
+        connection = Connection(None, "doc", user="alice")
+        op = {"type": "op"}
+        assert await ws_module.throttle_message(connection, op)
+        assert await ws_module.throttle_message(connection, op)
+        assert not await ws_module.throttle_message(connection, {"type": "cursor"})
+        started = asyncio.get_running_loop().time()
+        assert await ws_module.throttle_message(connection, op)
+        assert asyncio.get_running_loop().time() - started >= 0.04
+        assert limits.stats["delayed"] == 1 and limits.stats["dropped"] == 1
+        limits.max_wait = 0.0
+        with pytest.raises(RateLimitExceeded):
+            await ws_module.throttle_message(connection, op)
+
+    asyncio.run(scenario())
+
+def test_admission_sheds_on_connections_and_loop_lag():
+    monitor = LoopMonitor()
+    admission = AdmissionControl(monitor, max_connections=10, max_loop_lag=0.2)
+    assert admission.check(9) is None
+    assert "connections" in admission.check(10)
+    monitor.record(0.5)
+    assert "lagging" in admission.check(0)
+    # Recovers gradually once the loop is responsive again
+    for _ in range(10):
+        monitor.record(0.0)
+    assert admission.check(0) is None
+    assert admission.stats == {"admitted": 2, "rejected_connections": 1, "rejected_lag": 1}
@@ -0,0 +1,59 @@
+import random
+import pytest
+
+from collab import rope
+from collab.document import DocumentState
+from collab.ot import OTError, TextOperation
+from collab.rope import Rope
+
+def test_random_edits_match_str(monkeypatch):
+    # Short pieces so edits cross and split them often
+    monkeypatch.setattr(rope, "LEAF_CHARS", 16)
+    rng = random.Random(3)
+    content = "".join(rng.choice("ab\n") for _ in range(300))
+    r = Rope(content)
+    for _ in range(2000):
+        pos = rng.randint(0, len(content))
+        deleted = rng.randint(0, min(30, len(content) - pos)) if rng.random() < 0.4 else 0
+        text = "".join(rng.choice("xy\n") for _ in range(rng.randint(0, 40)))
+        op = TextOperation.from_edit(len(content), pos, deleted, text)
+        content = op.apply(content)
+        r.apply(op)
+        assert len(r) == len(content)
+        if rng.random() < 0.05:
+            assert str(r) == content
+            start = rng.randint(0, len(content))
+            end = rng.randint(start, len(content))
+            assert r.slice(start, end) == content[start:end]
+    assert str(r) == content
+    assert r.line_count == content.count("\n") + 1
+    with pytest.raises(OTError):
+        r.apply(TextOperation().retain(len(content) + 1))
+
+def test_line_col_and_position():
+    text = "first\n\nthird line\nlast"
+    r = Rope(text)
+    for pos in range(len(text) + 1):
+        line = text.count("\n", 0, pos)
+        column = pos - (text.rfind("\n", 0, pos) + 1)
+        assert r.line_col(pos) == (line, column)
+        assert r.position(line, column) == pos
+    assert [r.line_start(line) for line in range(r.line_count)] == [0, 6, 7, 18]
+    with pytest.raises(IndexError):
+        r.position(1, 1)
+    with pytest.raises(IndexError):
+        r.line_col(len(text) + 1)
+
+def test_document_state_switches_to_rope_when_large():
+    state = DocumentState("doc", "a" * 10, rope_min_chars=12)
+    state.apply_client_op(0, TextOperation().retain(10).insert("bb"))
+    assert state._rope is None
+    state.apply_client_op(1, TextOperation().insert("c").retain(12))
+    assert state._rope is not None and state._text is None
+    assert state.length == 13
+    assert state.content == "c" + "a" * 10 + "bb"
+    # A client that missed revision 1 is still transformed against it
+    state.apply_client_op(1, TextOperation().retain(12).insert("d"))
+    assert state.content == "c" + "a" * 10 + "bbd"
+    state.content = "replaced"
+    assert state._rope is None and state.length == 8
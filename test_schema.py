@@ -0,0 +1,34 @@
+import asyncio
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from db.schema import ensure_schema
+
+def test_ensure_schema_is_idempotent():
+    async def run():
+        db = mongomock_motor.AsyncMongoMockClient()["schema-test"]
+        await ensure_schema(db)
+        await ensure_schema(db)
+        assert {"documents", "users"} <= set(await db.list_collection_names())
+        doc_indexes = await db.documents.index_information()
+        assert doc_indexes["doc_id_unique"]["unique"]
+        assert "updated_at_desc" in doc_indexes
+        user_indexes = await db.users.index_information()
+        assert user_indexes["username_unique"]["unique"]
+        for name in ("document_ops", "document_snapshots"):
+            assert (await db[name].index_information())["doc_rev_unique"]["unique"]
+
+    asyncio.run(run())
+
+def test_unique_doc_id_rejects_duplicates():
+    from pymongo.errors import DuplicateKeyError
+
+    async def run():
+        db = mongomock_motor.AsyncMongoMockClient()["schema-test"]
+        await ensure_schema(db)
+        await db.documents.insert_one({"doc_id": "a", "content": ""})
+        with pytest.raises(DuplicateKeyError):
+            await db.documents.insert_one({"doc_id": "a", "content": ""})
+
+    asyncio.run(run())
@@ -0,0 +1,142 @@
+import asyncio
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from collab.search import SearchIndex, parse_query, tokenize
+from collab.store import DocumentStore
+
+def run(coro):
+    return asyncio.run(coro)
+
+def new_index(**kwargs):
+    db = mongomock_motor.AsyncMongoMockClient()["search-test"]
+    index = SearchIndex(**kwargs)
+    index.documents = db.search_documents
+    index.postings = db.search_postings
+    index.terms = db.search_terms
+    return db, index
+
+def test_tokenize_and_parse_query():
+    assert tokenize("The cat and THE other cat.") == {"cat": 2, "other": 1}
+    assert tokenize("b a b c c c", max_terms=2) == {"c": 3, "b": 2}
+    assert parse_query("the quick bro") == [("quick", False), ("bro", True)]
+    assert parse_query("sea* otters") == [("sea", True), ("otters", True)]
+
+def test_ranking_prefixes_and_pages():
+    async def scenario():
+        _, index = new_index()
+        await index.index([
+            ("a", 1, "orange otter swims"),
+            ("b", 1, "orange orange otter"),
+            ("c", 1, "orange juice"),
+            ("d", 1, "otters and orangutans"),
+        ])
+        total, hits = await index.search("orange otter", limit=10)
+        # Both words in a and b; b says orange twice
+        assert total == 2 and [doc_id for doc_id, _ in hits] == ["b", "a"]
+        # "ora" is typed: orange and orangutan both match
+        total, _ = await index.search("ora")
+        assert total == 4
+        total, first = await index.search("ora", limit=3)
+        _, second = await index.search("ora", limit=3, offset=3)
+        assert len(first) == 3 and len(second) == 1
+        assert {doc_id for doc_id, _ in first + second} == {"a", "b", "c", "d"}
+        assert await index.search("the") == (0, [])
+        assert await index.search("zebra otter") == (0, [])
+
+    run(scenario())
+
+def test_prefix_expansion_is_bounded():
+    async def scenario():
+        _, index = new_index(prefix_expansions=3)
+        # More postings of "tab" than fit on a page of the term walk
+        await index.index([(f"d{i}", 1, "tab") for i in range(5)] + [
+            ("e", 1, "tablet tables table tabs"), ("f", 1, "stab")
+        ])
+        assert await index._expand("ta") == ["tab", "table", "tables"]
+        assert await index._expand("tabs") == ["tabs"]
+        assert await index._expand("x") == []
+
+    run(scenario())
+
+def test_reindex_writes_only_changed_postings_and_skips_stale():
+    async def scenario():
+        db, index = new_index()
+        await index.index([("a", 1, "red green blue")])
+        await index.index([("a", 3, "red green green yellow")])
+        assert index.stats["postings_written"] == 3 + 2
+        assert index.stats["postings_deleted"] == 1
+        rows = {row["term"]: row["tf"] async for row in db.search_postings.find({"doc_id": "a"})}
+        assert rows == {"red": 1, "green": 2, "yellow": 1}
+        await index.index([("a", 2, "purple")])
+        assert index.stats["skipped_stale"] == 1
+        assert (await index.search("yellow"))[0] == 1 and (await index.search("purple"))[0] == 0
+
+    run(scenario())
+
+def test_flushed_documents_are_indexed_in_the_background():
+    async def scenario():
+        db, index = new_index(interval_ms=10)
+        await db.documents.insert_one({"doc_id": "old", "content": "saved before search existed", "revision": 4})
+        store = DocumentStore(flush_interval_ms=60000, search=index)
+        await store.start(db.documents)
+        index.start(db.search_documents, db.search_postings, db.search_terms, backfill=store)
+        await asyncio.sleep(0.05)
+        assert index.stats["backfilled"] == 1
+        await store.write("new", "draft one")
+        await store.write("new", "draft two")
+        await store.flush()
+        await asyncio.sleep(0.1)
+        assert [doc_id for doc_id, _ in (await index.search("draft"))[1]] == ["new"]
+        assert (await index.search("two"))[0] == 1 and (await index.search("one"))[0] == 0
+        assert (await index.search("existed"))[1][0][0] == "old"
+        await store.write("new", "final text")
+        await store.stop()
+        await index.stop()
+        assert (await index.search("final"))[0] == 1
+        assert index.metrics()["pending"] == 0
+
+    run(scenario())
+
+def test_document_frequencies_and_bounded_postings_reads():
+    async def scenario():
+        db, index = new_index(max_postings_per_term=5)
+        await index.index([(f"d{i:02d}", 1, "apple " * (i + 1) + ("pear" if i < 3 else "")) for i in range(30)])
+        df = {row["term"]: row["df"] async for row in db.search_terms.find()}
+        assert df == {"apple": 30, "pear": 3}
+        await index.index([("d00", 2, "apple")])
+        assert (await db.search_terms.find_one({"term": "pear"}))["df"] == 2
+        await index.index([("d01", 2, "apple"), ("d02", 2, "apple")])
+        # No document has it any more
+        assert await db.search_terms.find_one({"term": "pear"}) is None
+
+        read = []
+        find = db.search_postings.find
+
+        def counting(*args, **kwargs):
+            cursor = find(*args, **kwargs)
+            to_list = cursor.to_list
+
+            async def listed(length=None):
+                rows = await to_list(length)
+                read.extend(rows)
+                return rows
+
+            cursor.to_list = listed
+            return cursor
+
+        index.postings.find = counting
+        # Only the five postings with the highest tf are read and counted
+        total, hits = await index.search("apple", limit=10)
+        assert total == 5 and [doc_id for doc_id, _ in hits] == ["d29", "d28", "d27", "d26", "d25"]
+        # Prefix expansion reads terms only; postings are the rows with a doc_id
+        assert len([row for row in read if "doc_id" in row]) == 5
+
+        # Counts for an index built before search_terms existed
+        await db.search_terms.drop()
+        assert await index.rebuild_terms() == 1
+        assert (await db.search_terms.find_one({"term": "apple"}))["df"] == 30
+        assert await index.rebuild_terms() == 0
+
+    run(scenario())
@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from collab.ot import TextOperation
+from collab.store import DocumentStore
+
+def run(coro):
+    return asyncio.run(coro)
+
+def new_collection():
+    return mongomock_motor.AsyncMongoMockClient()["store-test"].documents
+
+def test_writes_are_coalesced_into_one_flush():
+    async def scenario():
+        collection = new_collection()
+        store = DocumentStore(flush_interval_ms=60000)
+        await store.start(collection)
+        state = await store.open("a")
+        for i in range(10):
+            state.apply_client_op(state.revision, TextOperation().retain(i).insert("x"))
+            store.changed(state)
+        await store.write("b", "hello")
+        assert await collection.count_documents({}) == 0
+        assert await store.flush() == 2
+        assert await store.flush() == 0
+        saved = await collection.find_one({"doc_id": "a"})
+        assert saved["content"] == "x" * 10 and saved["revision"] == 10
+        metrics = store.metrics()
+        assert metrics["writes_saved"] == 9
+        assert metrics["largest_batch"] == 2
+        await store.stop()
+
+    run(scenario())
+
+def test_stop_flushes_dirty_documents():
+    async def scenario():
+        collection = new_collection()
+        store = DocumentStore(flush_interval_ms=60000)
+        await store.start(collection)
+        await store.write("a", "unsaved")
+        await store.stop()
+        assert (await collection.find_one({"doc_id": "a"}))["content"] == "unsaved"
+
+    run(scenario())
+
+def test_flush_after_max_ops():
+    async def scenario():
+        collection = new_collection()
+        store = DocumentStore(flush_interval_ms=60000, flush_max_ops=3)
+        await store.start(collection)
+        for i in range(3):
+            await store.write("a", str(i))
+        await asyncio.sleep(0.05)
+        assert (await collection.find_one({"doc_id": "a"}))["content"] == "2"
+        await store.stop()
+
+    run(scenario())
+
+def test_eviction_keeps_pinned_and_dirty_documents():
+    async def scenario():
+        collection = new_collection()
+        await collection.insert_many([{"doc_id": f"d{i}", "content": "x"} for i in range(5)])
+        store = DocumentStore(max_documents=2, flush_interval_ms=60000)
+        await store.start(collection)
+        await store.open("d0")
+        await store.write("d1", "dirty")
+        for i in range(2, 5):
+            assert await store.read(f"d{i}") is not None
+        assert store.get("d0") is not None
+        assert store.get("d1") is not None
+        assert await store.read("missing") is None
+        await store.stop()
+
+    run(scenario())
@@ -0,0 +1,133 @@
+import asyncio
+import gzip
+import json
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+httpx = pytest.importorskip("httpx")
+
+from fastapi import FastAPI
+
+from api import routes
+from auth import jwt_handler
+from collab.store import DocumentStore
+from db.dependencies import get_db
+from db.schema import INDEXES, ensure_schema
+from db.transfer import export_lines, import_lines
+
+def run(coro):
+    return asyncio.run(coro)
+
+async def pieces(data, size=7):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+async def started_store(name):
+    db = mongomock_motor.AsyncMongoMockClient()[name]
+    # Duplicate users are caught by the unique index
+    await ensure_schema(db, {"users": INDEXES["users"]})
+    store = DocumentStore(chunk_size=50)
+    await store.start(db.documents, db.document_chunks)
+    return db, store
+
+def test_export_then_import_round_trip():
+    async def scenario():
+        db, store = await started_store("transfer-source")
+        await db.documents.insert_many([
+            {"doc_id": "a", "content": "stored", "revision": 4}, {"doc_id": "b", "content": "two", "revision": 2}
+        ])
+        await db.users.insert_one({"username": "ann", "password": "hash", "email": "ann@example.com"})
+        await store.write("big", "x" * 120)
+        await store.flush()
+        # Cached and dirty: exported as it is in memory
+        await store.write("a", "live")
+        data = b"".join([piece async for piece in export_lines(store, db.users, compress_level=6)])
+        await store.stop()
+        rows = [json.loads(line) for line in gzip.decompress(data).splitlines()]
+        by_id = {row.get("doc_id", row.get("username")): row for row in rows}
+        assert by_id["a"]["content"] == "live" and by_id["a"]["rev"] == 5
+        assert by_id["big"]["content"] == "x" * 120
+        assert by_id["ann"] == {"type": "user", "username": "ann", "password": "hash", "email": "ann@example.com"}
+
+        target, copy = await started_store("transfer-target")
+        report = await import_lines(copy, target.users, pieces(data), batch_size=2, compressed=True)
+        assert (report["documents_inserted"], report["users_inserted"], report["errors"]) == (3, 1, 0)
+        assert (await target.documents.find_one({"doc_id": "b"}))["revision"] == 2
+        # Larger than a chunk: written through the store, in chunks
+        assert await target.document_chunks.count_documents({"doc_id": "big"}) == 3
+        again = await import_lines(copy, target.users, pieces(data), compressed=True)
+        assert (again["documents_skipped"], again["users_skipped"]) == (3, 1)
+
+        replaced = []
+
+        async def on_replace(state):
+            replaced.append(state.doc_id)
+
+        line = json.dumps({"type": "document", "doc_id": "b", "content": "new"}).encode()
+        report = await import_lines(copy, target.users, pieces(line), replace=True, on_replace=on_replace)
+        assert report["documents_replaced"] == 1 and replaced == ["b"]
+        assert copy.get("b").content == "new" and copy.get("b").revision == 3
+        await copy.stop()
+
+    run(scenario())
+
+def test_bad_lines_are_reported_and_skipped():
+    async def scenario():
+        db, store = await started_store("transfer-errors")
+        data = b"\n".join([
+            b'{"type": "document", "doc_id": "ok", "content": "fine"}',
+            b"not json",
+            b'{"type": "user", "username": "u"}',
+            b'{"type": "document", "doc_id": "x", "rev": -1}',
+            b"",
+            b'["type", "document"]',
+        ])
+        report = await import_lines(store, db.users, pieces(data))
+        assert report["documents_inserted"] == 1 and report["errors"] == 4
+        assert [error["line"] for error in report["error_lines"]] == [2, 3, 4, 6]
+        await store.stop()
+
+    run(scenario())
+
+def test_admin_endpoints(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient()["transfer-api-test"]
+    store = routes.live_documents
+    monkeypatch.setattr(store, "journal", None)
+    monkeypatch.setattr(jwt_handler, "ADMIN_USERNAMES", {"root"})
+    store.history.start(db.document_ops, db.document_snapshots)
+    app = FastAPI()
+    app.include_router(routes.router, prefix="/api")
+    app.dependency_overrides[get_db] = lambda: db
+    admin = {"Authorization": "Bearer " + jwt_handler.create_access_token({"sub": "root"})}
+    other = {"Authorization": "Bearer " + jwt_handler.create_access_token({"sub": "ann"})}
+
+    async def scenario():
+        await store.start(db.documents)
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                assert (await client.get("/api/admin/export")).status_code == 401
+                assert (await client.get("/api/admin/export", headers=other)).status_code == 403
+                body = gzip.compress(b"".join(
+                    json.dumps({"type": "document", "doc_id": f"d{i}", "content": f"text {i}"}).encode() + b"\n"
+                    for i in range(5)
+                ))
+                response = await client.post(
+                    "/api/admin/import?batch_size=2", content=body,
+                    headers={**admin, "Content-Encoding": "gzip"}
+                )
+                assert response.status_code == 200 and response.json()["documents_inserted"] == 5
+                response = await client.post("/api/admin/import", content=b"\x1f\x8bjunk",
+                                             headers={**admin, "Content-Encoding": "gzip"})
+                assert response.status_code == 400
+                response = await client.get("/api/admin/export?kinds=documents&gzip=true", headers=admin)
+                assert response.headers["content-encoding"] == "gzip"
+                assert sorted(json.loads(line)["doc_id"] for line in response.text.splitlines()) == [
+                    f"d{i}" for i in range(5)
+                ]
+                assert (await client.get("/api/admin/export?kinds=secrets", headers=admin)).status_code == 422
+        finally:
+            await store.stop()
+            store._states.clear()
+
+    run(scenario())
@@ -0,0 +1,91 @@
+"""Export or import documents and users as NDJSON, straight against MongoDB.
+
+    python transfer.py export [--kinds documents,users] [--batch-size N] [FILE]
+    python transfer.py import [--replace] [--batch-size N] [FILE]
+
+FILE defaults to stdout / stdin; a name ending in .gz is gzip compressed.
+The format is the one GET /api/admin/export and POST /api/admin/import use
+(see db.transfer). This talks to the database directly, for migrations and
+backups with the server stopped: a running server does not see documents
+replaced underneath it, so use the endpoints against a live one.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from config import (
+    DOC_CHUNK_SIZE, DOC_UPLOAD_MAX_BYTES, HISTORY_KEEP_OP_SNAPSHOTS, HISTORY_SNAPSHOT_EVERY_BYTES,
+    HISTORY_SNAPSHOT_EVERY_OPS, HTTP_GZIP_LEVEL, MONGO_DB_NAME, TRANSFER_BATCH_SIZE
+)
+from collab.history import HistoryStore
+from collab.store import DocumentStore
+from db.mongo import close_mongo, connect_mongo
+from db.schema import ensure_schema
+from db.transfer import EXPORT_KINDS, TransferError, export_lines, import_lines
+
+# Bytes read from the input per piece
+READ_BYTES = 1024 * 1024
+
+async def _read(stream):
+    while True:
+        piece = await asyncio.to_thread(stream.read, READ_BYTES)
+        if not piece:
+            return
+        yield piece
+
+async def main(args) -> int:
+    client = await connect_mongo(health_interval=0)
+    db = client[MONGO_DB_NAME]
+    await ensure_schema(db)
+    # No journal and no search index: the server backfills the index at startup
+    store = DocumentStore(chunk_size=DOC_CHUNK_SIZE, history=HistoryStore(
+        snapshot_every_ops=HISTORY_SNAPSHOT_EVERY_OPS,
+        snapshot_every_bytes=HISTORY_SNAPSHOT_EVERY_BYTES,
+        keep_op_snapshots=HISTORY_KEEP_OP_SNAPSHOTS,
+        chunk_size=DOC_CHUNK_SIZE
+    ))
+    store.history.start(db.document_ops, db.document_snapshots, db.history_chunks)
+    await store.start(db.documents, db.document_chunks)
+    compressed = bool(args.file) and args.file.endswith(".gz")
+    try:
+        if args.command == "export":
+            kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+            out = open(args.file, "wb") if args.file else sys.stdout.buffer
+            try:
+                async for piece in export_lines(store, db.users, kinds, args.batch_size,
+                                                HTTP_GZIP_LEVEL if compressed else None):
+                    out.write(piece)
+            finally:
+                if args.file:
+                    out.close()
+        else:
+            source = open(args.file, "rb") if args.file else sys.stdin.buffer
+            try:
+                report = await import_lines(store, db.users, _read(source), args.batch_size, args.replace,
+                                            compressed=compressed, max_line_bytes=DOC_UPLOAD_MAX_BYTES)
+            except TransferError as e:
+                print(f"Import stopped: {e}", file=sys.stderr)
+                return 1
+            finally:
+                if args.file:
+                    source.close()
+            print(json.dumps(report, indent=2), file=sys.stderr)
+            return 1 if report["errors"] else 0
+    finally:
+        await store.stop()
+        await close_mongo()
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk export/import of documents and users as NDJSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export")
+    export.add_argument("--kinds", default=",".join(EXPORT_KINDS))
+    export.add_argument("--batch-size", type=int, default=TRANSFER_BATCH_SIZE)
+    export.add_argument("file", nargs="?")
+    load = commands.add_parser("import")
+    load.add_argument("--replace", action="store_true", help="overwrite existing documents and users")
+    load.add_argument("--batch-size", type=int, default=TRANSFER_BATCH_SIZE)
+    load.add_argument("file", nargs="?")
+    sys.exit(asyncio.run(main(parser.parse_args())))